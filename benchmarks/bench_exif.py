@@ -0,0 +1,66 @@
+# coding=utf-8
+"""Time per image of geotagging by re-saving with PIL and by rewriting the Exif segment.
+
+A camera-sized JPEG with an Exif segment is generated, copied for every
+run and geotagged either the way geotag_photos used to (decode with PIL,
+save with the new Exif) or with strabo_exif.geotag.
+
+    python benchmarks/bench_exif.py [images] [width] [height]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+import numpy
+import piexif
+from PIL import Image
+
+from strabo_exif import geotag, gps_exif
+
+
+def pil_geotag(path, longitude, latitude):
+    # geotag_photos before strabo_exif: the whole image is decoded and encoded again
+    image = Image.open(path)
+    exif = image.info['exif']
+    image.save(path, 'jpeg', exif=gps_exif(exif, longitude, latitude))
+
+
+def run(tag, source, folder, count):
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, '%d.jpeg' % i)
+        shutil.copyfile(source, path)
+        paths.append(path)
+    start = time.time()
+    for path in paths:
+        tag(path, -97.5, 38.9)
+    return (time.time() - start) / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 4000
+    height = int(sys.argv[3]) if len(sys.argv) > 3 else 3000
+    folder = tempfile.mkdtemp()
+    try:
+        source = os.path.join(folder, 'source.jpeg')
+        pixels = numpy.random.RandomState(0).randint(0, 256, (height, width, 3)).astype(numpy.uint8)
+        exif = piexif.dump({'0th': {piexif.ImageIFD.Make: b'Camera'}, 'Exif': {}, 'GPS': {}, '1st': {},
+                            'thumbnail': None})
+        Image.fromarray(pixels).save(source, 'jpeg', quality=90, exif=exif)
+        print('%d images of %dx%d, %.1f MB each' % (count, width, height, os.path.getsize(source) / 1048576.0))
+        piltime = run(pil_geotag, source, folder, count)
+        print('PIL re-save:     %8.1f ms per image' % (piltime * 1000))
+        exiftime = run(geotag, source, folder, count)
+        print('Exif segment:    %8.1f ms per image  (%.0fx faster)' % (exiftime * 1000, piltime / exiftime))
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# coding=utf-8
+"""Spots/second of the table-driven flattener against the old per-type blocks.
+
+The legacy function below is the loop importSpots used to run, bugs and all,
+so the two are timed doing the same amount of copying.
+
+    python benchmarks/bench_flatten.py [spots]
+"""
+import multiprocessing
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+from strabo_flatten import SpotFlattener, flatten_spots
+
+
+def make_spots(count):
+    spots = []
+    for i in range(count):
+        spots.append({'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [-97.5, 38.9]},
+                      'properties': {
+                          'id': i, 'modified_timestamp': 1500000000000, 'time': '', 'date': '', 'self': '',
+                          'orientation_data': [{'strike': 10, 'dip': 20, 'type': 'planar_orientation'}] * 3,
+                          'rock_unit': {'unit_label_abbreviation': 'Kd', 'description': 'Dakota'},
+                          'samples': [{'label': 's1', 'sample_description': 'x'}],
+                          'images': [{'id': i, 'self': 'https://strabospot.org/db/image/%d' % i}]}})
+    return spots
+
+
+def make_tags(count):
+    return [{'id': t, 'name': 'tag %d' % t, 'spots': list(range(t, count, 50))} for t in range(50)]
+
+
+def legacy(spots, prj_tags):
+    tag_spotids = []
+    for tag in prj_tags:
+        tag_spotids.extend(tag.get('spots', []))
+    out = []
+    for spot in spots:
+        spotgeometry = spot['geometry']
+        spotprop = spot['properties']
+        spotID = spotprop['id']
+        out.append({'type': 'Feature', 'geometry': spotgeometry,
+                    'properties': {'id': spotID, 'modified_timestamp': spotprop['modified_timestamp'],
+                                   'time': spotprop['time'], 'date': spotprop['date'], 'self': spotprop['self']}})
+        if spotID in tag_spotids:
+            for tag in prj_tags:
+                if spotID in tag.get('spots', []):
+                    out.append({'type': 'Feature', 'geometry': spotgeometry,
+                                'properties': dict(('tag_' + k, v) for k, v in tag.items() if k != 'spots')})
+        for key, suffix, many in (('orientation_data', '_orientation_data', True), ('rock_unit', '_rock_unit', False),
+                                  ('samples', '_samples', True), ('images', '_images', True)):
+            if key in spotprop:
+                records = spotprop[key] if many else [spotprop[key]]
+                for record in records:
+                    properties = {}
+                    for k in record:
+                        k = k + suffix
+                        properties[k] = record.get(k)
+                    properties['SpotID'] = spotID
+                    out.append({'type': 'Feature', 'geometry': spotgeometry, 'properties': properties})
+    return out
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    spots = make_spots(count)
+    tags = make_tags(count)
+
+    start = time.time()
+    SpotFlattener(tags)
+    print('tag index:         %10.3f s for %d tags' % (time.time() - start, len(tags)))
+
+    start = time.time()
+    legacy(spots, tags)
+    old = count / (time.time() - start)
+    print('per-type blocks:   %10.0f spots/s' % old)
+
+    start = time.time()
+    SpotFlattener(tags).flatten_all(spots)
+    new = count / (time.time() - start)
+    print('SpotFlattener:     %10.0f spots/s  (x%.1f)' % (new, new / old))
+
+    processes = max(2, multiprocessing.cpu_count())
+    start = time.time()
+    for result in flatten_spots(SpotFlattener(tags), spots, processes=processes, threshold=0):
+        pass
+    pooled = count / (time.time() - start)
+    print('%2d processes:      %10.0f spots/s  (x%.1f)' % (processes, pooled, pooled / old))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+# coding=utf-8
+"""Memory and speed of flattened features as GeoJSON dicts and as __slots__ records.
+
+The same spots are flattened and every feature kept, once converted to
+GeoJSON dicts the way the flattener used to build them and once as the
+records it makes now.  Memory is measured with tracemalloc (Python 3).
+
+    python benchmarks/bench_records.py [spots]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+from strabo_flatten import SpotFlattener
+
+
+def make_spots(count):
+    spots = []
+    for i in range(count):
+        spots.append({'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [-97.5, 38.9]},
+                      'properties': {
+                          'id': i, 'modified_timestamp': 1500000000000, 'time': '', 'date': '', 'self': '',
+                          'orientation_data': [{'strike': 10, 'dip': 20, 'type': 'planar_orientation'}] * 5,
+                          'samples': [{'label': 's1', 'sample_description': 'x'}],
+                          'images': [{'id': i, 'self': 'https://strabospot.org/db/image/%d' % i}]}})
+    return spots
+
+
+def measure(spots, convert):
+    flattener = SpotFlattener()
+    tracemalloc.start()
+    start = time.time()
+    features = []
+    for spot in spots:
+        for kind, record, feature in flattener.flatten(spot):
+            features.append(feature.to_geojson() if convert else feature)
+    elapsed = time.time() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(features), current, elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    spots = make_spots(count)
+    mb = 1024.0 * 1024.0
+    features, dictmemory, dicttime = measure(spots, True)
+    print('%d features' % features)
+    print('GeoJSON dicts:  %8.1f MB  %6.2f s' % (dictmemory / mb, dicttime))
+    features, recordmemory, recordtime = measure(spots, False)
+    print('slots records:  %8.1f MB  %6.2f s  (%.1fx less memory, %.1fx faster)'
+          % (recordmemory / mb, recordtime, float(dictmemory) / recordmemory, dicttime / recordtime))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# coding=utf-8
+"""Peak memory of flattened layers held as lists of dicts and as FeatureTables.
+
+Spots are generated as parsed JSON, flattened into layers of either kind
+and the peak Python allocation measured with tracemalloc (Python 3).
+
+    python benchmarks/bench_table.py [spots]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+from strabo_flatten import SpotFlattener
+from strabo_table import FeatureTable
+
+
+def make_spot(i):
+    # A fresh parsed-JSON spot, geometries are not shared between spots
+    return {'type': 'Feature',
+            'geometry': {'type': 'Polygon', 'coordinates': [[[-97.5 + i * 1e-5, 38.9], [-97.4, 38.8],
+                                                             [-97.3, 38.9], [-97.5 + i * 1e-5, 38.9]]]},
+            'properties': {
+                'id': 15000000000000 + i, 'modified_timestamp': 1500000000000 + i,
+                'time': '2017-06-15T10:00:00Z', 'date': '2017-06-15T10:00:00Z',
+                'self': 'https://strabospot.org/db/feature/%d' % (15000000000000 + i),
+                'orientation_data': [{'strike': (i * 7 + j) % 360, 'dip': (i + j) % 90,
+                                      'type': 'planar_orientation', 'feature_type': 'bedding'} for j in range(5)],
+                'samples': [{'label': 'S%d' % i, 'sample_description': 'hand sample', 'oriented_sample': 'no'}]}}
+
+
+def measure(factory, count):
+    flattener = SpotFlattener()
+    tracemalloc.start()
+    start = time.time()
+    layers = flattener.new_layers(factory)
+    for i in range(count):
+        for kind, record, feature in flattener.flatten(make_spot(i)):
+            # Lists hold GeoJSON dicts, as importSpots did before FeatureTable
+            layers[kind].append(feature.to_geojson() if factory is list else feature)
+    elapsed = time.time() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    mb = 1024.0 * 1024.0
+    listpeak, listtime = measure(list, count)
+    print('lists of dicts: %8.1f MB peak  %6.2f s' % (listpeak / mb, listtime))
+    tablepeak, tabletime = measure(FeatureTable, count)
+    print('FeatureTable:   %8.1f MB peak  %6.2f s  (%.1fx less memory)'
+          % (tablepeak / mb, tabletime, float(listpeak) / tablepeak))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+# coding=utf-8
+"""Requests/second of the transfer engine against the old sequential GETs.
+
+Runs against a local stand-in server that adds a fixed latency to every
+response, roughly what a field-office link to strabospot.org looks like.
+
+    python benchmarks/bench_transfer.py [requests] [latency ms]
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'test'))
+
+from strabo_client import StraboClient
+from strabo_transfer import TransferEngine
+from utilities import StraboTestServer
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = float(sys.argv[2]) / 1000.0 if len(sys.argv) > 2 else 0.05
+    body = b'{"type": "FeatureCollection", "features": []}'
+
+    def spots(handler):
+        time.sleep(latency)
+        return 200, body
+
+    paths = ['/db/datasetspotsarc/%d' % i for i in range(count)]
+    server = StraboTestServer(dict((path, spots) for path in paths))
+    try:
+        client = StraboClient(base_url=server.url)
+        start = time.time()
+        for path in paths:
+            client.get(path).content
+        sequential = count / (time.time() - start)
+        print('sequential GETs:        %8.1f requests/s' % sequential)
+
+        for in_flight in (8, 16, 32):
+            engine = TransferEngine(client, max_in_flight=in_flight)
+            start = time.time()
+            for key, r in engine.fetch_all([(path, path) for path in paths]):
+                r.content
+            rate = count / (time.time() - start)
+            engine.close()
+            print('engine, %2d in flight:   %8.1f requests/s (%.1fx)' % (in_flight, rate, rate / sequential))
+        client.close()
+    finally:
+        server.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,473 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ StraboSpot response cache
+                                 A QGIS plugin
+ Download and Upload Strabo data to and from QGIS.
+                             -------------------
+        begin                : 2017-06-15
+        git sha              : $Format:%H$
+        copyright            : (C) 2017 by Emily Bunse - University of Kansas
+        email                : egbunse@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+ Persistent on-disk cache of StraboSpot GET responses, keyed by URL and
+ user.  Entries are revalidated with ETag/If-Modified-Since, or skip the
+ round trip altogether when the caller knows the version (e.g. the
+ project's modified_timestamp) has not changed.
+
+ ListingCache keeps the user's project list and every project's dataset
+ list in memory, fetched in the background right after login.
+
+ ImageStore keeps every downloaded image, keyed by StraboSpot image id and
+ stored once per content hash, so a later download of the same image (in
+ any project or folder) is hardlinked or copied from it instead of fetched
+ again.  The least recently used images are evicted past a size cap.
+"""
+import errno
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# Response headers kept with a cached body
+KEPT_HEADERS = ['Content-Type', 'ETag', 'Last-Modified']
+# Size cap of the image store by default, in bytes
+DEFAULT_IMAGE_STORE_SIZE = 1024 * 1024 * 1024
+# Bytes hashed at a time
+HASH_CHUNK_SIZE = 64 * 1024
+# Seconds the plug-in waits on a running prefetch before fetching a listing itself
+PREFETCH_WAIT = 5
+# Seconds between checks for a listing while waiting on the prefetch
+POLL_INTERVAL = 0.05
+
+
+def replace_file(source, path):
+    """Rename source over path, so readers of path see either the old or the new file."""
+    if hasattr(os, 'replace'):
+        os.replace(source, path)
+        return
+    try:
+        os.rename(source, path)
+    except OSError:
+        # Python 2 on Windows does not rename over an existing file
+        os.remove(path)
+        os.rename(source, path)
+
+
+class CachingReader(object):
+    """Wraps a response's raw stream, copying the body into the cache as it is read.
+
+    The entry only becomes visible once the whole body has been read, so an
+    interrupted download never leaves a partial payload in the cache.
+    """
+
+    def __init__(self, raw, cache, key, meta):
+        self.raw = raw
+        self.cache = cache
+        self.key = key
+        self.meta = meta
+        # Each reader has its own part file, several GETs of the same URL may overlap
+        handle, self.partpath = tempfile.mkstemp(prefix=key + '.', suffix='.part', dir=cache.folder)
+        self.partfile = os.fdopen(handle, 'wb')
+
+    def read(self, amt=None):
+        data = self.raw.read(amt, decode_content=True)
+        if self.partfile is not None:
+            if data:
+                self.partfile.write(data)
+            else:
+                self.partfile.close()
+                self.partfile = None
+                self.cache.commit(self.key, self.meta, self.partpath)
+        return data
+
+    def tell(self):
+        return self.raw.tell()
+
+    def close(self):
+        if self.partfile is not None:
+            # Closed before the end of the body, throw the partial copy away
+            self.partfile.close()
+            self.partfile = None
+            os.remove(self.partpath)
+        self.raw.close()
+
+    def release_conn(self):
+        release = getattr(self.raw, 'release_conn', None)
+        if release is not None:
+            release()
+
+
+class ResponseCache(object):
+    """On-disk store of response bodies plus the validators needed to revalidate them."""
+
+    def __init__(self, folder):
+        """Constructor.
+
+        :param folder: Folder holding the cache, created if missing.
+        :type folder: str
+        """
+        self.folder = folder
+        try:
+            os.makedirs(folder)
+        except OSError as exception:
+            if exception.errno != errno.EEXIST:
+                raise
+
+    def key(self, url, user):
+        text = (user or '') + ' ' + url
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def body_path(self, key):
+        return os.path.join(self.folder, key + '.body')
+
+    def meta_path(self, key):
+        return os.path.join(self.folder, key + '.json')
+
+    def lookup(self, url, user):
+        """Return the metadata of the cached entry, None if there isn't one."""
+        key = self.key(url, user)
+        if not os.path.exists(self.body_path(key)):
+            return None
+        try:
+            with open(self.meta_path(key)) as metafile:
+                return json.load(metafile)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def validators(self, entry):
+        """Conditional request headers for a cached entry."""
+        headers = {}
+        if entry is None:
+            return headers
+        cached = entry.get('headers', {})
+        if cached.get('ETag'):
+            headers['If-None-Match'] = cached['ETag']
+        if cached.get('Last-Modified'):
+            headers['If-Modified-Since'] = cached['Last-Modified']
+        return headers
+
+    def capture(self, url, user, response, version=None):
+        """Have response's body saved to the cache as the caller reads it."""
+        key = self.key(url, user)
+        headers = dict((name, response.headers[name]) for name in KEPT_HEADERS if name in response.headers)
+        meta = {'url': url, 'version': version, 'encoding': response.encoding, 'headers': headers}
+        response.raw = CachingReader(response.raw, self, key, meta)
+        return response
+
+    def commit(self, key, meta, partpath):
+        """Move a completely read body into place and write its metadata.
+
+        When another reader of the same URL gets there first its copy is
+        kept and this one is thrown away.
+        """
+        body = self.body_path(key)
+        handle, metapart = tempfile.mkstemp(prefix=key + '.', suffix='.part', dir=self.folder)
+        with os.fdopen(handle, 'w') as metafile:
+            json.dump(meta, metafile)
+        try:
+            replace_file(partpath, body)
+            replace_file(metapart, self.meta_path(key))
+        except OSError:
+            for part in (partpath, metapart):
+                if os.path.exists(part):
+                    os.remove(part)
+
+    def response(self, url, user):
+        """Build a response serving the cached body straight from disk, None if it is gone."""
+        key = self.key(url, user)
+        entry = self.lookup(url, user)
+        if entry is None:
+            return None
+        try:
+            raw = open(self.body_path(key), 'rb')
+        except (IOError, OSError):
+            return None
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.url = url
+        response.headers = CaseInsensitiveDict(entry.get('headers', {}))
+        response.encoding = entry.get('encoding')
+        response.raw = raw
+        response.from_cache = True
+        return response
+
+    def remove(self, url, user):
+        key = self.key(url, user)
+        for path in (self.body_path(key), self.meta_path(key)):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class ListingCache(object):
+    """In-memory project and dataset listings, prefetched on a background thread."""
+
+    def __init__(self, client):
+        """Constructor.
+
+        :param client: The plug-in's StraboSpot client, already logged in when
+            prefetch is called.
+        :type client: strabo_client.StraboClient
+        """
+        self.client = client
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.finished.set()
+        self.generation = 0
+        self._projects = None
+        self._datasets = {}
+        self.error = None
+
+    def prefetch(self):
+        """Start fetching myProjects and every project's datasets in the background."""
+        self.clear()
+        self.finished.clear()
+        worker = threading.Thread(target=self._prefetch, args=(self.generation,))
+        worker.daemon = True
+        worker.start()
+
+    def _prefetch(self, generation):
+        try:
+            r = self.client.get('db/myProjects', cache=True)
+            if r.status_code != 200:
+                r.close()
+                return
+            projects = r.json()['projects']
+            self.set_projects(projects, generation)
+            jobs = [(prj['id'], 'db/projectDatasets/' + str(prj['id']), {'cache': True}) for prj in projects]
+            for projectid, r in self.client.fetch_all(jobs):
+                if r.status_code == 200:
+                    self.set_datasets(projectid, r.json()['datasets'], generation)
+                else:
+                    r.close()
+        except Exception as error:
+            # Anything missing is simply fetched when the user asks for it
+            self.error = error
+        finally:
+            if generation == self.generation:
+                self.finished.set()
+
+    def wait(self, timeout=None):
+        """Block until the prefetch is done, returns False on timeout."""
+        return self.finished.wait(timeout)
+
+    def wait_for(self, listing, timeout, process_events=None, poll_interval=POLL_INTERVAL):
+        """Wait for one listing while the prefetch is running, calling process_events meanwhile.
+
+        :param listing: Returns the listing, None while it isn't in yet, e.g.
+            the projects method.
+        :type listing: function
+
+        :returns: The listing, None if the prefetch finished or timeout
+            seconds passed without it.
+        """
+        deadline = time.time() + timeout
+        while listing() is None and not self.finished.is_set() and time.time() < deadline:
+            self.finished.wait(poll_interval)
+            if process_events is not None:
+                process_events()
+        return listing()
+
+    def clear(self):
+        """Forget everything (e.g. on logout), a prefetch still running is ignored."""
+        with self.lock:
+            self.generation += 1
+            self._projects = None
+            self._datasets = {}
+            self.finished.set()
+
+    def set_projects(self, projects, generation=None):
+        with self.lock:
+            if generation is None or generation == self.generation:
+                self._projects = projects
+
+    def set_datasets(self, projectid, datasets, generation=None):
+        with self.lock:
+            if generation is None or generation == self.generation:
+                self._datasets[projectid] = datasets
+
+    def projects(self):
+        """The user's projects, None if they have not been fetched yet."""
+        with self.lock:
+            return self._projects
+
+    def datasets(self, projectid):
+        """A project's datasets, None if they have not been fetched yet."""
+        with self.lock:
+            return self._datasets.get(projectid)
+
+
+def file_hash(path, algorithm='sha1'):
+    """Hex digest of a file's content."""
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def place(source, path, link=True):
+    """Put a copy of source at path, as a hardlink when link is set and the file system allows it."""
+    partfile = path + '.part'
+    if os.path.exists(partfile):
+        os.remove(partfile)
+    linked = False
+    if link and hasattr(os, 'link'):
+        try:
+            os.link(source, partfile)
+            linked = True
+        except OSError:
+            # Another drive, or a file system without hardlinks
+            pass
+    if not linked:
+        shutil.copyfile(source, partfile)
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(partfile, path)
+
+
+class ImageStore(object):
+    """Downloaded images kept on disk, keyed by image id and stored once per content hash.
+
+    Safe to use from the image pool's worker threads.  A hardlinked copy
+    shares its content with the store, so it must be replaced (written
+    elsewhere and renamed) rather than modified in place.
+    """
+
+    def __init__(self, folder, max_bytes=DEFAULT_IMAGE_STORE_SIZE, clock=time.time):
+        """Constructor.
+
+        :param folder: Folder holding the store, created if missing.
+        :type folder: str
+
+        :param max_bytes: Size the stored images are kept under, the least
+            recently used are removed past it.
+        :type max_bytes: int
+        """
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.lock = threading.Lock()
+        try:
+            os.makedirs(os.path.join(folder, 'objects'))
+        except OSError as exception:
+            if exception.errno != errno.EEXIST:
+                raise
+        # image id -> content hash, and content hash -> {'size', 'used'}
+        self.ids = {}
+        self.objects = {}
+        try:
+            with open(self.index_path()) as indexfile:
+                index = json.load(indexfile)
+            self.ids = index.get('ids', {})
+            self.objects = index.get('objects', {})
+        except (IOError, OSError, ValueError):
+            pass
+        self.size = sum(entry['size'] for entry in self.objects.values())
+        self._prune()
+
+    def _prune(self):
+        # Objects put after the index was last saved (the import failed or QGIS exited first) are
+        # not in it, so they would never count towards the size cap or be evicted
+        folder = os.path.join(self.folder, 'objects')
+        for name in os.listdir(folder):
+            if name not in self.objects:
+                os.remove(os.path.join(folder, name))
+        for digest in [digest for digest in self.objects if not os.path.exists(self.object_path(digest))]:
+            self._forget(digest)
+
+    def index_path(self):
+        return os.path.join(self.folder, 'index.json')
+
+    def object_path(self, digest):
+        return os.path.join(self.folder, 'objects', digest)
+
+    def lookup(self, imageid):
+        """Path of the stored image with this id, None if it isn't stored."""
+        with self.lock:
+            digest = self.ids.get(str(imageid))
+            if digest is None:
+                return None
+            stored = self.object_path(digest)
+            if not os.path.exists(stored) or os.path.getsize(stored) != self.objects[digest]['size']:
+                # Removed or damaged outside the store
+                self._forget(digest)
+                return None
+            self.objects[digest]['used'] = self.clock()
+            return stored
+
+    def get(self, imageid, path, link=True):
+        """Place the stored image with this id at path.
+
+        :returns: True if it was stored, otherwise False and path is untouched.
+        :rtype: bool
+        """
+        stored = self.lookup(imageid)
+        if stored is None:
+            return False
+        try:
+            place(stored, path, link)
+        except (IOError, OSError):
+            # Evicted by another thread meanwhile
+            return False
+        return True
+
+    def put(self, imageid, path, link=True):
+        """Add the image at path under this id, evicting old images past the size cap."""
+        digest = file_hash(path)
+        size = os.path.getsize(path)
+        with self.lock:
+            if digest not in self.objects:
+                place(path, self.object_path(digest), link)
+                self.objects[digest] = {'size': size, 'used': self.clock()}
+                self.size += size
+            else:
+                self.objects[digest]['used'] = self.clock()
+            self.ids[str(imageid)] = digest
+            self._evict(keep=digest)
+        return digest
+
+    def _evict(self, keep=None):
+        oldest = sorted(self.objects, key=lambda digest: self.objects[digest]['used'])
+        for digest in oldest:
+            if self.size <= self.max_bytes:
+                break
+            if digest != keep:
+                self._forget(digest)
+
+    def _forget(self, digest):
+        entry = self.objects.pop(digest, None)
+        if entry is not None:
+            self.size -= entry['size']
+        for imageid in [imageid for imageid, stored in self.ids.items() if stored == digest]:
+            del self.ids[imageid]
+        stored = self.object_path(digest)
+        if os.path.exists(stored):
+            os.remove(stored)
+
+    def save(self):
+        """Write the index, the images added since the store was opened are lost without it."""
+        with self.lock:
+            index = {'ids': self.ids, 'objects': self.objects}
+            with open(self.index_path() + '.part', 'w') as indexfile:
+                json.dump(index, indexfile)
+            if os.path.exists(self.index_path()):
+                os.remove(self.index_path())
+            os.rename(self.index_path() + '.part', self.index_path())
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ StraboClient
+                                 A QGIS plugin
+ Download and Upload Strabo data to and from QGIS.
+                             -------------------
+        begin                : 2017-06-15
+        git sha              : $Format:%H$
+        copyright            : (C) 2017 by Emily Bunse - University of Kansas
+        email                : egbunse@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+ REST client used by every StraboSpot call in the plug-in.
+
+ A single requests.Session is kept for the life of the plug-in so that the
+ TCP+TLS connection to strabospot.org is reused between calls instead of
+ being opened again for every GET/POST.  Auth, headers and timeouts all
+ live here, as does the optional on-disk response cache.
+
+ Every request also passes through a ConcurrencyController which adapts
+ how many requests may be in flight to the latency StraboSpot shows and
+ backs off on 429/503 responses, honouring Retry-After.
+"""
+import threading
+import time
+from email.utils import mktime_tz, parsedate_tz
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+
+from strabo_transfer import TransferEngine
+
+STRABO_URL = 'https://strabospot.org'
+# Number of keep-alive connections held open per host
+DEFAULT_POOL_SIZE = 10
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (15, 120)
+# Requests allowed in flight to begin with and at most
+INITIAL_LIMIT = 4
+MAX_LIMIT = 32
+# Responses telling us to slow down
+THROTTLE_STATUSES = (429, 503)
+# Seconds of completed requests used for the throughput figure
+THROUGHPUT_WINDOW = 10.0
+# Longest pause a Retry-After is allowed to cause, in seconds
+MAX_RETRY_AFTER = 60.0
+
+
+def parse_retry_after(value, now=None):
+    """Seconds to wait from a Retry-After header (delay-seconds or an HTTP-date), None if unusable.
+
+    The delay is capped at MAX_RETRY_AFTER and a date already past gives 0.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return min(float(value), MAX_RETRY_AFTER)
+    try:
+        parsed = parsedate_tz(value)
+        if parsed is None:
+            return None
+        when = mktime_tz(parsed)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    if now is None:
+        now = time.time()
+    return min(max(0.0, when - now), MAX_RETRY_AFTER)
+
+
+def on_main_thread():
+    """Whether the caller is the main (in QGIS the GUI) thread."""
+    return threading.current_thread().name == 'MainThread'
+
+
+class ConcurrencyController(object):
+    """Adaptive limit on the number of StraboSpot requests in flight.
+
+    The limit grows by about one request per round trip while latency stays
+    close to the best seen, eases off when latency climbs, and is halved on
+    429/503 responses or connection errors.  A Retry-After on those responses
+    holds back new requests until it has passed.
+    """
+
+    def __init__(self, initial=INITIAL_LIMIT, minimum=1, maximum=MAX_LIMIT,
+                 latency_tolerance=2.0, clock=time.time):
+        """Constructor.
+
+        :param latency_tolerance: How many times the best latency seen a
+            response may take before the limit is reduced.
+        :type latency_tolerance: float
+
+        :param clock: Time source, swapped out by the tests.
+        :type clock: function
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.latency_tolerance = latency_tolerance
+        self.clock = clock
+        self.in_flight = 0
+        self.best_latency = None
+        self.latency = None
+        self.paused_until = 0.0
+        self.throttled = 0
+        self.completions = []
+        self.condition = threading.Condition()
+
+    def acquire(self, pause=True):
+        """Block until another request may start.
+
+        :param pause: False to not wait out a Retry-After pause, for requests
+            made on the GUI thread which must not freeze QGIS.
+        :type pause: bool
+        """
+        with self.condition:
+            while True:
+                wait = self.paused_until - self.clock() if pause else 0
+                if wait > 0:
+                    self.condition.wait(wait)
+                elif self.in_flight >= int(self.limit):
+                    self.condition.wait()
+                else:
+                    break
+            self.in_flight += 1
+
+    def release(self, latency=None, status=None, retry_after=None):
+        """Record the outcome of a request started with acquire.
+
+        :param latency: Seconds until the response arrived, None if the
+            request failed without a response.
+        :param status: HTTP status code of the response.
+        :param retry_after: The response's Retry-After header, if any.
+        """
+        with self.condition:
+            self.in_flight -= 1
+            now = self.clock()
+            if latency is None or status in THROTTLE_STATUSES:
+                self.limit = max(self.minimum, self.limit / 2.0)
+                if status in THROTTLE_STATUSES:
+                    self.throttled += 1
+                    delay = parse_retry_after(retry_after, now)
+                    if delay:
+                        self.paused_until = max(self.paused_until, now + delay)
+            else:
+                self.completions.append(now)
+                self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+                if self.best_latency is None or latency < self.best_latency:
+                    self.best_latency = latency
+                if latency <= self.best_latency * self.latency_tolerance:
+                    self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+                else:
+                    self.limit = max(self.minimum, self.limit * 0.9)
+            self.condition.notify_all()
+
+    def throughput(self):
+        """Completed requests per second over the last THROUGHPUT_WINDOW seconds."""
+        with self.condition:
+            cutoff = self.clock() - THROUGHPUT_WINDOW
+            self.completions = [done for done in self.completions if done >= cutoff]
+            return len(self.completions) / THROUGHPUT_WINDOW
+
+    def stats(self):
+        """Current state for diagnostics."""
+        return {'limit': int(self.limit), 'in_flight': self.in_flight,
+                'latency': self.latency, 'best_latency': self.best_latency,
+                'throughput': self.throughput(), 'throttled': self.throttled,
+                'paused': max(0.0, self.paused_until - self.clock())}
+
+    def summary(self):
+        stats = self.stats()
+        return "%d requests in flight allowed, %.1f requests/s, %d throttled responses" % (
+            stats['limit'], stats['throughput'], stats['throttled'])
+
+
+class StraboClient(object):
+    """Pooled, keep-alive session for the StraboSpot REST API."""
+
+    def __init__(self, base_url=STRABO_URL, pool_size=DEFAULT_POOL_SIZE,
+                 timeout=DEFAULT_TIMEOUT, verify=False, cache=None, controller=None):
+        """Constructor.
+
+        :param base_url: Root of the StraboSpot site, relative paths given to
+            get/post are joined to this.
+        :type base_url: str
+
+        :param pool_size: Number of connections kept alive per host.
+        :type pool_size: int
+
+        :param timeout: Timeout (seconds) or (connect, read) tuple used when a
+            call does not pass its own.
+        :type timeout: float, tuple
+
+        :param verify: Passed to requests for SSL verification.
+            Later on check for update of Requests library so verify=False can
+            be taken out-- Need to figure out how to accept the StraboSpot SSL
+            Certificate
+        :type verify: bool
+
+        :param cache: Optional store for GETs made with cache=True.
+        :type cache: strabo_cache.ResponseCache
+
+        :param controller: Limits the requests in flight, a new
+            ConcurrencyController if not given.
+        :type controller: ConcurrencyController
+        """
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.verify = verify
+        # Ask for compressed bodies, requests decodes them as they are read
+        self.session.headers.update({'Accept-Charset': 'UTF-8', 'Accept-Encoding': 'gzip, deflate'})
+        self.cache = cache
+        self.controller = controller or ConcurrencyController()
+        self.pool_size = None
+        self.set_pool_size(pool_size)
+
+    def set_pool_size(self, pool_size):
+        """(Re)mount the connection pools holding pool_size connections per host."""
+        pool_size = max(1, int(pool_size))
+        if pool_size == self.pool_size:
+            return
+        self.pool_size = pool_size
+        for prefix in ('https://', 'http://'):
+            self.session.mount(prefix, HTTPAdapter(pool_maxsize=pool_size))
+
+    def set_auth(self, username, password):
+        self.session.auth = HTTPBasicAuth(username, password)
+
+    def clear_auth(self):
+        self.session.auth = None
+
+    def username(self):
+        return getattr(self.session.auth, 'username', None)
+
+    def url(self, path):
+        # Full URLs (e.g. an image's 'self' link) are used as they are
+        if path.startswith('http://') or path.startswith('https://'):
+            return path
+        return self.base_url + '/' + path.lstrip('/')
+
+    def request(self, method, path, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        # Only background requests wait out a Retry-After, the GUI thread's go straight on
+        self.controller.acquire(pause=not on_main_thread())
+        start = time.time()
+        try:
+            r = self.session.request(method, self.url(path), **kwargs)
+        except Exception:
+            self.controller.release()
+            raise
+        self.controller.release(time.time() - start, r.status_code, r.headers.get('Retry-After'))
+        return r
+
+    def get(self, path, cache=False, version=None, **kwargs):
+        """GET a path, optionally through the response cache.
+
+        :param cache: Serve the body from the cache when the server reports it
+            unchanged (304) and store new bodies as they are read.
+        :type cache: bool
+
+        :param version: Known version of the resource (e.g. the project's
+            modified_timestamp). A cached entry saved with the same version is
+            served without contacting the server.
+        :type version: str
+        """
+        if not cache or self.cache is None:
+            return self.request('GET', path, **kwargs)
+        url = self.url(path)
+        user = self.username()
+        entry = self.cache.lookup(url, user)
+        if entry is not None and version is not None and entry.get('version') == version:
+            cached = self.cache.response(url, user)
+            if cached is not None:
+                return cached
+        extra = kwargs.pop('headers', {})
+        headers = self.cache.validators(entry)
+        headers.update(extra)
+        kwargs['stream'] = True
+        r = self.request('GET', path, headers=headers, **kwargs)
+        if r.status_code == 304 and entry is not None:
+            r.close()
+            cached = self.cache.response(url, user)
+            if cached is not None:
+                return cached
+            # The entry was replaced or removed meanwhile, GET the body itself
+            r = self.request('GET', path, headers=extra, **kwargs)
+        if r.status_code == 200:
+            self.cache.capture(url, user, r, version)
+        return r
+
+    def head(self, path, **kwargs):
+        return self.request('HEAD', path, **kwargs)
+
+    def post(self, path, json=None, **kwargs):
+        headers = {'Content-type': 'application/json'}
+        headers.update(kwargs.pop('headers', {}))
+        return self.request('POST', path, json=json, headers=headers, **kwargs)
+
+    def fetch_all(self, requests_list, workers=None, **kwargs):
+        """GET a batch of paths concurrently through a bounded pool of worker threads.
+
+        :param requests_list: (key, path) pairs to GET. The key is handed back
+            with the response so the caller knows which request it answers.
+            A third item, a dict of keyword arguments for get, may be added
+            for arguments that differ between requests.
+        :type requests_list: list
+
+        :param workers: Maximum number of requests in flight. Defaults to the
+            connection pool size so every worker holds a kept-alive connection.
+        :type workers: int
+
+        :returns: Generator of (key, response) pairs in the order the responses
+            arrive. An exception raised by a request is re-raised here.
+        """
+        engine = TransferEngine(self, max_in_flight=min(workers or self.pool_size, max(1, len(requests_list))))
+        try:
+            for result in engine.fetch_all(requests_list, **kwargs):
+                yield result
+        finally:
+            # If the caller stops early, drop whatever has not started
+            engine.close()
+
+    def login(self, username, password):
+        """POST the user's credentials to userAuthenticate.
+
+        The credentials are sent in the body, use set_auth once the login
+        is valid so later calls carry Basic auth.
+        """
+        data = {'email': username, 'password': password}
+        return self.post('userAuthenticate', json=data)
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ StraboSpot spot coordinates
+                                 A QGIS plugin
+ Download and Upload Strabo data to and from QGIS.
+                             -------------------
+        begin                : 2017-06-15
+        git sha              : $Format:%H$
+        copyright            : (C) 2017 by Emily Bunse - University of Kansas
+        email                : egbunse@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+ The coordinates of a dataset's spots gathered into NumPy arrays, so their
+ bounding boxes, representative points (for geotagging images) and the
+ dataset's extent are worked out for every spot at once instead of spot
+ by spot.
+"""
+import numpy
+
+# Earth radius of the spherical (web) Mercator projection, EPSG:3857
+MERCATOR_RADIUS = 6378137.0
+
+
+def positions(geometry):
+    """Every position of a GeoJSON geometry, in order, as [x, y] lists."""
+    if not geometry:
+        return []
+    if geometry.get('type') == 'GeometryCollection':
+        found = []
+        for part in geometry.get('geometries') or ():
+            found.extend(positions(part))
+        return found
+    found = []
+    stack = [geometry.get('coordinates')]
+    # Walk the nested coordinate lists depth first, a position is a list of numbers
+    while stack:
+        item = stack.pop()
+        if not item:
+            continue
+        if isinstance(item[0], (list, tuple)):
+            stack.extend(reversed(item))
+        else:
+            found.append(item[:2])
+    return found
+
+
+class SpotCoordinates(object):
+    """Coordinates of a list of spots, all in one (n, 2) array.
+
+    Each spot's positions are the rows starts[i]:starts[i] + counts[i] of
+    coords.  Results for a spot without a geometry are NaN.
+    """
+
+    def __init__(self, spots):
+        """Constructor.
+
+        :param spots: The spots (GeoJSON features), usually the ones of one
+            dataset and geometry type.
+        :type spots: list
+        """
+        values = []
+        counts = []
+        for spot in spots:
+            found = positions(spot.get('geometry'))
+            counts.append(len(found))
+            values.extend(found)
+        self.coords = numpy.array(values, dtype=numpy.float64).reshape(-1, 2)
+        self.counts = numpy.array(counts, dtype=numpy.int64)
+        self.starts = numpy.cumsum(self.counts) - self.counts
+        self.present = self.counts > 0
+
+    def __len__(self):
+        return len(self.counts)
+
+    def _per_spot(self, reduce):
+        result = numpy.full((len(self.counts), 2), numpy.nan)
+        if self.present.any():
+            result[self.present] = reduce(self.coords, self.starts[self.present], axis=0)
+        return result
+
+    def first_points(self):
+        """(n, 2) array of every spot's first position."""
+        result = numpy.full((len(self.counts), 2), numpy.nan)
+        result[self.present] = self.coords[self.starts[self.present]]
+        return result
+
+    def centroids(self):
+        """(n, 2) array of the mean of every spot's positions."""
+        sums = self._per_spot(numpy.add.reduceat)
+        return sums / self.counts[:, numpy.newaxis]
+
+    def representative_points(self, method='first'):
+        """One point per spot, its first position ('first') or the mean of its positions ('centroid')."""
+        if method == 'centroid':
+            return self.centroids()
+        return self.first_points()
+
+    def bounds(self):
+        """(n, 4) array of every spot's xmin, ymin, xmax, ymax."""
+        return numpy.hstack([self._per_spot(numpy.minimum.reduceat), self._per_spot(numpy.maximum.reduceat)])
+
+    def extent(self):
+        """(xmin, ymin, xmax, ymax) of all the spots, None when none has coordinates."""
+        if len(self.coords) == 0:
+            return None
+        low = self.coords.min(axis=0)
+        high = self.coords.max(axis=0)
+        return float(low[0]), float(low[1]), float(high[0]), float(high[1])
+
+
+def union_extent(first, second):
+    """The extent covering two (xmin, ymin, xmax, ymax), either may be None."""
+    if first is None:
+        return second
+    if second is None:
+        return first
+    return (min(first[0], second[0]), min(first[1], second[1]),
+            max(first[2], second[2]), max(first[3], second[3]))
+
+
+def web_mercator(points):
+    """Project (n, 2) WGS84 longitude/latitude points to EPSG:3857 metres."""
+    points = numpy.asarray(points, dtype=numpy.float64)
+    x = numpy.radians(points[:, 0]) * MERCATOR_RADIUS
+    latitude = numpy.clip(points[:, 1], -85.0511287798, 85.0511287798)
+    y = numpy.log(numpy.tan(numpy.pi / 4.0 + numpy.radians(latitude) / 2.0)) * MERCATOR_RADIUS
+    return numpy.column_stack([x, y])
+
+
+def to_dms(values):
+    """Degrees, minutes and thousandths of seconds of decimal degrees, as the EXIF GPS tags store them.
+
+    :returns: Three int arrays, the sign of values is dropped (it is the
+        EXIF N/S or E/W reference).
+    """
+    values = numpy.abs(numpy.asarray(values, dtype=numpy.float64))
+    degrees = numpy.trunc(values)
+    minutes = numpy.trunc((values - degrees) * 60)
+    seconds = numpy.trunc((((values - degrees) * 60) - minutes) * 60 * 1000)
+    return degrees.astype(numpy.int64), minutes.astype(numpy.int64), seconds.astype(numpy.int64)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ StraboSpot EXIF geotagging
+                                 A QGIS plugin
+ Download and Upload Strabo data to and from QGIS.
+                             -------------------
+        begin                : 2017-06-15
+        git sha              : $Format:%H$
+        copyright            : (C) 2017 by Emily Bunse - University of Kansas
+        email                : egbunse@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+
+ Writes a Spot's location to the EXIF GPS tags of a downloaded JPEG
+ without decoding it.  Only the header segments are read; the Exif APP1
+ segment is replaced (or inserted if there isn't one) and everything from
+ the start of scan on is streamed into the new file untouched, so the
+ image is not re-encoded.
+"""
+import os
+import shutil
+import struct
+
+import piexif
+
+from strabo_coords import to_dms
+
+SOI = b'\xff\xd8'
+# Markers with no length or payload: TEM, RST0-7, SOI and EOI
+STANDALONE_MARKERS = set([0x01, 0xd0, 0xd1, 0xd2, 0xd3, 0xd4, 0xd5, 0xd6, 0xd7, 0xd8, 0xd9])
+APP0 = 0xe0
+APP1 = 0xe1
+SOS = 0xda
+EXIF_HEADER = b'Exif\x00\x00'
+# A segment's length field counts itself, so its payload is at most this long
+MAX_SEGMENT = 0xffff - 2
+# Bytes copied at a time from the start of scan on
+COPY_CHUNK_SIZE = 256 * 1024
+
+
+def read_segments(fileobj):
+    """The header segments of a JPEG, up to the start of scan.
+
+    :returns: (marker, payload) pairs, fileobj is left just past the SOS
+        marker (or at the end for a JPEG without one).
+    :raises ValueError: If fileobj is not a JPEG.
+    """
+    if fileobj.read(2) != SOI:
+        raise ValueError('not a JPEG file')
+    segments = []
+    while True:
+        byte = fileobj.read(1)
+        if not byte:
+            return segments
+        if byte != b'\xff':
+            raise ValueError('JPEG marker expected at byte %d' % (fileobj.tell() - 1))
+        marker = ord(fileobj.read(1) or b'\x00')
+        while marker == 0xff:  # Fill bytes before the marker
+            marker = ord(fileobj.read(1) or b'\x00')
+        if marker == SOS:
+            return segments
+        if marker in STANDALONE_MARKERS:
+            segments.append((marker, None))
+            continue
+        length = fileobj.read(2)
+        if len(length) != 2:
+            raise ValueError('JPEG segment cut short')
+        payload = fileobj.read(struct.unpack('>H', length)[0] - 2)
+        segments.append((marker, payload))
+
+
+def is_exif(marker, payload):
+    return marker == APP1 and payload is not None and payload.startswith(EXIF_HEADER)
+
+
+def read_exif(path):
+    """The Exif APP1 payload (starting with 'Exif\\0\\0') of a JPEG, None if it has none."""
+    with open(path, 'rb') as f:
+        for marker, payload in read_segments(f):
+            if is_exif(marker, payload):
+                return payload
+    return None
+
+
+def write_exif(path, exif):
+    """Replace the Exif segment of a JPEG, or insert one, leaving the image data as it is.
+
+    The new file is written next to path and renamed over it, so a
+    hardlinked copy of the original is left alone.
+
+    :param exif: Exif APP1 payload, as made by piexif.dump.
+    :type exif: bytes
+    """
+    if not exif.startswith(EXIF_HEADER):
+        raise ValueError('Exif payload must start with the Exif header')
+    if len(exif) > MAX_SEGMENT:
+        raise ValueError('Exif payload of %d bytes does not fit in a JPEG segment' % len(exif))
+    partfile = path + '.part'
+    with open(path, 'rb') as source:
+        segments = read_segments(source)
+        positions = [i for i, (marker, payload) in enumerate(segments) if is_exif(marker, payload)]
+        if positions:
+            segments[positions[0]] = (APP1, exif)
+            for i in reversed(positions[1:]):
+                del segments[i]
+        else:
+            # Right after the JFIF APP0 if there is one, otherwise straight after SOI
+            at = 1 if segments and segments[0][0] == APP0 else 0
+            segments.insert(at, (APP1, exif))
+        scan = source.tell() < os.fstat(source.fileno()).st_size
+        with open(partfile, 'wb') as target:
+            target.write(SOI)
+            for marker, payload in segments:
+                if payload is None:
+                    target.write(struct.pack('>BB', 0xff, marker))
+                else:
+                    target.write(struct.pack('>BBH', 0xff, marker, len(payload) + 2))
+                    target.write(payload)
+            if scan:
+                target.write(struct.pack('>BB', 0xff, SOS))
+                shutil.copyfileobj(source, target, COPY_CHUNK_SIZE)
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(partfile, path)
+
+
+def gps_exif(exif, longitude, latitude):
+    """Exif payload with its GPS position set, exif may be None to start a new one."""
+    if exif is not None:
+        exif_dict = piexif.load(exif)
+    else:
+        exif_dict = {'0th': {}, 'Exif': {}, 'GPS': {}, '1st': {}, 'thumbnail': None}
+    gps = exif_dict['GPS']
+    gps[piexif.GPSIFD.GPSLongitudeRef] = 'W' if longitude < 0 else 'E'
+    gps[piexif.GPSIFD.GPSLatitudeRef] = 'S' if latitude < 0 else 'N'
+    # Degrees, minutes and thousandths of seconds, longitude and latitude together
+    degrees, minutes, seconds = to_dms([longitude, latitude])
+    gps[piexif.GPSIFD.GPSLongitude] = [(int(degrees[0]), 1), (int(minutes[0]), 1), (int(seconds[0]), 1000)]
+    gps[piexif.GPSIFD.GPSLatitude] = [(int(degrees[1]), 1), (int(minutes[1]), 1), (int(seconds[1]), 1000)]
+    return piexif.dump(exif_dict)
+
+
+def geotag(path, longitude, latitude):
+    """Write longitude/latitude (WGS84) to a JPEG's EXIF GPS tags in place."""
+    write_exif(path, gps_exif(read_exif(path), longitude, latitude))
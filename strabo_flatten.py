@@ -0,0 +1,484 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ StraboSpot spot flattening
+                                 A QGIS plugin
+ Download and Upload Strabo data to and from QGIS.
+                             -------------------
+        begin                : 2017-06-15
+        git sha              : $Format:%H$
+        copyright            : (C) 2017 by Emily Bunse - University of Kansas
+        email                : egbunse@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+ Turns StraboSpot spots, whose properties hold nested arrays (Orientation
+ Data, Samples, Images, etc.), into flat GeoJSON features QGIS can load.
+
+ Each nested type is one row of NESTED_TYPES rather than a block of code of
+ its own, and every spot is handled in a single pass over that table.  The
+ features are grouped into one layer per kind (spots, tags and each nested
+ type) so each layer gets a compact schema of its own.
+ Nothing in here depends on QGIS so it can be tested and benchmarked on its
+ own.
+
+ Large datasets are flattened in chunks on a pool of processes
+ (flatten_spots), smaller ones stay in the calling process where starting
+ the pool would cost more than it saves.
+
+ A FlattenSnapshot keeps the features of the last download of a dataset so
+ only spots that are new or have a new modified_timestamp are flattened
+ again (flatten_incremental).
+
+ DatasetFlattener takes the spots one at a time as they are parsed from
+ the response and flattens them a chunk at a time into a set of layers per
+ geometry type, so a whole dataset of spots is never held in memory.
+"""
+import errno
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+from collections import namedtuple, OrderedDict
+
+from strabo_records import FieldNames, SpotRecord, ChildRecord, GeoJSONRecord
+from strabo_spots import GEOMETRY_TYPES, geometry_type
+
+# A nested spot property that becomes features of its own.
+#   key:    name of the property in the spot
+#   suffix: added to every field name "to avoid table confusion"
+#   many:   True if the property holds a list of records, False for a single record
+NestedType = namedtuple('NestedType', ['key', 'suffix', 'many'])
+
+NESTED_TYPES = [
+    NestedType('orientation_data', '_orientation_data', True),
+    NestedType('rock_unit', '_rock_unit', False),
+    NestedType('trace', '_trace', False),
+    NestedType('samples', '_samples', True),
+    NestedType('_3d_structures', '_3d_structures', True),
+    NestedType('other_features', '_other_features', True),
+    NestedType('images', '_images', True),
+]
+
+# Spot properties copied onto the spot's own feature
+SPOT_FIELDS = ['id', 'modified_timestamp', 'time', 'date', 'self']
+# Kinds of feature yielded besides the NESTED_TYPES keys
+SPOT = 'spot'
+TAGS = 'tags'
+# Fewest spots worth flattening on a process pool, and fewest spots per chunk sent to it
+PARALLEL_THRESHOLD = 5000
+MIN_CHUNK_SIZE = 500
+
+
+def index_tags(tags):
+    """Map every spot id listed by the project's tags to those tags.
+
+    Built once per project so looking up a spot's tags is a single dict
+    access rather than a scan of every tag's 'spots' list.  Tags keep their
+    project order and a tag listing a spot twice is only added once.
+
+    :param tags: The project's tags (project JSON 'tags').
+    :type tags: list
+
+    :returns: {spot id: [tag, ...]}
+    :rtype: dict
+    """
+    index = {}
+    for tag in tags:
+        for spotid in tag.get('spots') or ():
+            spottags = index.setdefault(spotid, [])
+            if not spottags or spottags[-1] is not tag:
+                spottags.append(tag)
+    return index
+
+
+class SpotFlattener(object):
+    """Flattens the spots of one project's datasets."""
+
+    def __init__(self, tags=None, nested_types=NESTED_TYPES, child_geometry=True):
+        """Constructor.
+
+        :param tags: The project's tags (project JSON 'tags'), each listing
+            the ids of its spots under 'spots'.
+        :type tags: list
+
+        :param nested_types: Table of the nested properties to flatten.
+        :type nested_types: list
+
+        :param child_geometry: False to leave the spot's geometry off its tag
+            and nested record features, they are joined to the spot by SpotID.
+        :type child_geometry: bool
+        """
+        self.tags = tags or []
+        self.nested_types = nested_types
+        self.child_geometry = child_geometry
+        self._signature = None
+        self.tag_index = index_tags(self.tags)
+        # Renamed field names of each kind of child record, built once per key instead of per record
+        self.fieldnames = dict((nested.key, FieldNames(suffix=nested.suffix)) for nested in nested_types)
+        self.fieldnames[TAGS] = FieldNames(prefix='tag_', skip=('spots',))
+        # Added to the '<dataset>_<geometry>' layer name, the spots layer keeps the plain name
+        self.layer_suffixes = dict((nested.key, nested.suffix) for nested in nested_types)
+        self.layer_suffixes[SPOT] = ''
+        self.layer_suffixes[TAGS] = '_tags'
+
+    def signature(self, extra=None):
+        """Hash of everything besides the spot itself that shapes its features.
+
+        :param extra: Settings of the download that also end up in the
+            features, e.g. where the images are saved (each image feature
+            gets its path).
+        :type extra: list
+        """
+        if self._signature is None:
+            settings = [self.child_geometry, list(self.nested_types), self.tags]
+            self._signature = hashlib.sha1(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+        if extra is None:
+            return self._signature
+        return hashlib.sha1(json.dumps([self._signature, extra], sort_keys=True).encode('utf-8')).hexdigest()
+
+    def kinds(self):
+        """Every kind of feature, in layer order."""
+        return [SPOT, TAGS] + [nested.key for nested in self.nested_types]
+
+    def layer_name(self, basename, kind):
+        """Name of the layer holding one kind of feature, e.g. 'Bedrock_point_samples'."""
+        return basename + self.layer_suffixes[kind]
+
+    def new_layers(self, factory=list):
+        """Empty {kind: features} to fill, in layer order.
+
+        :param factory: Makes the container of each layer's features, e.g.
+            strabo_table.FeatureTable; anything with append().
+        """
+        return OrderedDict((kind, factory()) for kind in self.kinds())
+
+    def tags_for(self, spotid):
+        """The project's tags associated with a spot."""
+        return self.tag_index.get(spotid, ())
+
+    def flatten(self, spot):
+        """Flatten one spot.
+
+        :returns: Generator of (kind, record, feature) in output order: the
+            spot itself, its tags, then one feature per nested record. kind is
+            SPOT, TAGS or the NESTED_TYPES key, record is the source dict
+            (e.g. the image record holding the image's 'self' link) and
+            feature a strabo_records.FeatureRecord.
+        """
+        geometry = spot['geometry']
+        spotprop = spot['properties']
+        spotid = spotprop['id']
+
+        yield SPOT, spotprop, SpotRecord(geometry, spotprop)
+        if not self.child_geometry:
+            geometry = None
+
+        #Check if the Spot is associated with any Tags from the project JSON
+        fields = self.fieldnames[TAGS]
+        for tag in self.tags_for(spotid):
+            yield TAGS, tag, ChildRecord(geometry, tag, fields, spotid)
+
+        #Check for and add special features (nested JSON arrays)
+        for nested in self.nested_types:
+            value = spotprop.get(nested.key)
+            if not value:
+                continue
+            fields = self.fieldnames[nested.key]
+            records = value if nested.many else [value]
+            for record in records:
+                yield nested.key, record, ChildRecord(geometry, record, fields, spotid)
+
+    def flatten_all(self, spots):
+        """All the features of a list of spots as GeoJSON dicts, in order."""
+        features = []
+        for spot in spots:
+            for kind, record, feature in self.flatten(spot):
+                features.append(feature.to_geojson())
+        return features
+
+    def flatten_layers(self, spots, factory=list):
+        """The features of a list of spots grouped by kind, see new_layers."""
+        layers = self.new_layers(factory)
+        for spot in spots:
+            for kind, record, feature in self.flatten(spot):
+                layers[kind].append(feature)
+        return layers
+
+
+# The flattener of a pool worker process, set once by _init_worker
+_worker_flattener = None
+
+
+def _init_worker(flattener):
+    global _worker_flattener
+    _worker_flattener = flattener
+
+
+def _flatten_chunk(chunk):
+    start, spots = chunk
+    results = []
+    for offset, spot in enumerate(spots):
+        for kind, record, feature in _worker_flattener.flatten(spot):
+            results.append((start + offset, kind, record, feature))
+    return results
+
+
+def _set_executable():
+    # Inside QGIS on Windows sys.executable is qgis.exe, worker processes have to be started
+    # with the Python interpreter it embeds
+    if sys.platform == 'win32' and os.path.basename(sys.executable).lower() not in ('python.exe', 'pythonw.exe'):
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'pythonw.exe'))
+
+
+def flatten_spots(flattener, spots, processes=None, threshold=PARALLEL_THRESHOLD):
+    """Flatten a list of spots, on a process pool if there are enough of them.
+
+    :param flattener: Flattener whose settings and tag index the workers use.
+    :type flattener: SpotFlattener
+
+    :param spots: The dataset's spots (GeoJSON features).
+    :type spots: list
+
+    :param processes: Size of the pool, None for one per CPU. 1 never uses a pool.
+    :type processes: int
+
+    :param threshold: Fewest spots flattened on a pool.
+    :type threshold: int
+
+    :returns: Generator of (spot index, kind, record, feature) in the same
+        order as flattening the spots one by one.  From a pool, record and
+        feature are copies made in the worker.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if processes <= 1 or len(spots) < max(threshold, 1):
+        for index, spot in enumerate(spots):
+            for kind, record, feature in flattener.flatten(spot):
+                yield index, kind, record, feature
+        return
+
+    chunk_size = max(MIN_CHUNK_SIZE, len(spots) // (processes * 4) + 1)
+    chunks = [(start, spots[start:start + chunk_size]) for start in range(0, len(spots), chunk_size)]
+    _set_executable()
+    pool = multiprocessing.Pool(processes, _init_worker, (flattener,))
+    try:
+        # imap hands the chunks back in order, so the result does not depend on which worker finishes first
+        for results in pool.imap(_flatten_chunk, chunks):
+            for result in results:
+                yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+class FlattenSnapshot(object):
+    """The flattened features of a dataset's spots, saved between downloads.
+
+    Spots are keyed by id with the modified_timestamp they were flattened
+    at.  The snapshot is thrown away when the flattener's signature (tags,
+    settings) differs from the one it was saved with.
+    """
+
+    def __init__(self, path, signature):
+        """Constructor.
+
+        :param path: File the snapshot is read from and saved to, None to
+            neither read nor keep one.
+        :type path: str
+
+        :param signature: SpotFlattener.signature() of the current flattener.
+        :type signature: str
+        """
+        self.path = path
+        self.signature = signature
+        self.previous = {}
+        # Ids of the spots written so far, their features go straight to the part file
+        self.spotids = set()
+        self.partfile = None
+        # Anything different from the previous snapshot (new, modified or removed spots)
+        self.changed = True
+        self.reflattened = 0
+        self.reused = 0
+        if path is None:
+            return
+        try:
+            with open(path) as snapshotfile:
+                saved = json.load(snapshotfile)
+        except (IOError, OSError, ValueError):
+            return
+        if saved.get('signature') == signature:
+            self.previous = saved.get('spots', {})
+            self.changed = False
+
+    def features(self, spot):
+        """The saved [(kind, GeoJSON feature)] of an unchanged spot, None if it has to be flattened."""
+        spotprop = spot['properties']
+        saved = self.previous.get(str(spotprop['id']))
+        if saved is None or saved[0] != spotprop.get('modified_timestamp'):
+            return None
+        return saved[1]
+
+    def update(self, spot, features, reused):
+        """Record a spot's features, written out at once so they are not held until save()."""
+        spotprop = spot['properties']
+        spotid = str(spotprop['id'])
+        if self.path is not None and spotid not in self.spotids:
+            partfile = self._partfile()
+            if self.spotids:
+                partfile.write(', ')
+            entry = [spotprop.get('modified_timestamp'), [[kind, feature.to_geojson()] for kind, feature in features]]
+            partfile.write('%s: %s' % (json.dumps(spotid), json.dumps(entry)))
+        self.spotids.add(spotid)
+        if reused:
+            self.reused += 1
+        else:
+            self.reflattened += 1
+            self.changed = True
+
+    def _partfile(self):
+        if self.partfile is None:
+            self.partfile = open(self.path + '.part', 'w')
+            self.partfile.write('{"signature": %s, "spots": {' % json.dumps(self.signature))
+        return self.partfile
+
+    def save(self):
+        """Finish writing the spots flattened or reused since the snapshot was opened."""
+        if len(self.spotids) != len(self.previous):
+            self.changed = True  # Spots were removed from the dataset
+        if self.path is None:
+            return
+        self._partfile().write('}}')
+        self.partfile.close()
+        self.partfile = None
+        try:
+            os.remove(self.path)
+        except OSError as exception:
+            if exception.errno != errno.ENOENT:
+                raise
+        os.rename(self.path + '.part', self.path)
+
+
+def flatten_incremental(flattener, spots, snapshot, processes=None, threshold=PARALLEL_THRESHOLD):
+    """Like flatten_spots, reusing the snapshot's features for unchanged spots.
+
+    Only new and modified spots are flattened (on a pool if there are enough
+    of them); record is None for features taken from the snapshot.  The
+    snapshot is updated with every spot, call its save() afterwards.
+    """
+    changed = [index for index, spot in enumerate(spots) if snapshot.features(spot) is None]
+    results = flatten_spots(flattener, [spots[index] for index in changed], processes, threshold)
+    pending = next(results, None)
+    for index, spot in enumerate(spots):
+        saved = snapshot.features(spot)
+        if saved is not None:
+            features = []
+            for kind, feature in saved:
+                feature = GeoJSONRecord(feature)
+                features.append([kind, feature])
+                yield index, kind, None, feature
+            snapshot.update(spot, features, True)
+            continue
+        features = []
+        while pending is not None and changed[pending[0]] == index:
+            subindex, kind, record, feature = pending
+            features.append([kind, feature])
+            yield index, kind, record, feature
+            pending = next(results, None)
+        snapshot.update(spot, features, False)
+
+
+class DatasetFlattener(object):
+    """Flattens a dataset's spots into layers per geometry type as they are parsed.
+
+    Spots are only held until chunk_size of one geometry type have arrived,
+    then flattened together (on a process pool when there are at least
+    threshold of them) into that geometry's layers.  Memory is bounded by the
+    chunk rather than the dataset, the layers keep the flattened features
+    (e.g. in strabo_table.FeatureTable columns).
+    """
+
+    def __init__(self, flattener, snapshot=None, factory=list, processes=None,
+                 threshold=PARALLEL_THRESHOLD, chunk_size=None, visit=None):
+        """Constructor.
+
+        :param flattener: Flattener of the dataset's project.
+        :type flattener: SpotFlattener
+
+        :param snapshot: Called with a geometry type the first time a spot of
+            that type arrives, returns its FlattenSnapshot.  None keeps no
+            snapshot.
+        :type snapshot: function
+
+        :param factory: Makes the container of each layer's features, see
+            SpotFlattener.new_layers.
+        :type factory: function
+
+        :param chunk_size: Spots flattened at a time, threshold by default so
+            large datasets still use the pool.
+        :type chunk_size: int
+
+        :param visit: Called with (geometry type, spot index, kind, record,
+            feature) before each feature is added to its layer, e.g. to queue
+            an image's download.  The spot index counts the spots of that
+            geometry type, in the order they arrived.
+        :type visit: function
+        """
+        self.flattener = flattener
+        self.snapshot = snapshot or (lambda geotype: FlattenSnapshot(None, flattener.signature()))
+        self.factory = factory
+        self.processes = processes
+        self.threshold = threshold
+        self.chunk_size = max(1, chunk_size or threshold)
+        self.visit = visit
+        self.layers = {}
+        self.snapshots = {}
+        self.counts = {}
+        self.pending = {}
+
+    def add(self, spot):
+        """Take one spot, spots without a usable geometry are left out."""
+        geotype = geometry_type(spot)
+        if geotype is None:
+            return
+        if geotype not in self.layers:
+            self.layers[geotype] = self.flattener.new_layers(self.factory)
+            self.snapshots[geotype] = self.snapshot(geotype)
+            self.counts[geotype] = 0
+            self.pending[geotype] = []
+        self.pending[geotype].append(spot)
+        if len(self.pending[geotype]) >= self.chunk_size:
+            self._flush(geotype)
+
+    def _flush(self, geotype):
+        chunk = self.pending[geotype]
+        self.pending[geotype] = []
+        start = self.counts[geotype]
+        layers = self.layers[geotype]
+        for index, kind, record, feature in flatten_incremental(self.flattener, chunk, self.snapshots[geotype],
+                                                                self.processes, self.threshold):
+            if self.visit is not None:
+                self.visit(geotype, start + index, kind, record, feature)
+            layers[kind].append(feature)
+        self.counts[geotype] = start + len(chunk)
+
+    def finish(self):
+        """Flatten the spots still held back.
+
+        :returns: The geometry types the dataset has, in GEOMETRY_TYPES order.
+        :rtype: list
+        """
+        for geotype in self.pending:
+            if self.pending[geotype]:
+                self._flush(geotype)
+        return [geotype for geotype in GEOMETRY_TYPES if geotype in self.layers]
@@ -0,0 +1,494 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ StraboSpot image downloads
+                                 A QGIS plugin
+ Download and Upload Strabo data to and from QGIS.
+                             -------------------
+        begin                : 2017-06-15
+        git sha              : $Format:%H$
+        copyright            : (C) 2017 by Emily Bunse - University of Kansas
+        email                : egbunse@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+ Image transfers for the download process.  Each image is written to a
+ .part file next to its final name; a dropped connection is retried with
+ exponential backoff and picks up where the .part file left off using an
+ HTTP Range request.  Failures are collected for a summary at the end
+ instead of stopping the download.
+
+ An image already in the download folder can be skipped when it is
+ still the one last written there (by size, and content hash when asked)
+ or, for files without that record, when it matches the server's
+ Content-Length and ETag; a verify-only pass just reports the missing or
+ corrupt images.
+
+ ImagePool downloads the queued images on a few worker threads so the
+ spots keep being flattened while the images transfer.  Each finished
+ image is reported through notify, from the worker thread; inside QGIS
+ that is a Qt signal so the dialog is only touched on the main thread.
+ The downloaded jpegs are geotagged in a stage of their own, GeotagPool,
+ which collects the images it could not tag for the summary.
+"""
+import errno
+import json
+import math
+import os
+import re
+import threading
+import time
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+import requests
+
+from strabo_cache import file_hash
+from strabo_exif import geotag
+
+# Bytes read from an image response at a time, kept small since a chunk cut off by a
+# dropped connection is lost and has to be fetched again on resume
+IMAGE_CHUNK_SIZE = 8 * 1024
+# Attempts per image after the first, and the first delay (seconds) which doubles each retry
+DEFAULT_RETRIES = 4
+DEFAULT_BACKOFF = 1.0
+MAX_BACKOFF = 30.0
+# Statuses worth trying again, anything else is a permanent failure
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+# What is done with an image already in the download folder: always download it again,
+# skip it when it is still correct, or only report whether it is
+OVERWRITE = 'overwrite'
+SKIP = 'skip'
+VERIFY = 'verify'
+# Outcome of each image
+DOWNLOADED = 'downloaded'
+SKIPPED = 'skipped'
+# Kept because it matches the server's copy, so it still has to be geotagged and recorded like a download
+MATCHED = 'matched'
+FAILED = 'failed'
+MISSING = 'missing'
+CORRUPT = 'corrupt'
+UNCHECKED = 'unchecked'
+# Sizes and hashes of the images written to a folder, kept in the folder
+MANIFEST_NAME = 'images.json'
+# ETags that are a digest of the content, by length
+ETAG_DIGESTS = {32: 'md5', 40: 'sha1'}
+HEX = re.compile(r'^[0-9a-fA-F]+$')
+# Images downloaded at the same time by default
+DEFAULT_IMAGE_WORKERS = 4
+# Jpegs geotagged at the same time by default
+DEFAULT_GEOTAG_WORKERS = 2
+# Seconds to wait for the pool before letting the event loop run again
+POLL_INTERVAL = 0.05
+
+
+class ImageDownloader(object):
+    """Downloads StraboSpot images with retries and Range resume."""
+
+    def __init__(self, client, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, sleep=time.sleep,
+                 store=None, link=True, mode=OVERWRITE, manifest=None, thorough=False):
+        """Constructor.
+
+        :param client: The plug-in's StraboSpot client.
+        :type client: strabo_client.StraboClient
+
+        :param retries: Number of times a failed image is tried again.
+        :type retries: int
+
+        :param backoff: Delay in seconds before the first retry, doubled for
+            each retry after it (up to MAX_BACKOFF).
+        :type backoff: float
+
+        :param store: Images already downloaded once are taken from it rather
+            than from StraboSpot, and new ones are added to it.
+        :type store: strabo_cache.ImageStore
+
+        :param link: Whether images may be hardlinked to and from the store,
+            only if they are never modified in place.
+        :type link: bool
+
+        :param mode: OVERWRITE, SKIP or VERIFY, what fetch does with an
+            image that is already at its path.
+        :type mode: str
+
+        :param manifest: Sizes and hashes of the images as they were last
+            written, checked before asking the server.
+        :type manifest: ImageManifest
+
+        :param thorough: Compare content hashes as well as sizes.
+        :type thorough: bool
+        """
+        self.client = client
+        self.retries = retries
+        self.backoff = backoff
+        self.sleep = sleep
+        self.store = store
+        self.link = link
+        self.mode = mode
+        self.manifest = manifest
+        self.thorough = thorough
+        # Images taken from the store, and left as they were
+        self.stored = 0
+        self.skipped = 0
+        # (image id, path, MISSING, CORRUPT or UNCHECKED) for every image found wrong in verify mode
+        self.problems = []
+        # (image id, url, reason) for every image that could not be downloaded
+        self.failures = []
+
+    def fetch(self, url, path, imageid=None):
+        """Download url to path, unless the mode is to skip or only verify an image already there.
+
+        :returns: DOWNLOADED, SKIPPED, MATCHED (skipped, but only known to
+            be the server's copy), FAILED or, in verify mode, MISSING, CORRUPT
+            or UNCHECKED.
+        :rtype: str
+        """
+        if self.mode != OVERWRITE:
+            state = self.check(url, path)
+            if state in (None, MATCHED):
+                self.skipped += 1
+                # Verify mode leaves the files alone, so a match is only reported as correct
+                if state is None or self.mode == VERIFY:
+                    return SKIPPED
+                return MATCHED
+            if self.mode == VERIFY:
+                self.problems.append((imageid, path, state))
+                return state
+        if self.download(url, path, imageid):
+            return DOWNLOADED
+        return FAILED
+
+    def check(self, url, path):
+        """Whether the image at path is correct, without downloading it.
+
+        :returns: None if it is as the manifest has it, MATCHED if it is the
+            same as the server's copy, otherwise MISSING, CORRUPT or UNCHECKED
+            (neither the manifest nor the server could tell).
+        """
+        if not os.path.exists(path):
+            return MISSING
+        size = os.path.getsize(path)
+        entry = self.manifest.lookup(path) if self.manifest is not None else None
+        if entry is not None:
+            if entry['size'] != size or (self.thorough and entry['sha1'] != file_hash(path)):
+                return CORRUPT
+            return None
+        # Not written by a download that kept a manifest, compare with what the server has
+        try:
+            r = self.client.head(url, headers={'Accept-Encoding': 'identity'}, allow_redirects=True)
+            r.close()
+        except requests.exceptions.RequestException:
+            return UNCHECKED
+        if r.status_code != 200:
+            return UNCHECKED
+        checked = False
+        length = r.headers.get('Content-Length')
+        if length is not None:
+            if int(length) != size:
+                return CORRUPT
+            checked = True
+        etag = r.headers.get('ETag', '')
+        if etag.startswith('W/'):
+            etag = ''
+        etag = etag.strip('"')
+        if self.thorough and len(etag) in ETAG_DIGESTS and HEX.match(etag):
+            if file_hash(path, ETAG_DIGESTS[len(etag)]) != etag.lower():
+                return CORRUPT
+            checked = True
+        if not checked:
+            return UNCHECKED
+        return MATCHED
+
+    def download(self, url, path, imageid=None):
+        """Download url to path.
+
+        :returns: True if the image was saved, otherwise False and the
+            failure is added to self.failures.
+        :rtype: bool
+        """
+        if self.store is not None and imageid is not None and self.store.get(imageid, path, self.link):
+            self.stored += 1
+            return True
+        reason = None
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                self.sleep(min(self.backoff * (2 ** (attempt - 1)), MAX_BACKOFF))
+            try:
+                done, retry, reason = self._attempt(url, path)
+            except (requests.exceptions.RequestException, IOError) as error:
+                done, retry, reason = False, True, str(error)
+            if done:
+                if self.store is not None and imageid is not None:
+                    self.store.put(imageid, path, self.link)
+                return True
+            if not retry:
+                break
+        self.failures.append((imageid, url, reason))
+        return False
+
+    def _attempt(self, url, path):
+        """One GET of the image, resuming a partial file if there is one.
+
+        :returns: (done, worth retrying, failure reason)
+        """
+        partfile = path + '.part'
+        offset = os.path.getsize(partfile) if os.path.exists(partfile) else 0
+        # Ranges count encoded bytes, so images are always asked for uncompressed
+        headers = {'Accept-Encoding': 'identity'}
+        if offset > 0:
+            headers['Range'] = 'bytes=%d-' % offset
+        r = self.client.get(url, stream=True, headers=headers)
+        try:
+            if r.status_code == 416 and offset > 0:
+                # Nothing left past the partial file, it already holds the whole image
+                self._finish(partfile, path)
+                return True, False, None
+            if r.status_code not in (200, 206):
+                return False, r.status_code in RETRY_STATUSES, 'HTTP ' + str(r.status_code)
+            # A 200 means the server ignored the Range, so start the file again
+            mode = 'ab' if r.status_code == 206 else 'wb'
+            expected = r.headers.get('Content-Length')
+            written = 0
+            with open(partfile, mode) as f:
+                for chunk in r.iter_content(IMAGE_CHUNK_SIZE):
+                    f.write(chunk)
+                    written += len(chunk)
+            if expected is not None and written < int(expected):
+                return False, True, 'connection closed after %d of %s bytes' % (written, expected)
+        finally:
+            r.close()
+        self._finish(partfile, path)
+        return True, False, None
+
+    def _finish(self, partfile, path):
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(partfile, path)
+
+    def summary(self):
+        """Lines describing every failed image, empty when all were downloaded."""
+        lines = []
+        for imageid, url, reason in self.failures:
+            lines.append("Image with id: " + str(imageid) + " not downloaded (" + str(reason) + ")")
+        for imageid, path, state in self.problems:
+            if state == UNCHECKED:
+                lines.append("Image with id: " + str(imageid) + " could not be checked: " + path)
+            else:
+                lines.append("Image with id: " + str(imageid) + " is " + state + ": " + path)
+        return lines
+
+
+class ImageManifest(object):
+    """Size and sha1 of every image as it was last written, kept in a MANIFEST_NAME file per folder."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # folder -> {file name -> {'size', 'sha1'}}
+        self.folders = {}
+        self.changed = set()
+
+    def _entries(self, folder):
+        if folder not in self.folders:
+            try:
+                with open(os.path.join(folder, MANIFEST_NAME)) as manifestfile:
+                    self.folders[folder] = json.load(manifestfile)
+            except (IOError, OSError, ValueError):
+                self.folders[folder] = {}
+        return self.folders[folder]
+
+    def lookup(self, path):
+        """The entry of the image at path, None if it has none."""
+        folder, name = os.path.split(os.path.abspath(path))
+        with self.lock:
+            return self._entries(folder).get(name)
+
+    def record(self, path):
+        """Remember the image at path as it is now (e.g. once it has been geotagged)."""
+        entry = {'size': os.path.getsize(path), 'sha1': file_hash(path)}
+        folder, name = os.path.split(os.path.abspath(path))
+        with self.lock:
+            self._entries(folder)[name] = entry
+            self.changed.add(folder)
+
+    def save(self):
+        """Write the manifest of every folder with new entries."""
+        with self.lock:
+            for folder in self.changed:
+                manifestpath = os.path.join(folder, MANIFEST_NAME)
+                with open(manifestpath + '.part', 'w') as manifestfile:
+                    json.dump(self.folders[folder], manifestfile)
+                try:
+                    os.remove(manifestpath)
+                except OSError as exception:
+                    if exception.errno != errno.ENOENT:
+                        raise
+                os.rename(manifestpath + '.part', manifestpath)
+            self.changed = set()
+
+
+class WorkerPool(object):
+    """Runs queued jobs on a few worker threads, started as they are needed.
+
+    Subclasses implement run, whose result (a tuple) is passed to notify
+    after (done, queued).
+    """
+
+    def __init__(self, workers, notify=None, poll_interval=POLL_INTERVAL):
+        self.workers = max(1, int(workers))
+        self.notify = notify
+        self.poll_interval = poll_interval
+        self.jobs = queue.Queue()
+        self.threads = []
+        self.lock = threading.Lock()
+        self.finished = threading.Condition(self.lock)
+        self.queued = 0
+        self.done = 0
+        # Jobs done and notified, wait returns once it reaches queued
+        self.reported = 0
+
+    def submit(self, *job):
+        with self.lock:
+            self.queued += 1
+            start = len(self.threads) < self.workers and len(self.threads) < self.queued - self.done
+        self.jobs.put(job)
+        if start:
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            self.threads.append(thread)
+            thread.start()
+
+    def run(self, *job):
+        raise NotImplementedError
+
+    def _work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            result = self.run(*job)
+            with self.lock:
+                self.done += 1
+                done, queued = self.done, self.queued
+            try:
+                if self.notify is not None:
+                    self.notify(done, queued, *result)
+            finally:
+                with self.lock:
+                    self.reported += 1
+                    self.finished.notify_all()
+
+    def wait(self, process_events=None):
+        """Block until every queued job is done, calling process_events meanwhile."""
+        with self.lock:
+            while self.reported < self.queued:
+                self.finished.wait(self.poll_interval)
+                if process_events is not None:
+                    self.lock.release()
+                    try:
+                        process_events()
+                    finally:
+                        self.lock.acquire()
+        if process_events is not None:
+            # Deliver the notifications of the last jobs
+            process_events()
+
+    def close(self):
+        """Stop the worker threads once the queued jobs are done."""
+        for thread in self.threads:
+            self.jobs.put(None)
+        self.threads = []
+
+
+class ImagePool(WorkerPool):
+    """Downloads queued images on worker threads through an ImageDownloader."""
+
+    def __init__(self, downloader, workers=DEFAULT_IMAGE_WORKERS, notify=None, poll_interval=POLL_INTERVAL):
+        """Constructor.
+
+        :param downloader: Downloader doing the retries and resumes, its
+            failures list collects the images that could not be downloaded.
+            The client's connection pool is grown to workers if smaller.
+        :type downloader: ImageDownloader
+
+        :param workers: Most images downloaded at the same time.
+        :type workers: int
+
+        :param notify: Called from the worker thread after every image with
+            (done, queued, image id, path, result of fetch, context).
+        :type notify: function
+        """
+        WorkerPool.__init__(self, workers, notify, poll_interval)
+        self.downloader = downloader
+        client = downloader.client
+        if getattr(client, 'pool_size', self.workers) < self.workers:
+            client.set_pool_size(self.workers)
+
+    def submit(self, url, path, imageid=None, context=None):
+        """Queue an image, context is handed back to notify (e.g. the point to geotag it with)."""
+        WorkerPool.submit(self, url, path, imageid, context)
+
+    def run(self, url, path, imageid, context):
+        try:
+            result = self.downloader.fetch(url, path, imageid)
+        except Exception as error:
+            self.downloader.failures.append((imageid, url, str(error)))
+            result = FAILED
+        return imageid, path, result, context
+
+
+class GeotagPool(WorkerPool):
+    """Geotags downloaded jpegs on worker threads, collecting the failures for a report."""
+
+    def __init__(self, workers=DEFAULT_GEOTAG_WORKERS, manifest=None, notify=None, poll_interval=POLL_INTERVAL):
+        """Constructor.
+
+        :param workers: Most images geotagged at the same time.
+        :type workers: int
+
+        :param manifest: Each geotagged image is recorded in it as written.
+        :type manifest: ImageManifest
+
+        :param notify: Called from the worker thread after every image with
+            (done, queued, image id, path, geotagged).
+        :type notify: function
+        """
+        WorkerPool.__init__(self, workers, notify, poll_interval)
+        self.manifest = manifest
+        # (image id, path, reason) for every image that could not be geotagged
+        self.failures = []
+
+    def submit(self, path, point, imageid=None):
+        """Queue a jpeg to be tagged with point, the Spot's (longitude, latitude)."""
+        WorkerPool.submit(self, path, point, imageid)
+
+    def run(self, path, point, imageid):
+        longitude = float(point[0])
+        latitude = float(point[1])
+        if math.isnan(longitude) or math.isnan(latitude):
+            self.failures.append((imageid, path, 'the Spot has no coordinates'))
+            return imageid, path, False
+        try:
+            geotag(path, longitude, latitude)
+            if self.manifest is not None:
+                self.manifest.record(path)
+        except Exception as error:
+            self.failures.append((imageid, path, str(error)))
+            return imageid, path, False
+        return imageid, path, True
+
+    def summary(self):
+        """Lines describing every image that could not be geotagged."""
+        lines = []
+        for imageid, path, reason in self.failures:
+            lines.append("Image with id: " + str(imageid) + " not geotagged (" + str(reason) + "): " + path)
+        return lines
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ StraboSpot flattened feature records
+                                 A QGIS plugin
+ Download and Upload Strabo data to and from QGIS.
+                             -------------------
+        begin                : 2017-06-15
+        git sha              : $Format:%H$
+        copyright            : (C) 2017 by Emily Bunse - University of Kansas
+        email                : egbunse@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+ Compact records for the features the flattener makes, in place of a
+ GeoJSON dict (plus its 'properties' dict) per feature.  A spot's record
+ keeps its few fields in __slots__; a tag or nested record only points at
+ the source dict from the spot or project JSON and renames its fields as
+ they are read.  to_geojson() builds the GeoJSON feature when one is
+ actually needed.
+"""
+
+
+class FieldNames(object):
+    """Renames the fields of one kind of child record, e.g. 'dip' to 'dip_orientation_data'.
+
+    Shared by every record of that kind, each name is built once.
+    """
+
+    __slots__ = ('prefix', 'suffix', 'skip', 'names')
+
+    def __init__(self, prefix='', suffix='', skip=()):
+        self.prefix = prefix
+        self.suffix = suffix
+        self.skip = frozenset(skip)
+        self.names = {}
+
+    def name(self, key):
+        name = self.names.get(key)
+        if name is None:
+            name = self.names[key] = self.prefix + key + self.suffix
+        return name
+
+    def __getstate__(self):
+        return self.prefix, self.suffix, self.skip, self.names
+
+    def __setstate__(self, state):
+        self.prefix, self.suffix, self.skip, self.names = state
+
+
+class FeatureRecord(object):
+    """Base of the records, a GeoJSON feature with properties read through items().
+
+    Fields set after the record is made (e.g. an image's local 'path') are
+    kept in extra.
+    """
+
+    __slots__ = ('geometry', 'extra')
+
+    def items(self):
+        """Generator of the feature's (field name, value) in field order."""
+        raise NotImplementedError
+
+    def _extra_items(self):
+        if self.extra:
+            for item in self.extra.items():
+                yield item
+
+    def get(self, name, default=None):
+        for key, value in self.items():
+            if key == name:
+                return value
+        return default
+
+    def set(self, name, value):
+        if self.extra is None:
+            self.extra = {}
+        self.extra[name] = value
+
+    def properties(self):
+        return dict(self.items())
+
+    def to_geojson(self):
+        """The record as a GeoJSON feature dict."""
+        return {'type': 'Feature', 'geometry': self.geometry, 'properties': self.properties()}
+
+    def __eq__(self, other):
+        if not isinstance(other, FeatureRecord):
+            return NotImplemented
+        return self.to_geojson() == other.to_geojson()
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.to_geojson())
+
+    # __slots__ classes are pickled (e.g. back from flattening processes) through these
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self._fields())
+
+    def __setstate__(self, state):
+        for name, value in zip(self._fields(), state):
+            setattr(self, name, value)
+
+    @classmethod
+    def _fields(cls):
+        fields = []
+        for klass in reversed(cls.__mro__):
+            fields.extend(getattr(klass, '__slots__', ()))
+        return fields
+
+
+class SpotRecord(FeatureRecord):
+    """A spot's own feature, holding its basic fields (SPOT_FIELDS)."""
+
+    __slots__ = ('id', 'modified_timestamp', 'time', 'date', 'self')
+
+    def __init__(self, geometry, spotprop):
+        self.geometry = geometry
+        self.extra = None
+        self.id = spotprop.get('id')
+        self.modified_timestamp = spotprop.get('modified_timestamp')
+        self.time = spotprop.get('time')
+        self.date = spotprop.get('date')
+        self.self = spotprop.get('self')
+
+    def items(self):
+        yield 'id', self.id
+        yield 'modified_timestamp', self.modified_timestamp
+        yield 'time', self.time
+        yield 'date', self.date
+        yield 'self', self.self
+        for item in self._extra_items():
+            yield item
+
+
+class ChildRecord(FeatureRecord):
+    """A tag or nested record of a spot, its fields renamed by a FieldNames plus SpotID."""
+
+    __slots__ = ('source', 'fields', 'spotid')
+
+    def __init__(self, geometry, source, fields, spotid):
+        self.geometry = geometry
+        self.extra = None
+        self.source = source
+        self.fields = fields
+        self.spotid = spotid
+
+    def items(self):
+        fields = self.fields
+        for key, value in self.source.items():
+            if key not in fields.skip:
+                yield fields.name(key), value
+        yield 'SpotID', self.spotid
+        for item in self._extra_items():
+            yield item
+
+
+class GeoJSONRecord(FeatureRecord):
+    """A feature read back as GeoJSON (e.g. from a FlattenSnapshot)."""
+
+    __slots__ = ('values',)
+
+    def __init__(self, feature):
+        self.geometry = feature.get('geometry')
+        self.extra = None
+        self.values = feature.get('properties') or {}
+
+    def items(self):
+        return iter(self.values.items())
+
+    def set(self, name, value):
+        self.values[name] = value
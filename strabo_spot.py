@@ -36,9 +36,9 @@
 
 """
 from PyQt4.QtGui import QIcon, QAction, QFileDialog, QMessageBox
-from PyQt4.QtCore import QSettings, QTranslator, qVersion
+from PyQt4.QtCore import QSettings, QTranslator, qVersion, QObject, pyqtSignal, pyqtSlot
 from PyQt4.QtSql import QSqlDatabase
-from qgis.core import QCoreApplication, QgsMessageLog, QgsVectorFileWriter, QgsVectorLayer, QgsMapLayerRegistry, QgsDataSourceURI, QgsCoordinateReferenceSystem
+from qgis.core import QgsApplication, QCoreApplication, QgsMessageLog, QgsVectorFileWriter, QgsVectorLayer, QgsMapLayerRegistry, QgsDataSourceURI, QgsCoordinateReferenceSystem, QgsProject, QgsRelation, QgsRectangle, QgsCoordinateTransform
 from qgis.gui import QgsMessageBar
 import qgis.utils
 from pyspatialite import dbapi2 as db
@@ -48,18 +48,46 @@ from PyQt4 import QtCore
 import resources
 # Import the code for the dialog
 from strabo_spot_dialog import StraboSpotDialog
-import os.path, requests, json, errno, datetime, shutil, piexif, math, psycopg2, numpy, time
-from requests.auth import HTTPBasicAuth
-from PIL import Image
-from PIL import ImageFile
+from strabo_client import StraboClient, DEFAULT_POOL_SIZE
+from strabo_transfer import TransferEngine, DEFAULT_IN_FLIGHT
+from strabo_cache import ListingCache, ResponseCache, ImageStore, DEFAULT_IMAGE_STORE_SIZE, PREFETCH_WAIT
+from strabo_spots import GEOMETRY_TYPES
+from strabo_stream import BodyStream, FeatureStream, save_body, file_chunks
+from strabo_images import ImageDownloader, ImageManifest, ImagePool, GeotagPool, DEFAULT_IMAGE_WORKERS, DEFAULT_GEOTAG_WORKERS, OVERWRITE, VERIFY, DOWNLOADED, MATCHED
+from strabo_flatten import SpotFlattener, FlattenSnapshot, DatasetFlattener, SPOT, PARALLEL_THRESHOLD
+from strabo_table import FeatureTable
+from strabo_coords import SpotCoordinates, union_extent
+import os.path, json, errno, datetime, functools, psycopg2, numpy, time
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 from osgeo import gdal
 from tempfile import mkstemp, gettempdir
 
+
+class ImageProgress(QObject):
+    """Hands the image pool's notifications over to the main thread.
+
+    report is called from the pool's worker threads; the queued connection
+    delivers each result to handler on the thread this object lives in."""
+    finished = pyqtSignal(object)
+
+    def __init__(self, handler):
+        QObject.__init__(self)
+        self.handler = handler
+        self.finished.connect(self.deliver, QtCore.Qt.QueuedConnection)
+
+    def report(self, *result):
+        self.finished.emit(result)
+
+    @pyqtSlot(object)
+    def deliver(self, result):
+        self.handler(*result)
+
+
 class StraboSpot:
     """QGIS Plugin Implementation."""
     #These are global variables
     global username, password, projectid,  projectids, datasetids, projectname,\
+        projectversion, projectversions, datasetversions,\
         requestImages, fileExte, chosendatasets, selDB,\
         upload_layer_list, sel_upload_method, temp_folder
     username= None
@@ -67,6 +95,10 @@ class StraboSpot:
     projectid = None
     projectids = []
     datasetids = []
+    # modified_timestamps from the project/dataset listings, used to check the response cache
+    projectversion = None
+    projectversions = []
+    datasetversions = []
     projectname = None
     requestImages = False
     fileExte = None
@@ -106,6 +138,24 @@ class StraboSpot:
         # Create the dialog (after translation) and keep reference
         self.dlg = StraboSpotDialog()
 
+        # One keep-alive REST client is shared by every call to StraboSpot
+        # Project and dataset downloads are cached on disk and revalidated before being re-used
+        pool_size = QSettings().value('StraboSpot/poolSize', DEFAULT_POOL_SIZE, type=int)
+        cache = ResponseCache(os.path.join(QgsApplication.qgisSettingsDirPath(), 'StraboSpot', 'cache'))
+        self.client = StraboClient(pool_size=pool_size, cache=cache)
+        # Batches of requests are kept in flight together, the Qt event loop runs while they
+        # transfer so the dialog stays live
+        max_in_flight = QSettings().value('StraboSpot/maxInFlight', DEFAULT_IN_FLIGHT, type=int)
+        self.engine = TransferEngine(self.client, max_in_flight=max_in_flight,
+                                     process_events=QCoreApplication.processEvents)
+        # Project and dataset listings fetched in the background after login
+        self.listings = ListingCache(self.client)
+        # Every downloaded image is kept (up to StraboSpot/imageStoreSize MB) so it is not
+        # fetched again by a later download of any project
+        image_store_size = QSettings().value('StraboSpot/imageStoreSize', DEFAULT_IMAGE_STORE_SIZE // (1024 * 1024), type=int)
+        self.imagestore = ImageStore(os.path.join(QgsApplication.qgisSettingsDirPath(), 'StraboSpot', 'images'),
+                                     image_store_size * 1024 * 1024)
+
         # Declare instance attributes
         self.actions = []
         self.menu = self.tr(u'&StraboSpot')
@@ -254,6 +304,8 @@ class StraboSpot:
             self.iface.removeToolBarIcon(action)
         # remove the toolbar
         del self.toolbar
+        self.engine.close()
+        self.client.close()
 
     def backdialog(self):
         # Handles all the back buttons based on which part of the Stacked Widget displayed
@@ -267,6 +319,8 @@ class StraboSpot:
             username = None
             global password
             password = None
+            self.client.clear_auth()
+            self.listings.clear()
         elif currentIndex == 2:
             # Take the user back to where they choose download or upload
             self.dlg.stackedWidget.setCurrentIndex(1)
@@ -284,12 +338,7 @@ class StraboSpot:
         global password
         password = self.dlg.passwordlineEdit.text()
         # QgsMessageLog.logMessage('username:' + username + " password: " + password)
-        url = 'https://strabospot.org/userAuthenticate'
-        data = {'email': username, 'password': password}
-        headers = {'Content-type': 'application/json', 'Accept-Charset': 'UTF-8'}
-        #Later on check for update of Requests library so verify=False can be taken out--
-        #--Need to figure out how to accept the StraboSpot SSL Certificate
-        r = requests.post(url, json=data, headers=headers, verify= False)
+        r = self.client.login(username, password)
         code = r.status_code
         QgsMessageLog.logMessage('Login Status Code: ' + str(code))
         # Check for a Bad Response- if so, warn the user and reset authorization vars
@@ -308,6 +357,9 @@ class StraboSpot:
         # Check the status code for success to move on
         if valid == 'true':
             #If the user is logged-in hide the log in widget and show choose one
+            self.client.set_auth(username, password)
+            # Fetch the project and dataset lists while the user picks download or upload
+            self.listings.prefetch()
             self.dlg.stackedWidget.setCurrentIndex(1)
         elif valid == 'false':
             self.iface.messageBar().pushMessage("Error:", "Login Failed. Try again.", QgsMessageBar.CRITICAL, 10)
@@ -326,21 +378,29 @@ class StraboSpot:
             if self.dlg.projectlistWidget.count() > 0:
                 self.dlg.projectlistWidget.clear()
 
-        # GET the project list
-        url = 'https://strabospot.org/db/myProjects'
-        r = requests.get(url, auth=HTTPBasicAuth(username, password), verify=False)
-        statuscode = r.status_code
-        QgsMessageLog.logMessage(('Get projects code: ' + str(statuscode)))
-        response = r.json()
-        global projectids
+        # Use the project list prefetched after login, or GET it if it isn't in yet
+        # A prefetch still running is given a moment rather than sending the same request twice
+        projects = self.listings.projects()
+        if projects is None:
+            projects = self.listings.wait_for(self.listings.projects, PREFETCH_WAIT, QCoreApplication.processEvents)
+        if projects is None:
+            r = self.client.get('db/myProjects', cache=True)
+            statuscode = r.status_code
+            QgsMessageLog.logMessage(('Get projects code: ' + str(statuscode)))
+            response = r.json()
+            projects = response['projects']
+            self.listings.set_projects(projects)
+        global projectids, projectversions
         projectids = []
+        projectversions = []
         #Add project names to projectlistWidget
-        for prj in response['projects']:
+        for prj in projects:
             if widget_name == "create_prj_widget":
                 self.dlg.create_prj_widget.addItem(prj['name'])
             elif widget_name == "projectlistWidget":
                 self.dlg.projectlistWidget.addItem(prj['name'])
             projectids.append(prj['id'])
+            projectversions.append(prj.get('modified_timestamp'))
 
     # Get the project id and then GET the datasets from that project
     # Dataset names are added to the datasetlistWidget
@@ -356,22 +416,31 @@ class StraboSpot:
             projectname = self.dlg.create_prj_widget.currentItem().text()
 
         QgsMessageLog.logMessage('Project Chosen :' + str(projectname) + ' Index of: ' + str(chosenid))
-        global projectid
+        global projectid, projectversion
         projectid = projectids[chosenid]
+        projectversion = projectversions[chosenid]
 
         if widget_name == "projectlistWidget":
-            # GET the datasets within a Strabo project
-            url = 'https://strabospot.org/db/projectDatasets/' + str(projectid)
-            r = requests.get(url, auth=HTTPBasicAuth(username, password), verify=False)
-            statuscode = r.status_code
-            response = r.json()
-            global datasetids
+            # GET the datasets within a Strabo project, unless they were already prefetched
+            datasets = self.listings.datasets(projectid)
+            if datasets is None:
+                datasets = self.listings.wait_for(lambda: self.listings.datasets(projectid), PREFETCH_WAIT,
+                                                  QCoreApplication.processEvents)
+            if datasets is None:
+                r = self.client.get('db/projectDatasets/' + str(projectid), cache=True)
+                statuscode = r.status_code
+                response = r.json()
+                QgsMessageLog.logMessage('Get datasets code: ' + str(statuscode))
+                datasets = response['datasets']
+                self.listings.set_datasets(projectid, datasets)
+            global datasetids, datasetversions
             datasetids = []
-            QgsMessageLog.logMessage('Get datasets code: ' + str(statuscode))
+            datasetversions = []
             # Add datasets to list widget
-            for dataset in response['datasets']:
+            for dataset in datasets:
                 self.dlg.datasetlistWidget.addItem(dataset['name'])
                 datasetids.append(dataset['id'])
+                datasetversions.append(dataset.get('modified_timestamp'))
 
     # Gets the StraboSpot unique identifer for the user-chosen dataset
     # This is needed later for the REST call for the full dataset GeoJSON
@@ -382,7 +451,8 @@ class StraboSpot:
         datasetname = self.dlg.datasetlistWidget.currentItem().text()
         #QgsMessageLog.logMessage('Dataset Chosen :' + str(datasetname) + ' Index of: ' + str(chosenid))
         datasetid = datasetids[chosenid]
-        chosendatasets.append([datasetname, datasetid])
+        datasetversion = datasetversions[chosenid]
+        chosendatasets.append([datasetname, datasetid, datasetversion])
         #QgsMessageLog.logMessage('DatasetID: ' + str(datasetid))
 
     def downloadOptionsGUI(self):
@@ -434,24 +504,35 @@ class StraboSpot:
         QgsMessageLog.logMessage(str(datafolder))
 
         # GET the project info from StraboSpot and save
-        url = 'https://strabospot.org/db/project/' + str(projectid)
+        url = 'db/project/' + str(projectid)
         QgsMessageLog.logMessage(url)
-        r = requests.get(url, auth=HTTPBasicAuth(username, password), verify=False )
+        r = self.client.get(url, cache=True, version=self.cache_version(projectversion))
         statuscode = r.status_code
-        response = r.json()
-        prj_json = response
+        prj_json = None
         rawprojectfile = datafolder + "\\" + prj + "_" + str(projectid) + ".json"
+        if str(statuscode) == "200":
+            # Decode the (compressed) body straight to the raw project file, then parse it from there
+            body = BodyStream(r)
+            with open(rawprojectfile, 'wb') as savedproject:
+                for chunk in body:
+                    savedproject.write(chunk)
+            QgsMessageLog.logMessage('Project JSON: ' + body.summary())
+            with open(rawprojectfile) as savedproject:
+                prj_json = json.load(savedproject)
+            if str(prj_json) == 'None':
+                os.remove(rawprojectfile)
         if str(statuscode) == "200" and (not str(prj_json) == 'None'): #If project is successfully transferred from StraboSpot
-            with open(rawprojectfile, 'w') as savedproject:
-                json.dump(prj_json, savedproject)
-            #Check the project for Tags. Save any spotids to list.
-            if 'tags' in prj_json:
-                prj_tags = prj_json['tags']
-                tag_spotids = []
-                for tag in prj_tags:
-                    if 'spots' in tag:
-                        for spot in tag['spots']:
-                            tag_spotids.append(spot)
+            #The project's Tags are added to the features of the Spots they list
+            # Child records (Orientation Data, Samples, Tags, etc.) can be written as attribute-only
+            # tables joined to their Spot by SpotID instead of repeating the Spot's geometry
+            childtables = QSettings().value('StraboSpot/childTables', False, type=bool)
+            createrelations = QSettings().value('StraboSpot/createRelations', True, type=bool)
+            flattener = SpotFlattener(prj_json.get('tags'), child_geometry=not childtables)
+            # Processes flattening large datasets (0 for one per CPU) and fewest Spots worth using them for
+            flattenprocesses = QSettings().value('StraboSpot/flattenProcesses', 0, type=int) or None
+            flattenthreshold = QSettings().value('StraboSpot/parallelFlattenThreshold', PARALLEL_THRESHOLD, type=int)
+            # Keep the flattened Spots of each download so only new or modified Spots are flattened next time
+            incremental = QSettings().value('StraboSpot/incrementalFlatten', True, type=bool)
 
             endMessage = "-StraboSpot Project: " + projectname + " downloaded. \r\n"
             endMessage += "-Data saved in folder: " + datafolder + "\r\n"
@@ -489,293 +570,214 @@ class StraboSpot:
                 if db_exists is True:
                     endMessage += "-PostGIS Database, " + postDB + " created.\r\n"
 
-        #Iterate per dataset tuple (dataset's name and id)
+        # Split the full response into point/line/polygon locally (one transfer per dataset)
+        # unless turned off, in which case each geometry is requested from its own endpoint
+        splitgeometries = QSettings().value('StraboSpot/splitGeometriesLocally', True, type=bool)
+        # GET the full datasetspots of every chosen dataset at once through the transfer
+        # engine, each response is saved as soon as it arrives
+        fullrequests = []
         for chosen in chosendatasets:
-            datasetname = chosen[0]
-            datasetid = chosen[1]
-            # GET the datasetspots information from StraboSpot
-            url = 'https://strabospot.org/db/datasetspotsarc/' + str(datasetid)
+            url = 'db/datasetspotsarc/' + str(chosen[1])
             QgsMessageLog.logMessage(url)
-            r = requests.get(url, auth=HTTPBasicAuth(username, password), verify=False )
-            statuscode = r.status_code
-            response = r.json()
-
-            if str(statuscode) == "200":  #If dataset is successfully transferred from StraboSpot
-                # ADD LATER-- FOR EACH DATASET CHOSEN CREATE A "DATASET" FOLDER AND DO THE FOLLOWING
-                # Save the datasetspots response to datafolder
-                # This whole version of the dataset will be called upon during Upload
-                self.dlg.downloadProgresslabel.setText("Downloading: " + datasetname + "\r\n" + "in StraboSpot Project: " + projectname)
-                rawjsonfile = datafolder + "\\" + datasetname + "_" + str(datasetid) + ".json"
-                QgsMessageLog.logMessage('JSON file: ' + str(rawjsonfile))
-                with open(rawjsonfile, 'w') as savedrawjson:
-                    json.dump(response, savedrawjson)
-
-                """Begin Processing the Dataset for use in QGIS: 
-                1.) Check dataset for images. If the dataset contains images AND one of the checkboxes
-                (.jpeg or .tiff) are checked download the images to the datafolder.
-                2.) Parse the raw GeoJSON to make new feature objects out of the nested arrays 
-                (i.e. Orientation Data, Samples, Images, etc.) 
-                3.) Get the edited JSON file into QGIS using New Vector Layer. 
-                4.) (Optional) Make a SpatiaLite database and save each layer file within the database.
-                5.) (Optional) Save into a PostGIS database."""
-
-                geometryList = ['point', 'line', 'polygon']
-                for geotype in geometryList:
-                    url = 'https://strabospot.org/db/datasetspotsarc/' + str(datasetid) + '/' + geotype
-                    r = requests.get(url, auth=HTTPBasicAuth(username, password), verify=False)
-                    statuscode = r.status_code
-                    response = r.json()
-                    if str(statuscode) == "200":  # If dataset is successfully transferred from StraboSpot
-                            if str(response)== 'None': # If dataset doesn't have that geometry keep checking
-                              continue
-                            parsed = response
-                            # Set Up and Advance to the Download Progress Widget
-                            fullDataset = parsed['features']
-                            imageCount = 0
-                            for spot in fullDataset:
-                                spotprop = spot['properties']
-                                if 'images' in spotprop:
-                                    imgJson = spotprop['images']
-                                    for img in imgJson:
-                                        imageCount +=1
-                            QgsMessageLog.logMessage('Images in dataset: ' + str(imageCount))   #Need to work on resizing
-                            downloadedimagescount = 0
-                            if requestImages is True:
-                                #self.dlg.progBarLabel.setText("Preparing to download " + datasetname + " and " + str(imageCount) + " images.") #Need to work on resizing
-                                progBarMax = imageCount + 3  # each downloaded image + (parsing GeoJSON, create layer, save layer(s) to db)
-                                self.dlg.downloadprogressBar.setMaximum(progBarMax)
-                                self.dlg.imageprogLabel.setText(
-                                    "Image " + str(downloadedimagescount) + " of " + str(imageCount) + " downloaded.")
-                                imgFolder = str(datafolder) + "/" + datasetname + "_Images"
-                                try:
-                                    os.makedirs(imgFolder)
-                                except OSError as exception:
-                                    if exception.errno != errno.EEXIST:
-                                        raise
-                                    elif exception.errno == errno.EEXIST:  # If the folder does exist then store in project folder
-                                        imgFolder = datafolder
-                                #Initialize Json for making an images layer
-                                imagesJson = []
-                            else:
-                                progBarMax = 3 #parsing GeoJSON, create layer, save layer(s) to db (Perhaps this should be Spot#?)
-                                self.dlg.downloadprogressBar.setMaximum(progBarMax)
-                                #self.dlg.progBarLabel.setText("Downloading StraboSpot dataset: " + datasetname + "...")
-
-                            # Iterate Spots to reorganize nested arrays and download images
-                            newDatasetJson = []
-                            for spot in fullDataset:
-                                #Gather basic information on the Spot
-                                spotgeometry = spot['geometry']
-                                spotprop = spot['properties']
-                                spotID = spotprop['id']
-                                spotModTS = spotprop['modified_timestamp']
-                                spottime = spotprop['time']
-                                spotdate = spotprop['date']
-                                spotself = spotprop['self']
-                                newSpot = {}
-                                newSpot['type'] = 'Feature'
-                                newSpot['geometry'] = spotgeometry
-                                newSpot['properties'] = {'id': spotID, 'modified_timestamp' : spotModTS,
-                                                       'time' : spottime, 'date' : spotdate, 'self' : spotself}
-                                newDatasetJson.append(newSpot)
-                                #Check if the Spot is associated with any Tags from the project JSON
-                                if spotID in tag_spotids:
-                                    for tag in prj_tags:
-                                        if 'spots' in tag:
-                                            if spotID in tag['spots']:
-                                                QgsMessageLog.logMessage("Tag associated with spotID" + str(spotID))
-                                                newTag = {}
-                                                newTag['type'] = 'Feature'
-                                                newTag['geometry'] = spotgeometry
-                                                newTag['properties'] = {}
-                                                for key in tag:
-                                                    if not key =='spots':
-                                                        newfield = 'tag_'+ key  #To avoid table confusion
-                                                        newTag['properties'][newfield] = tag.get(key)
-                                                newDatasetJson.append(newTag)
-                                #Check for and add special features (nested JSON arrays)
-                                if 'orientation_data' in spotprop:
-                                    #Handle orientation data
-                                    ori_dataJson = spotprop['orientation_data']
-                                    for ori_data in ori_dataJson:   #Each set of measurements in the Orientation Data array
-                                        newOri = {}
-                                        newOri['type'] = 'Feature'
-                                        newOri['geometry'] = spotgeometry
-                                        newOri['properties'] = {}
-                                        for key in ori_data:
-                                            key = key + "_orientation_data"
-                                            newOri['properties'][key] = ori_data.get(key)
-                                        newOri['properties']['SpotID'] = spotID
-                                        newDatasetJson.append(newOri)
-                                if 'rock_unit' in spotprop:
-                                    #Handle rock unit data
-                                    rock_unitJson = spotprop['rock_unit']
-                                    newRockUnit = {}
-                                    newRockUnit['type'] = 'Feature'
-                                    newRockUnit['geometry'] = spotgeometry
-                                    newRockUnit['properties'] = {}
-                                    for key in rock_unitJson:
-                                        key = key + "_rock_unit"
-                                        newRockUnit['properties'][key] = rock_unitJson.get(key)
-                                    newRockUnit['properties']['SpotID'] = spotID
-                                    newDatasetJson.append(newRockUnit)
-                                if 'trace' in spotprop:
-                                    # Handle trace data
-                                    traceJson= spotprop['trace']
-                                    newTrace = {}
-                                    newTrace['type'] = 'Feature'
-                                    newTrace['geometry'] = spotgeometry
-                                    newTrace['properties'] = {}
-                                    for key in traceJson:
-                                        key = key + "_trace"
-                                        newTrace['properties'][key] = traceJson.get(key)
-                                    newTrace['properties']['SpotID'] = spotID
-                                    newDatasetJson.append(newTrace)
-
-                                if 'samples' in spotprop:
-                                    # Handle samples data
-                                    samplesJson = spotprop['samples']
-                                    for samples_data in samplesJson:
-                                        newSample = {}
-                                        newSample['type'] = 'Feature'
-                                        newSample['geometry'] = spotgeometry
-                                        newSample['properties'] = {}
-                                        for key in samples_data:
-                                            key = key + "_samples"
-                                            newSample['properties'][key] = samples_data.get(key)
-                                        newSample['properties']['SpotID'] = spotID
-                                        newDatasetJson.append(newSample)
-
-                                if '_3d_structures' in spotprop:
-                                    _3DJson = spotprop['3d_structures']
-                                    for _3d in _3DJson:
-                                        new3d = {}
-                                        new3d['type'] = 'Feature'
-                                        new3d['geometry'] = spotgeometry
-                                        new3d['properties'] = {}
-                                        for key in _3DJson:
-                                            key = key + "_3d_structures"
-                                            new3d['properties'][key] = _3d.get(key)
-                                        new3d['properties']['SpotID'] = spotID
-                                        newDatasetJson.append(new3d)
-
-                                if 'other_features' in spotprop:
-                                    otherFeatJson = spotprop['other_features']
-                                    for otherFeat in otherFeatJson:
-                                        newOther = {}
-                                        newOther['type'] = 'Feature'
-                                        newOther['geometry'] = spotgeometry
-                                        newOther['properties'] = {}
-                                        for key in otherFeat:
-                                            key = key + "_other_features"
-                                            newOther['properties'][key] = otherFeat.get(key)
-                                        newOther['properties']['SpotID'] = spotID
-                                        newDatasetJson.append(otherFeat)
-
-                                if 'images' in spotprop:
-                                    imgJson = spotprop['images']
-                                    for img in imgJson:
-                                        newImg = {}
-                                        newImg['type'] = 'Feature'
-                                        newImg['geometry'] = spotgeometry
-                                        newImg['properties'] = {}
-                                        for key in img:
-                                            key = key + "_images"
-                                            newImg['properties'][key ] = img.get(key)
-                                        newImg['properties']['SpotID'] = spotID
-                                        # Save the actual image to disk
-                                        imgURL = img.get('self')
-                                        imgID = img.get('id')
-                                        #QgsMessageLog.logMessage(imgURL)
-                                        #If the user requested images be downloaded, retrieve image from StraboSpot
-                                        if requestImages is True:
-                                            r = requests.get(imgURL, auth=HTTPBasicAuth(username, password), verify=False, stream=True)
-                                            statuscode = r.status_code
-                                            #QgsMessageLog.logMessage(imgURL + " accessed with status code " + str(statuscode))
-                                            #If the image was successfully retrieved from StraboSpot, save to file and geoTag
-                                            if str(statuscode) == '200' :
-                                                downloadedimagescount += 1
-                                                imgFile = imgFolder + "/" + str(imgID) + fileExte
-                                                with open(imgFile, 'wb') as f:
-                                                    r.raw.decode_content = True
-                                                    shutil.copyfileobj(r.raw, f)
-                                                if fileExte == ".jpeg":
-                                                    self.geotag_photos(spotgeometry, imgFile, geotype)
-                                            elif str(statuscode) == '404':
-                                                warningMsg = "Image with id: " + str(imgID) + " not downloaded. Click 'Ok' to continue downloading."
-                                                result = QMessageBox.warning(None, "Error", warningMsg, QMessageBox.Ok)
-                                            self.dlg.downloadprogressBar.setValue(downloadedimagescount)
-                                            self.dlg.imageprogLabel.setText(
-                                                "Image " + str(downloadedimagescount) + " of " + str(imageCount) + " successfully downloaded.")
-                                            newImg['properties']['path'] = imgFile
-                                            imagesJson.append(newImg)
-                                        newDatasetJson.append(newImg)
-                            #Convert to GeoJson Array
-                            fullJson = {'type': 'FeatureCollection',
-                                          'features': newDatasetJson}
-                            modifiedJson = json.dumps(fullJson)
-                            # Save newly organized GeoJson array to file
-                            modifiedFileName = datafolder + "\\" + datasetname + "_" + geotype + "_" + str(datasetid) +  ".geojson"
-                            modifiedFileName = str.replace(str(modifiedFileName), "\\", "/")
-                            modifiedJsonDict = json.loads(modifiedJson)
-                            QgsMessageLog.logMessage('Modifided Json file: ' + modifiedFileName)
-                            with open(modifiedFileName, 'w') as savemodJson:
-                                json.dump(modifiedJsonDict, savemodJson)
-
-                            self.dlg.downloadprogressBar.setValue(downloadedimagescount + 1)
-                            self.dlg.progBarLabel.setText("Creating QGIS layer of name: " + datasetname + "...")
-
-                            #Add the modified Json file as a QGIS Layer
-                            layername = datasetname + "_" + geotype
-                            newlayer = QgsVectorLayer(modifiedFileName, layername, "ogr")
-                            if not newlayer.isValid():
-                                QgsMessageLog.logMessage("Layer: " + layername + " is not valid...")
-                            else:
-                                QgsMapLayerRegistry.instance().addMapLayer(newlayer)
-                                # Try Adding the project info to the metadata for upload...
-                                self.dlg.downloadprogressBar.setValue(downloadedimagescount + 2)
-                                #Add to databases
-                                if selDB == "SpatiaLite":
-                                    self.dlg.progBarLabel.setText("Saving QGIS layer to " + selDB + " database")
-                                    table_exists = self.create_spatialite_table(newlayer, newDatasetJson, geotype,SL_conn, SL_cur)
-                                    if table_exists is True:
-                                        endMessage += "-SpatiaLite table for " + newlayer.name() + " successfully created.\r\n"
-                                    else:
-                                        endMessage += "-Error creating SpatiaLite table, " + newlayer.name() + ", see Message Log for details."
-
-                                elif selDB == "PostGIS":
-                                    self.dlg.progBarLabel.setText("Saving QGIS layer to " + selDB + " database")
-                                    endMessage += "-GeoJSON for " + datasetname + " " + geotype + " saved.\r\n"
-                                    resultBool = self.load_geojson_to_postgis(postDB, postGISUser, postGISPass, postGISport, modifiedFileName)
-                                    if resultBool is True:
-                                        endMessage += "-PostGIS table for " + datasetname + "_" + geotype + " saved in " + postDB + " database.\r\n"
-                                    if resultBool is False:
-                                        endMessage += "-Error creating PostGIS table for, " + datasetname + "_" + geotype + ", see Message Log for details."
-
-                            if requestImages is True and (not imagesJson == []) :
-                                allImagesJson = {'type': 'FeatureCollection',
-                                              'features': imagesJson}
-                                fullimgJson = json.dumps(allImagesJson)
-                                imageLayer = datasetname + "_" + geotype + "_images"
-                                newimagelayer = QgsVectorLayer(fullimgJson, imageLayer, "ogr")
-                                '''The following line sets the HTML MapTip Display Text under Layer Properties-> Display tab
-                                From pg. 299 QGIS Pyton Programming Cookbook and 
-                                https://gis.stackexchange.com/questions/123675/how-to-get-image-pop-ups-in-qgis
-                                But in QGIS 3.0 can use 'setMapTipTemplate' 
-                                Be sure in informational videos to tell user where to edit the HTML!'''
-                                newimagelayer.setDisplayField('<b> Image ID: </b> [% "id" %] <br> <img src ="[% "path" %]" width=400 height=400/>')
-                                if not newimagelayer.isValid():
-                                    QgsMessageLog.logMessage("Image layer is not valid...")
-                                else:
-                                    QgsMapLayerRegistry.instance().addMapLayer(newimagelayer)
-
-                            if self.dlg.downloadprogressBar.value == self.dlg.downloadprogressBar.maximum:
-                                self.dlg.close()
-                endMessage += "-StraboSpot Dataset, " + chosen[0] + ", successfully downloaded.\r\n"
-
-            else:
+            rawjsonfile = datafolder + "\\" + chosen[0] + "_" + str(chosen[1]) + ".json"
+            QgsMessageLog.logMessage('JSON file: ' + str(rawjsonfile))
+            # The body is written to the raw file on the engine's thread as it arrives, rather than
+            # left unread on its connection while the datasets before it are processed
+            fullrequests.append(((chosen[0], chosen[1]), url, {'cache': True, 'version': self.cache_version(chosen[2]),
+                                                               'consume': functools.partial(save_body, path=rawjsonfile)}))
+        downloadeddatasets = []
+        # Images already in the download folder are skipped when still correct (StraboSpot/imageMode
+        # 'skip'), downloaded again ('overwrite') or only checked ('verify')
+        imagemode = QSettings().value('StraboSpot/imageMode', 'skip', type=str)
+        self.imagemanifest = ImageManifest()
+        # Geotagging replaces a jpeg rather than writing into it, so jpegs can be hardlinked from the store.
+        # Other images are left as downloaded and could be edited in place, so they are copied
+        imagedownloader = ImageDownloader(self.client, store=self.imagestore, link=(fileExte == ".jpeg"),
+                                          mode=imagemode, manifest=self.imagemanifest,
+                                          thorough=QSettings().value('StraboSpot/verifyImageHashes', False, type=bool))
+        # Images are downloaded on a few threads while the Spots are flattened, the dialog is
+        # updated from the main thread as each one finishes
+        self.imageprogress = ImageProgress(self.image_downloaded)
+        imagepool = ImagePool(imagedownloader, QSettings().value('StraboSpot/imageWorkers', DEFAULT_IMAGE_WORKERS, type=int),
+                              notify=self.imageprogress.report)
+        # Downloaded jpegs are geotagged on threads of their own, the ones that can't be are listed at the end
+        self.geotagpool = GeotagPool(QSettings().value('StraboSpot/geotagWorkers', DEFAULT_GEOTAG_WORKERS, type=int),
+                                     manifest=self.imagemanifest)
+        """Begin Processing the Dataset for use in QGIS: 
+        1.) Check dataset for images. If the dataset contains images AND one of the checkboxes
+        (.jpeg or .tiff) are checked download the images to the datafolder.
+        2.) Parse the raw GeoJSON to make new feature objects out of the nested arrays 
+        (i.e. Orientation Data, Samples, Images, etc.) 
+        3.) Get the edited JSON file into QGIS using New Vector Layer. 
+        4.) (Optional) Make a SpatiaLite database and save each layer file within the database.
+        5.) (Optional) Save into a PostGIS database."""
+
+        downloadextent = None
+        for (datasetname, datasetid), body in self.engine.fetch_all(fullrequests, stream=True):
+            if body.response.status_code != 200:
                 errorMsg = "Dataset, " + datasetname + ", could not be downloaded from StraboSpot."
                 result = QMessageBox.critical(None, "Critical Error", errorMsg, QMessageBox.Ok)
+                continue
+            # ADD LATER-- FOR EACH DATASET CHOSEN CREATE A "DATASET" FOLDER AND DO THE FOLLOWING
+            # The raw datasetspots response saved in datafolder is the whole version of the dataset
+            # called upon during Upload
+            self.dlg.downloadProgresslabel.setText("Downloading: " + datasetname + "\r\n" + "in StraboSpot Project: " + projectname)
+            QgsMessageLog.logMessage('Dataset ' + datasetname + ': ' + body.summary())
+            downloadeddatasets.append((datasetname, body.summary()))
+            if requestImages is True:
+                # The progress bar follows the images of every dataset, see image_downloaded
+                imgFolder = str(datafolder) + "/" + datasetname + "_Images"
+                try:
+                    os.makedirs(imgFolder)
+                except OSError as exception:
+                    if exception.errno != errno.EEXIST:
+                        raise
+                    elif exception.errno == errno.EEXIST and imagemode == OVERWRITE:  # If the folder does exist then store in project folder
+                        imgFolder = datafolder
+            else:
+                progBarMax = 3 #parsing GeoJSON, create layer, save layer(s) to db (Perhaps this should be Spot#?)
+                self.dlg.downloadprogressBar.setMaximum(progBarMax)
+                #self.dlg.progBarLabel.setText("Downloading StraboSpot dataset: " + datasetname + "...")
+
+            # The image features carry the path their image is saved to, so the image settings are part
+            # of the snapshots' signature as well
+            imagesettings = [requestImages, fileExte, imgFolder] if requestImages is True else [False]
+            signature = flattener.signature(imagesettings)
+            images = []
+
+            def visit(geotype, spotindex, kind, record, feature):
+                #If the user requested images be downloaded, note the image to retrieve from StraboSpot
+                if kind == 'images':
+                    images.append((geotype, spotindex, feature.get('self_images'), feature.get('id_images')))
+                    if requestImages is True:
+                        feature.set('path', imgFolder + "/" + str(feature.get('id_images')) + fileExte)
+
+            # Spots unchanged since the last download (same modified_timestamp) reuse the features saved then
+            def snapshot_for(geotype):
+                snapshotfile = datafolder + "/" + datasetname + "_" + geotype + "_" + str(datasetid) + ".flat"
+                if not incremental:
+                    if os.path.exists(snapshotfile):
+                        os.remove(snapshotfile)
+                    snapshotfile = None
+                return FlattenSnapshot(snapshotfile, signature)
+
+            # Flatten the Spots' nested arrays into a layer per kind of feature as they are parsed, a chunk at
+            # a time (on a pool of processes for large datasets). Only the layers are kept, in columns rather
+            # than as GeoJSON dicts, so memory does not grow with the Spots of the dataset
+            datasetflattener = DatasetFlattener(flattener, snapshot_for, FeatureTable, flattenprocesses,
+                                                flattenthreshold, visit=visit)
+            if splitgeometries:
+                rawjsonfile = datafolder + "\\" + datasetname + "_" + str(datasetid) + ".json"
+                for spot in FeatureStream(file_chunks(rawjsonfile)):
+                    datasetflattener.add(spot)
+            else:
+                self.stream_geometry_collections(datasetid, datasetflattener)
+            QgsMessageLog.logMessage('Images in dataset: ' + str(len(images)))   #Need to work on resizing
+
+            for geotype in datasetflattener.finish():
+                layers = datasetflattener.layers[geotype]
+                snapshot = datasetflattener.snapshots[geotype]
+                spotlayer = None
+                # Bounding boxes and the point each Spot's images are geotagged with, for every Spot at once
+                spotcoords = SpotCoordinates(layers[SPOT])
+                geotagpoints = spotcoords.representative_points()
+                downloadextent = union_extent(downloadextent, spotcoords.extent())
+                QgsMessageLog.logMessage(datasetname + " " + geotype + " extent: " + str(spotcoords.extent()))
+                if requestImages is True:
+                    for imagegeotype, spotindex, imgURL, imgID in images:
+                        if imagegeotype == geotype:
+                            #Queue the image, it is retrieved from StraboSpot (retrying and resuming dropped
+                            #transfers) and geoTagged in the background. Failures are listed once the download is done.
+                            imgFile = imgFolder + "/" + str(imgID) + fileExte
+                            imagepool.submit(imgURL, imgFile, imgID, geotagpoints[spotindex])
+                    QCoreApplication.processEvents()
+
+                if incremental:
+                    snapshot.save()
+                QgsMessageLog.logMessage(datasetname + " " + geotype + ": " + str(snapshot.reflattened) +
+                                         " Spots flattened, " + str(snapshot.reused) + " unchanged")
+                if requestImages is not True:
+                    self.dlg.downloadprogressBar.setValue(1)
+                self.dlg.progBarLabel.setText("Creating QGIS layers for: " + datasetname + "...")
+                for kind, layerJson in layers.items():
+                    if len(layerJson) == 0:
+                        continue
+                    layername = flattener.layer_name(datasetname + "_" + geotype, kind)
+                    # Save the layer's features as a GeoJson file of their own
+                    modifiedFileName = datafolder + "\\" + layername + "_" + str(datasetid) + ".geojson"
+                    modifiedFileName = str.replace(str(modifiedFileName), "\\", "/")
+                    # Only rewritten if a Spot was added, modified or removed since the last download
+                    if snapshot.changed or not os.path.exists(modifiedFileName):
+                        QgsMessageLog.logMessage('Modifided Json file: ' + modifiedFileName)
+                        with open(modifiedFileName, 'w') as savemodJson:
+                            layerJson.write_geojson(savemodJson)
+
+                    #Add the modified Json file as a QGIS Layer
+                    newlayer = QgsVectorLayer(modifiedFileName, layername, "ogr")
+                    if not newlayer.isValid():
+                        QgsMessageLog.logMessage("Layer: " + layername + " is not valid...")
+                        continue
+                    if kind == 'images' and requestImages is True:
+                        '''The following line sets the HTML MapTip Display Text under Layer Properties-> Display tab
+                        From pg. 299 QGIS Pyton Programming Cookbook and
+                        https://gis.stackexchange.com/questions/123675/how-to-get-image-pop-ups-in-qgis
+                        But in QGIS 3.0 can use 'setMapTipTemplate'
+                        Be sure in informational videos to tell user where to edit the HTML!'''
+                        newlayer.setDisplayField('<b> Image ID: </b> [% "id_images" %] <br> <img src ="[% "path" %]" width=400 height=400/>')
+                    QgsMapLayerRegistry.instance().addMapLayer(newlayer)
+                    if kind == SPOT:
+                        spotlayer = newlayer
+                    elif childtables and createrelations and spotlayer is not None:
+                        self.relate_to_spots(spotlayer, newlayer)
+                    layergeotype = None if childtables and kind != SPOT else geotype
+                    #Add to databases
+                    if selDB == "SpatiaLite":
+                        self.dlg.progBarLabel.setText("Saving QGIS layer to " + selDB + " database")
+                        table_exists = self.create_spatialite_table(newlayer, layerJson, layergeotype, SL_conn, SL_cur)
+                        if table_exists is True:
+                            endMessage += "-SpatiaLite table for " + newlayer.name() + " successfully created.\r\n"
+                        else:
+                            endMessage += "-Error creating SpatiaLite table, " + newlayer.name() + ", see Message Log for details."
+
+                    elif selDB == "PostGIS":
+                        self.dlg.progBarLabel.setText("Saving QGIS layer to " + selDB + " database")
+                        endMessage += "-GeoJSON for " + layername + " saved.\r\n"
+                        resultBool = self.load_geojson_to_postgis(postDB, postGISUser, postGISPass, postGISport, modifiedFileName)
+                        if resultBool is True:
+                            endMessage += "-PostGIS table for " + layername + " saved in " + postDB + " database.\r\n"
+                        if resultBool is False:
+                            endMessage += "-Error creating PostGIS table for, " + layername + ", see Message Log for details."
+                    QCoreApplication.processEvents()
+                if requestImages is not True:
+                    self.dlg.downloadprogressBar.setValue(2)
+
+                if self.dlg.downloadprogressBar.value == self.dlg.downloadprogressBar.maximum:
+                    self.dlg.close()
+            # Let go of this dataset's layers before the next one is parsed
+            datasetflattener = layers = spotcoords = geotagpoints = None
+        for datasetname, summary in downloadeddatasets:
+            endMessage += "-" + datasetname + ": " + summary + "\r\n"
+        for datasetname, summary in downloadeddatasets:
+            endMessage += "-StraboSpot Dataset, " + datasetname + ", successfully downloaded.\r\n"
+        if downloadextent is not None:
+            self.zoom_to_extent(downloadextent)
+        self.dlg.progBarLabel.setText("Finishing image downloads...")
+        imagepool.wait(QCoreApplication.processEvents)
+        imagepool.close()
+        self.geotagpool.wait(QCoreApplication.processEvents)
+        self.geotagpool.close()
+        self.imagestore.save()
+        self.imagemanifest.save()
+        if imagedownloader.skipped:
+            endMessage += "-" + str(imagedownloader.skipped) + " images already downloaded were kept.\r\n"
+        if imagemode == VERIFY:
+            endMessage += "-Images verified, " + str(len(imagedownloader.problems)) + " missing or corrupt.\r\n"
+        if imagedownloader.stored:
+            QgsMessageLog.logMessage(str(imagedownloader.stored) + " images taken from the local image store")
+        for failure in imagedownloader.summary() + self.geotagpool.summary():
+            QgsMessageLog.logMessage(failure)
+            endMessage += "-" + failure + "\r\n"
+        QgsMessageLog.logMessage('StraboSpot requests: ' + self.client.controller.summary())
         if selDB == "SpatiaLite":
             SL_conn.commit()
             SL_conn.close()
@@ -784,6 +786,61 @@ class StraboSpot:
         #Notify user of what was downloaded and created
         QMessageBox.information(None, "Download Complete", endMessage, QMessageBox.Ok)
 
+    def image_downloaded(self, done, queued, imgID, imgFile, result, point):
+        # Called on the main thread for every image the pool has finished with
+        # An image kept because it matches the server's copy has not been geotagged or recorded yet either
+        if result in (DOWNLOADED, MATCHED):
+            # Kept as written (and geotagged) so the next download can tell it is still correct
+            if fileExte == ".jpeg":
+                self.geotagpool.submit(imgFile, point, imgID)
+            else:
+                self.imagemanifest.record(imgFile)
+        self.dlg.downloadprogressBar.setMaximum(queued)
+        self.dlg.downloadprogressBar.setValue(done)
+        self.dlg.imageprogLabel.setText("Image " + str(done) + " of " + str(queued) + " done.")
+
+    def zoom_to_extent(self, extent):
+        # Show everything downloaded, extent is (xmin, ymin, xmax, ymax) in WGS84
+        canvas = self.iface.mapCanvas()
+        rectangle = QgsRectangle(extent[0], extent[1], extent[2], extent[3])
+        transform = QgsCoordinateTransform(QgsCoordinateReferenceSystem(4326), canvas.mapSettings().destinationCrs())
+        rectangle = transform.transformBoundingBox(rectangle)
+        if rectangle.width() == 0 and rectangle.height() == 0:  # A single point, keep the current scale
+            canvas.setCenter(rectangle.center())
+        else:
+            canvas.setExtent(rectangle)
+        canvas.refresh()
+
+    def relate_to_spots(self, spotlayer, childlayer):
+        # Add a QGIS relation so a Spot's child records show up in its attribute form
+        relation = QgsRelation()
+        relation.setRelationId(childlayer.id() + "_spot")
+        relation.setRelationName(childlayer.name())
+        relation.setReferencingLayer(childlayer.id())
+        relation.setReferencedLayer(spotlayer.id())
+        relation.addFieldPair('SpotID', 'id')
+        if relation.isValid():
+            QgsProject.instance().relationManager().addRelation(relation)
+        else:
+            QgsMessageLog.logMessage("Could not relate " + childlayer.name() + " to " + spotlayer.name())
+
+    def cache_version(self, modified_timestamp):
+        # A cached response saved under the same modified_timestamp is used without asking StraboSpot
+        if modified_timestamp is None:
+            return None
+        return str(modified_timestamp)
+
+    def stream_geometry_collections(self, datasetid, datasetflattener):
+        # GET the datasetspotsarc/{id}/{geotype} collections one after another, each Spot handed to the
+        # flattener as it is parsed from the body
+        for geotype in GEOMETRY_TYPES:
+            r = self.client.get('db/datasetspotsarc/' + str(datasetid) + '/' + geotype, stream=True)
+            if r.status_code != 200:
+                r.close()
+                continue
+            for spot in FeatureStream(BodyStream(r)):
+                datasetflattener.add(spot)
+
     def setJpeg(self):
         global fileExte
         fileExte = ".jpeg"
@@ -806,72 +863,6 @@ class StraboSpot:
         global selDB
         selDB = "SpatiaLite"
 
-    def geotag_photos(self, spotgeo, imageName, geoType):
-        """Based off guidance: from https://stackoverflow.com/questions/44636152/how-to-modify-exif-data-in-python
-        and Issues documentation at https://github.com/hMatoba/Piexif
-        KeyError handling from: https://github.com/getnikola/nikola/blob/master/nikola/image_processing.py"""
-
-        # Open image and try to get Exif dictionary
-        ImageFile.LOAD_TRUNCATED_IMAGES = True
-        coordinates = spotgeo['coordinates']
-        savedImg = Image.open(imageName)
-        try:
-            exif_dict = piexif.load(savedImg.info['exif'])
-        except KeyError:
-            exif_dict = None
-
-        if exif_dict is not None:
-            # Get the lat/long info
-            if geoType == "point":
-                longitude= coordinates[0]
-                latitude = coordinates[1]
-            # Can only store one lat/long pair to Exif, so pull the first set of coordinates
-            if geoType == "line":
-                longitude = coordinates[0][0]
-                latitude = coordinates[0][1]
-            if geoType == "polygon":
-                longitude = coordinates[0][0][0]
-                latitude = coordinates[0][0][1]
-
-            # Set Long/Lat Exif Refs
-            if longitude < 0:
-                exif_dict['GPS'][piexif.GPSIFD.GPSLongitudeRef] = "W"
-            else:
-                exif_dict['GPS'][piexif.GPSIFD.GPSLongitudeRef] = "E"
-            if latitude < 0:
-                exif_dict['GPS'][piexif.GPSIFD.GPSLatitudeRef] = "S"
-            else:
-                exif_dict['GPS'][piexif.GPSIFD.GPSLatitudeRef] = "N"
-
-            # Convert from decimal degrees to degrees, minutes, seconds
-            # Longitude
-            temp_val = abs(longitude)
-            long_deg = math.trunc(temp_val)
-            temp_val = ((temp_val - long_deg)*60)
-            long_mins = math.trunc(temp_val)
-            temp_val= ((temp_val - long_mins)*60)
-            long_sec = math.trunc(temp_val*1000)
-
-            QgsMessageLog.logMessage("Long DMS: " + str(long_deg)+ "," + str(long_mins) + "," + str(long_sec))
-            # Latitude
-            temp_val = abs(latitude)
-            lat_deg = math.trunc(temp_val)
-            temp_val = ((temp_val - lat_deg)*60)
-            lat_mins = math.trunc(temp_val)
-            temp_val= ((temp_val - lat_mins)*60)
-            lat_sec = math.trunc(temp_val*1000)
-
-            QgsMessageLog.logMessage("Lat DMS: " + str(lat_deg) + "," + str(lat_mins) + "," + str(lat_sec))
-            #Save info to Exif
-            exif_dict['GPS'][piexif.GPSIFD.GPSLongitude] = [(int(long_deg),1), (int(long_mins),1), (long_sec,1000)]
-            exif_dict['GPS'][piexif.GPSIFD.GPSLatitude] = [(int(lat_deg),1), (int(lat_mins),1), (lat_sec,1000)]
-            # Save edited Exif to Image
-            exif_bytes = piexif.dump(exif_dict)
-            savedImg.save(imageName, "jpeg", exif=exif_bytes)
-        else:
-            warningMsg = "Image file: \n" + imageName + "\n could not be geotagged. Click 'Ok' to continue downloading."
-            result = QMessageBox.warning(None, "Error", warningMsg, QMessageBox.Ok)
-
     def create_spatialite_db(self, folderpath, project_name):
         # Create/Connect to the database
         slDB = folderpath + "\\" + project_name + datetime.datetime.now().strftime("_%m-%d-%y") + ".sqlite"
@@ -894,18 +885,19 @@ class StraboSpot:
         layername = qgislayer.name()
         exe_error = ""
 
-        for field in qgislayer.pendingFields():
-            fieldtype = field.typeName()
+        # The field types were worked out while the layer's features were flattened, so the written
+        # GeoJSON doesn't need to be read back to find them
+        for fieldname, fieldtype in layerjson.schema():
             if fieldtype == "String":
                 fieldtype = 'Text'
             elif fieldtype == "Integer64":
                 fieldtype = 'BIGINT'
             elif fieldtype == "DateTime":
                 fieldtype = "TIMESTAMP"
-            if field.name() == 'id':
+            if fieldname == 'id':
                 fieldtype = "PRIMARY KEY"
 
-            fields.append(field.name() + " " + fieldtype)
+            fields.append(fieldname + " " + fieldtype)
         # https://www.gaia-gis.it/spatialite-2.4.0-4/splite-python.html
         #Create the table using the list of fields and field types
         sqlstatement = "CREATE TABLE IF NOT EXISTS " + layername + "(" + ",".join(fields) + ");"
@@ -917,21 +909,22 @@ class StraboSpot:
             return False
 
         dbconnection.commit()
-        # Add a geometry column to the table
+        # Add a geometry column to the table, attribute-only child tables (geometrytype None) have none
         if geometrytype == 'line':
             tablegeo = 'linestring'
         else:
             tablegeo = geometrytype
 
-        #Add a column for the geometry- cannot be combined with create table sql above!
-        sqlstatement = "SELECT AddGeometryColumn('" + layername + "', 'geom', 4326," + "'" + tablegeo.capitalize() + "', 'XY');"
-        QgsMessageLog.logMessage(sqlstatement)
-        try:
-            dbcursor.execute(sqlstatement)
-        except db.Error, exe_error:
-            QgsMessageLog.logMessage("Error Adding Geometry Column to SpatiaLite Table: " + exe_error)
-            return False
-        dbconnection.commit()
+        if tablegeo is not None:
+            #Add a column for the geometry- cannot be combined with create table sql above!
+            sqlstatement = "SELECT AddGeometryColumn('" + layername + "', 'geom', 4326," + "'" + tablegeo.capitalize() + "', 'XY');"
+            QgsMessageLog.logMessage(sqlstatement)
+            try:
+                dbcursor.execute(sqlstatement)
+            except db.Error, exe_error:
+                QgsMessageLog.logMessage("Error Adding Geometry Column to SpatiaLite Table: " + exe_error)
+                return False
+            dbconnection.commit()
 
         # Add rows to table using the geojson from saving the layer:
         for spot in layerjson:
@@ -954,17 +947,19 @@ class StraboSpot:
                     spotvals.append("NULL")
                 else:  # Everything else *should* be a string, so quote it
                     spotvals.append("'" + valuetoadd + "'")
-            spotkeys.append('geom')
-            #Construct the geometry JSON object to add to the table... Be sure to test this with LineString and Polygon!!!!!!!!
-            strgeom = str(spotgeom['coordinates'])
-            modgeom = '{"type": ' + '"' + tablegeo.capitalize() + '"' + \
-                      ',"crs":{"type":"name","properties":{"name":"EPSG:4326"}},"coordinates":' + \
-                      strgeom + '}'
-            # Execute SQL statement inserting the row
             keys = ",".join(spotkeys)
             vals = ",".join([unicode(i) for i in spotvals])
-            sqlstatement = "INSERT INTO " + layername + "(" + keys + ") VALUES " + "(" + vals + ",GeomFromGeoJSON('" + modgeom + "'))"
-            QgsMessageLog.logMessage(json.dumps(modgeom))
+            if tablegeo is None:
+                sqlstatement = "INSERT INTO " + layername + "(" + keys + ") VALUES " + "(" + vals + ")"
+            else:
+                #Construct the geometry JSON object to add to the table... Be sure to test this with LineString and Polygon!!!!!!!!
+                strgeom = str(spotgeom['coordinates'])
+                modgeom = '{"type": ' + '"' + tablegeo.capitalize() + '"' + \
+                          ',"crs":{"type":"name","properties":{"name":"EPSG:4326"}},"coordinates":' + \
+                          strgeom + '}'
+                # Execute SQL statement inserting the row
+                sqlstatement = "INSERT INTO " + layername + "(" + keys + ",geom) VALUES " + "(" + vals + ",GeomFromGeoJSON('" + modgeom + "'))"
+                QgsMessageLog.logMessage(json.dumps(modgeom))
 
             QgsMessageLog.logMessage(sqlstatement)
             try:
@@ -1182,8 +1177,8 @@ class StraboSpot:
         if sel_upload_method == "Overwrite":
             #Go through the process to signal to StraboSpot to save a Version of the project
             #Get project json
-            url = 'https://strabospot.org/db/project/' + projectid
-            r = requests.get(url, auth=HTTPBasicAuth(username, password), verify=False)
+            url = 'db/project/' + projectid
+            r = self.client.get(url)
             statuscode = r.status_code
             QgsMessageLog.logMessage(('Get projects code: ' + str(statuscode)))
             response = r.json()
@@ -1192,9 +1187,8 @@ class StraboSpot:
             QgsMessageLog.logMessage("Modified Response: " + response)
 
             #Post Modified Project JSON to StraboSpot
-            url = 'https://strabospot.org/db/project/' + projectid
-            headers = {'Content-type': 'application/json', 'Accept-Charset': 'UTF-8'}
-            r = requests.post(url, auth=HTTPBasicAuth(username, password), headers=headers, json=response,verify=False)
+            url = 'db/project/' + projectid
+            r = self.client.post(url, json=response)
             statuscode = r.status_code
             QgsMessageLog.logMessage(('Post project code: ' + str(statuscode)))
 
@@ -1202,25 +1196,24 @@ class StraboSpot:
             for lyr in upload_layer_list:
                 datasetid = lyr[2]
                 #Get All Spots in the dataset the layer is associated with
-                url = 'https://strabospot.org/db/datasetspots/' + str(datasetid)
-                r = requests.get(url, auth=HTTPBasicAuth(username, password), verify=False)
+                url = 'db/datasetspots/' + str(datasetid)
+                r = self.client.get(url)
                 statuscode = r.status_code
                 response = r.json()
                 if str(statuscode) == "200":
                     dataset_spots = response['features']    #This will later be compared to the geojson from the lyr
 
                     #Get the StraboSpot dataset JSON
-                    url = 'https://strabospot.org/db/dataset/' + str(datasetid)
-                    r = requests.get(url, auth=HTTPBasicAuth(username, password), verify=False)
+                    url = 'db/dataset/' + str(datasetid)
+                    r = self.client.get(url)
                     statuscode = r.status_code
                     response = r.json()
                     if str(statuscode) == "200":
                         response['modified_timestamp'] = time.time()
 
                     #Update the StraboSpot dataset JSON
-                    url = 'https://strabospot.org/db/dataset/' + str(datasetid)
-                    headers = {'Content-type': 'application/json', 'Accept-Charset': 'UTF-8'}
-                    r = requests.post(url, auth=HTTPBasicAuth(username, password), headers=headers, json=response, verify=False)
+                    url = 'db/dataset/' + str(datasetid)
+                    r = self.client.post(url, json=response)
                     statuscode = r.status_code
                     QgsMessageLog.logMessage(('Post project code: ' + str(statuscode)))
 
@@ -1241,11 +1234,11 @@ class StraboSpot:
                 new_dataset_json = {"id": timeStamp, "name": lyr[0], \
 	                                "modified_timestamp":unixTime ,"date": datetime.datetime.utcnow()}
                 datasetid = lyr[2]
-                url = 'https://strabospot.org/db/dataset/' + str(datasetid)
-                headers = {'Content-type': 'application/json', 'Accept-Charset': 'UTF-8'}
-                r = requests.post(url, auth=HTTPBasicAuth(username, password), headers=headers, json=new_dataset_json,
-                                  verify=False)
+                url = 'db/dataset/' + str(datasetid)
+                r = self.client.post(url, json=new_dataset_json)
                 statuscode = r.status_code
+        # The uploads changed the user's projects, so the listings are fetched again when needed
+        self.listings.clear()
 
     def run(self):
         """Run method that performs all the real work"""
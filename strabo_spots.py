@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ StraboSpot spot collection helpers
+                                 A QGIS plugin
+ Download and Upload Strabo data to and from QGIS.
+                             -------------------
+        begin                : 2017-06-15
+        git sha              : $Format:%H$
+        copyright            : (C) 2017 by Emily Bunse - University of Kansas
+        email                : egbunse@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+ Helpers for working with the datasetspotsarc GeoJSON returned by StraboSpot.
+ Nothing in here depends on QGIS so it can be tested on its own.
+"""
+
+# Order the geometry layers are built in
+GEOMETRY_TYPES = ['point', 'line', 'polygon']
+# GeoJSON geometry.type --> the geometry name used by the datasetspotsarc/{id}/{geotype} endpoints
+GEOJSON_GEOMETRY_TYPES = {'Point': 'point', 'MultiPoint': 'point',
+                          'LineString': 'line', 'MultiLineString': 'line',
+                          'Polygon': 'polygon', 'MultiPolygon': 'polygon'}
+
+
+def geometry_type(spot):
+    """Return 'point', 'line' or 'polygon' for a spot, None if it has no usable geometry."""
+    geometry = spot.get('geometry')
+    if not geometry:
+        return None
+    return GEOJSON_GEOMETRY_TYPES.get(geometry.get('type'))
+
+
+def split_by_geometry(features):
+    """Partition a full datasetspotsarc response by geometry type.
+
+    This gives the same spots as the datasetspotsarc/{id}/point, /line and
+    /polygon endpoints without downloading the dataset again for each one.
+
+    :param features: The datasetspotsarc/{id} response, or any iterable of its
+        spots (e.g. a strabo_stream.FeatureStream).
+    :type features: dict, iterable
+
+    :returns: {geotype: FeatureCollection} holding only the geometry types the
+        dataset actually has, spots without a geometry are left out.
+    :rtype: dict
+    """
+    collections = {}
+    if not features:
+        return collections
+    if isinstance(features, dict):
+        features = features.get('features') or []
+    for spot in features:
+        geotype = geometry_type(spot)
+        if geotype is None:
+            continue
+        if geotype not in collections:
+            collections[geotype] = {'type': 'FeatureCollection', 'features': []}
+        collections[geotype]['features'].append(spot)
+    return collections
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ StraboSpot streaming GeoJSON reader
+                                 A QGIS plugin
+ Download and Upload Strabo data to and from QGIS.
+                             -------------------
+        begin                : 2017-06-15
+        git sha              : $Format:%H$
+        copyright            : (C) 2017 by Emily Bunse - University of Kansas
+        email                : egbunse@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+ Reads the 'features' of a GeoJSON FeatureCollection one at a time from an
+ HTTP body (any iterable of byte chunks) instead of holding the whole
+ response in memory as Python dicts.  Only the feature being parsed and
+ the current chunk are kept in the buffer.
+
+ Bodies sent gzip/deflate compressed are decoded chunk by chunk on the way
+ in, BodyStream keeps count of the bytes on the wire and after decoding.
+"""
+import codecs
+import json
+import re
+
+# Bytes read from the response body at a time
+CHUNK_SIZE = 64 * 1024
+
+STRUCTURE = re.compile(r'["{}\[\],:]')
+STRING = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"')
+NEXT_VALUE = re.compile(r'[^\s,]')
+SCALAR_END = re.compile(r'[,\]]')
+
+
+class BodyStream(object):
+    """Decoded chunks of a response body, counting compressed and decoded bytes."""
+
+    def __init__(self, response, chunk_size=CHUNK_SIZE):
+        self.response = response
+        self.chunk_size = chunk_size
+        self.encoding = response.headers.get('Content-Encoding', 'identity')
+        self.decoded_bytes = 0
+
+    def __iter__(self):
+        for chunk in self.response.iter_content(self.chunk_size):
+            self.decoded_bytes += len(chunk)
+            yield chunk
+
+    @property
+    def wire_bytes(self):
+        """Bytes received from the server, before decompression."""
+        tell = getattr(self.response.raw, 'tell', None)
+        if tell is None:
+            return self.decoded_bytes
+        return tell()
+
+    def summary(self):
+        if getattr(self.response, 'from_cache', False):
+            return "%s bytes read from the local cache" % self.decoded_bytes
+        return "%s bytes transferred (%s), %s bytes of JSON" % (self.wire_bytes, self.encoding, self.decoded_bytes)
+
+    def close(self):
+        self.response.close()
+
+
+def save_body(response, path, chunk_size=CHUNK_SIZE):
+    """Write a streamed 200 response's decoded body to path, other responses are just closed.
+
+    Meant to run on a transfer engine's worker (see TransferEngine.submit's
+    consume), so the body is read as soon as it arrives rather than left
+    waiting on an open connection.
+
+    :returns: The body read, its response tells the status and summary()
+        what was transferred.
+    :rtype: BodyStream
+    """
+    body = BodyStream(response, chunk_size)
+    if response.status_code != 200:
+        response.close()
+        return body
+    with open(path, 'wb') as bodyfile:
+        for chunk in body:
+            bodyfile.write(chunk)
+    return body
+
+
+def file_chunks(path, chunk_size=CHUNK_SIZE):
+    """Byte chunks of a file, e.g. a body saved by save_body for a FeatureStream."""
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            yield chunk
+
+
+class FeatureStream(object):
+    """Iterator over the features of a FeatureCollection as its body arrives.
+
+    Every chunk read is also written to tee (e.g. the raw <dataset>_<id>.json
+    file) so saving the raw response and parsing it happen in one pass.  A
+    body that is not a FeatureCollection (e.g. null) yields no features.
+    """
+
+    def __init__(self, chunks, tee=None):
+        """Constructor.
+
+        :param chunks: Byte chunks of the response body, e.g.
+            response.iter_content(CHUNK_SIZE).
+        :type chunks: iterable
+
+        :param tee: Optional binary file object receiving every chunk as read.
+        :type tee: file
+        """
+        self.chunks = iter(chunks)
+        self.tee = tee
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = u''
+        self.pos = 0
+        self.finished = False
+        # Bytes read from the body and features parsed so far
+        self.bytes_read = 0
+        self.count = 0
+
+    def _read(self):
+        """Append the next chunk to the buffer, returns False at the end of the body."""
+        if self.finished:
+            return False
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            self.finished = True
+            self.buffer = self.buffer[self.pos:] + self.decoder.decode(b'', True)
+            self.pos = 0
+            return False
+        if self.tee is not None:
+            self.tee.write(chunk)
+        self.bytes_read += len(chunk)
+        # Drop the text already parsed so the buffer only holds the current feature
+        self.buffer = self.buffer[self.pos:] + self.decoder.decode(chunk)
+        self.pos = 0
+        return True
+
+    def drain(self):
+        """Read (and tee) whatever is left of the body without parsing it."""
+        while self._read():
+            self.pos = len(self.buffer)
+
+    def _find_features(self):
+        """Move past the '[' opening the top-level 'features' array.
+
+        :returns: False if the body has no features array.
+        """
+        depth = 0
+        lastkey = None
+        key = None
+        while True:
+            match = STRUCTURE.search(self.buffer, self.pos)
+            if match is None:
+                self.pos = len(self.buffer)
+                if not self._read():
+                    return False
+                continue
+            char = match.group()
+            start = match.start()
+            if char == '"':
+                string = STRING.match(self.buffer, start)
+                if string is None:  # The string carries on into the next chunk
+                    self.pos = start
+                    if not self._read():
+                        return False
+                    continue
+                lastkey = string.group()
+                self.pos = string.end()
+                continue
+            self.pos = start + 1
+            if char == ':':
+                if depth == 1:
+                    key = json.loads(lastkey)
+            elif char == ',':
+                key = None
+            elif char in '{[':
+                depth += 1
+                if char == '[' and depth == 2 and key == 'features':
+                    return True
+            else:
+                depth -= 1
+
+    def _next_feature(self):
+        """Parse the next element of the features array, None once it ends."""
+        while True:
+            match = NEXT_VALUE.search(self.buffer, self.pos)
+            if match is not None:
+                break
+            self.pos = len(self.buffer)
+            if not self._read():
+                raise ValueError('StraboSpot response ended inside the features array')
+        self.pos = match.start()
+        if match.group() == ']':
+            self.pos += 1
+            return None
+
+        # Scan to the end of this value, keeping track of nesting and strings
+        depth = 0
+        scan = self.pos
+        while True:
+            if depth == 0 and self.buffer[self.pos] not in '{[':
+                match = SCALAR_END.search(self.buffer, scan)
+            else:
+                match = STRUCTURE.search(self.buffer, scan)
+            if match is None:
+                offset = len(self.buffer) - self.pos
+                if not self._read():
+                    raise ValueError('StraboSpot response ended inside a feature')
+                scan = offset
+                continue
+            char = match.group()
+            start = match.start()
+            if depth == 0 and char in ',]':  # End of a scalar value
+                scan = start
+                break
+            if char == '"':
+                string = STRING.match(self.buffer, start)
+                if string is None:
+                    offset = start - self.pos
+                    if not self._read():
+                        raise ValueError('StraboSpot response ended inside a feature')
+                    scan = offset
+                    continue
+                scan = string.end()
+                continue
+            scan = start + 1
+            if char in '{[':
+                depth += 1
+            elif char in '}]':
+                depth -= 1
+                if depth == 0:
+                    break
+        feature = json.loads(self.buffer[self.pos:scan])
+        self.pos = scan
+        return feature
+
+    def __iter__(self):
+        if self._find_features():
+            while True:
+                feature = self._next_feature()
+                if feature is None:
+                    break
+                self.count += 1
+                yield feature
+        # Make sure the rest of the body still reaches the tee
+        self.drain()
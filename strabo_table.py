@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ StraboSpot columnar feature table
+                                 A QGIS plugin
+ Download and Upload Strabo data to and from QGIS.
+                             -------------------
+        begin                : 2017-06-15
+        git sha              : $Format:%H$
+        copyright            : (C) 2017 by Emily Bunse - University of Kansas
+        email                : egbunse@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+ Holds a layer of flattened features as columns instead of a list of
+ GeoJSON dicts: NumPy arrays for coordinates and numeric fields and
+ dictionary-encoded strings.  Geometries shared by a spot's child features
+ are stored once.  Features are turned back into GeoJSON dicts one at a
+ time as the GeoJSON, SpatiaLite and PostGIS writers read them.
+
+ Each column's type is worked out as values are appended, so the layer's
+ schema is known as soon as it is built, without re-reading the written
+ GeoJSON.
+"""
+import json
+import re
+
+import numpy
+
+try:
+    string_types = (str, unicode)
+    integer_types = (int, long)
+except NameError:  # Python 3
+    string_types = (str,)
+    integer_types = (int,)
+
+# Nesting depth of the 'coordinates' of each GeoJSON geometry type
+GEOMETRY_DEPTHS = {'Point': 0, 'MultiPoint': 1, 'LineString': 1, 'Polygon': 2,
+                   'MultiLineString': 2, 'MultiPolygon': 3}
+
+# State of a field in a row
+MISSING = 0
+NULL = 1
+VALUE = 2
+
+INITIAL_CAPACITY = 64
+
+# ISO 8601 date-times as StraboSpot writes them (e.g. 2017-06-15T10:00:00.000Z), OGR reads these as DateTime
+DATETIME = re.compile(r'^\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}:?\d{2})?$')
+
+# Field type (same names as OGR/QGIS) of each kind of column
+FIELD_TYPES = {None: 'String', 'bool': 'Boolean', 'int': 'Integer64', 'float': 'Real', 'str': 'String',
+               'object': 'String'}
+
+
+class GrowableArray(object):
+    """A 1-D NumPy array appended to one value at a time, growing by doubling."""
+
+    def __init__(self, dtype, capacity=INITIAL_CAPACITY):
+        self.data = numpy.empty(capacity, dtype)
+        self.size = 0
+
+    def _reserve(self, count):
+        if self.size + count > len(self.data):
+            grown = numpy.empty(max(len(self.data) * 2, self.size + count), self.data.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+
+    def append(self, value):
+        self._reserve(1)
+        self.data[self.size] = value
+        self.size += 1
+
+    def extend(self, values):
+        self._reserve(len(values))
+        self.data[self.size:self.size + len(values)] = values
+        self.size += len(values)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        return self.data[:self.size][index]
+
+    def array(self):
+        """The values appended so far (a view, not a copy)."""
+        return self.data[:self.size]
+
+
+class Column(object):
+    """One property field, typed by the values appended to it.
+
+    The type starts as whatever the first value is and is widened as
+    needed: int to float, and anything that does not fit (lists, dicts,
+    bools mixed with numbers...) falls back to a list of Python objects.
+    """
+
+    def __init__(self, rows=0):
+        self.kind = None
+        self.values = None
+        self.categories = []
+        self.codes = {}
+        self.state = bytearray(rows)
+        # True while every string in the column is a date-time
+        self.datetimes = True
+
+    def _start(self, value):
+        rows = len(self.state)
+        if isinstance(value, bool):
+            self.kind, dtype = 'bool', numpy.bool_
+        elif isinstance(value, integer_types):
+            self.kind, dtype = 'int', numpy.int64
+        elif isinstance(value, float):
+            self.kind, dtype = 'float', numpy.float64
+        elif isinstance(value, string_types):
+            self.kind, dtype = 'str', numpy.int32
+        else:
+            self.kind = 'object'
+            self.values = [None] * rows
+            return
+        self.values = GrowableArray(dtype, max(rows, INITIAL_CAPACITY))
+        self.values.extend(numpy.zeros(rows, dtype))
+
+    def _to_objects(self):
+        self.values = list(self.objects())
+        self.kind = 'object'
+
+    def _fits(self, value):
+        if self.kind == 'bool':
+            return isinstance(value, bool)
+        if isinstance(value, bool):
+            return False
+        if self.kind == 'int':
+            if isinstance(value, float):
+                self.values.data = self.values.data.astype(numpy.float64)
+                self.kind = 'float'
+                return True
+            return isinstance(value, integer_types) and -2 ** 63 <= value < 2 ** 63
+        if self.kind == 'float':
+            return isinstance(value, (float,) + integer_types)
+        if self.kind == 'str':
+            return isinstance(value, string_types)
+        return True
+
+    def append(self, value, present=True):
+        """Add the next row's value, present=False when the row lacks the field."""
+        if not present:
+            self.state.append(MISSING)
+        elif value is None:
+            self.state.append(NULL)
+        else:
+            if self.kind is None:
+                self._start(value)
+            elif not self._fits(value):
+                self._to_objects()
+            if self.kind == 'str':
+                code = self.codes.get(value)
+                if code is None:
+                    code = self.codes[value] = len(self.categories)
+                    self.categories.append(value)
+                    if self.datetimes and not DATETIME.match(value):
+                        self.datetimes = False
+                self.values.append(code)
+            else:
+                self.values.append(value)
+            self.state.append(VALUE)
+            return
+        if self.kind == 'object':
+            self.values.append(None)
+        elif self.kind is not None:
+            self.values.append(0)
+
+    def objects(self):
+        """The column's values as Python objects, None where null or missing."""
+        if self.kind is None:
+            return [None] * len(self.state)
+        if self.kind == 'object':
+            values = list(self.values)
+        elif self.kind == 'str':
+            categories = self.categories
+            values = [categories[code] for code in self.values.array().tolist()]
+        else:
+            values = self.values.array().tolist()
+        for row, state in enumerate(self.state):
+            if state != VALUE:
+                values[row] = None
+        return values
+
+    @property
+    def field_type(self):
+        """Type of the field, one of the FIELD_TYPES or 'DateTime'."""
+        if self.kind == 'str' and self.datetimes:
+            return 'DateTime'
+        return FIELD_TYPES[self.kind]
+
+    def value(self, row):
+        """One row's value as a Python object."""
+        if self.state[row] != VALUE:
+            return None
+        if self.kind == 'object':
+            return self.values[row]
+        value = self.values.data[row].item()
+        if self.kind == 'str':
+            return self.categories[value]
+        return value
+
+    def array(self):
+        """The column as a NumPy array (codes into categories for strings)."""
+        if self.kind in (None, 'object'):
+            return numpy.array(self.objects(), dtype=object)
+        return self.values.array()
+
+    def mask(self):
+        """NumPy bool array, True where the row has a (non-null) value."""
+        return numpy.frombuffer(bytes(self.state), numpy.uint8) == VALUE
+
+    @property
+    def nbytes(self):
+        size = len(self.state)
+        if self.kind not in (None, 'object'):
+            size += self.values.array().nbytes
+        return size
+
+
+class FeatureTable(object):
+    """Columnar store for the features of one layer.
+
+    Has the parts of the list interface importSpots uses: append a GeoJSON
+    feature, len() and iterating the features back as GeoJSON dicts.
+    """
+
+    def __init__(self):
+        self.fields = []
+        self.columns = {}
+        self.rows = 0
+        # Per feature index into the geometries, -1 for no geometry
+        self.geometry_index = GrowableArray(numpy.int32)
+        # Geometries: type code, coordinate dimensions, start in sizes and in coords
+        self.geometry_types = []
+        self.geometry_codes = {}
+        self.geometry_type = GrowableArray(numpy.int8)
+        self.geometry_dims = GrowableArray(numpy.int8)
+        self.geometry_sizes_start = GrowableArray(numpy.int64)
+        self.geometry_coords_start = GrowableArray(numpy.int64)
+        self.sizes = GrowableArray(numpy.int32)
+        self.coords = GrowableArray(numpy.float64)
+        # Geometries that do not fit the arrays (e.g. GeometryCollection), by index
+        self.other_geometries = {}
+        self._last_geometry = None
+
+    def __len__(self):
+        return self.rows
+
+    def append(self, feature):
+        """Add a GeoJSON feature dict or a strabo_records.FeatureRecord."""
+        if isinstance(feature, dict):
+            geometry = feature.get('geometry')
+            items = (feature.get('properties') or {}).items()
+        else:
+            geometry = feature.geometry
+            items = feature.items()
+        self.geometry_index.append(self._add_geometry(geometry))
+        rows = self.rows
+        for name, value in items:
+            column = self.columns.get(name)
+            if column is None:
+                self.fields.append(name)
+                column = self.columns[name] = Column(rows)
+            column.append(value)
+        # Fields this feature doesn't have
+        if len(self.columns) > 0:
+            for column in self.columns.values():
+                if len(column.state) == rows:
+                    column.append(None, False)
+        self.rows += 1
+
+    def _add_geometry(self, geometry):
+        if geometry is None:
+            return -1
+        # A spot's child features all point at the spot's geometry, store it once
+        if self._last_geometry is not None and self._last_geometry[0] is geometry:
+            return self._last_geometry[1]
+        index = len(self.geometry_type)
+        geotype = geometry.get('type')
+        depth = GEOMETRY_DEPTHS.get(geotype)
+        sizes = []
+        values = []
+        dims = 0
+        if depth is not None:
+            try:
+                dims = len(first_position(geometry['coordinates'], depth))
+                flatten_coordinates(geometry['coordinates'], depth, dims, sizes, values)
+            except (TypeError, ValueError, IndexError, KeyError):
+                depth = None
+        code = self.geometry_codes.get(geotype)
+        if code is None:
+            code = self.geometry_codes[geotype] = len(self.geometry_types)
+            self.geometry_types.append(geotype)
+        self.geometry_type.append(code)
+        self.geometry_sizes_start.append(len(self.sizes))
+        self.geometry_coords_start.append(len(self.coords))
+        if depth is None:
+            self.geometry_dims.append(0)
+            self.other_geometries[index] = geometry
+        else:
+            self.geometry_dims.append(dims)
+            self.sizes.extend(sizes)
+            self.coords.extend(values)
+        self._last_geometry = (geometry, index)
+        return index
+
+    def geometry(self, index):
+        """Rebuild geometry index as a GeoJSON dict."""
+        if index < 0:
+            return None
+        if index in self.other_geometries:
+            return self.other_geometries[index]
+        geotype = self.geometry_types[self.geometry_type[index]]
+        sizes_start = int(self.geometry_sizes_start[index])
+        coords_start = int(self.geometry_coords_start[index])
+        coordinates, sizes_end, coords_end = build_coordinates(
+            GEOMETRY_DEPTHS[geotype], int(self.geometry_dims[index]),
+            self.sizes.array(), sizes_start, self.coords.array(), coords_start)
+        return {'type': geotype, 'coordinates': coordinates}
+
+    def schema(self):
+        """[(field name, field type)] of the table's fields, in the order they were first seen."""
+        return [(name, self.columns[name].field_type) for name in self.fields]
+
+    def column(self, name):
+        """A field's values as a NumPy array, see Column.array."""
+        return self.columns[name].array()
+
+    def coordinates(self):
+        """Every stored coordinate as an (n, dims) array, only when all geometries have the same dims."""
+        dims = set(self.geometry_dims.array().tolist()) - set([0])
+        if len(dims) != 1:
+            return numpy.empty((0, 2))
+        return self.coords.array().reshape(-1, dims.pop())
+
+    def __iter__(self):
+        """The features as GeoJSON dicts, built one at a time."""
+        columns = [(name, self.columns[name]) for name in self.fields]
+        geometries = {}
+        for row in range(self.rows):
+            index = int(self.geometry_index[row])
+            if index not in geometries:
+                # Consecutive features share geometries, keep only the current one built
+                geometries = {index: self.geometry(index)}
+            geometry = geometries[index]
+            properties = {}
+            for name, column in columns:
+                if column.state[row] != MISSING:
+                    properties[name] = column.value(row)
+            yield {'type': 'Feature', 'geometry': geometry, 'properties': properties}
+
+    def write_geojson(self, fileobj):
+        """Write the table as a GeoJSON FeatureCollection, one feature at a time."""
+        fileobj.write('{"type": "FeatureCollection", "features": [')
+        for row, feature in enumerate(self):
+            if row > 0:
+                fileobj.write(', ')
+            fileobj.write(json.dumps(feature))
+        fileobj.write(']}')
+
+    @property
+    def nbytes(self):
+        """Bytes held by the table's arrays."""
+        size = sum(column.nbytes for column in self.columns.values())
+        for array in (self.geometry_index, self.geometry_type, self.geometry_dims, self.geometry_sizes_start,
+                      self.geometry_coords_start, self.sizes, self.coords):
+            size += array.array().nbytes
+        return size
+
+
+def first_position(coordinates, depth):
+    while depth > 0:
+        coordinates = coordinates[0]
+        depth -= 1
+    return coordinates
+
+
+def flatten_coordinates(coordinates, depth, dims, sizes, values):
+    """Append nested GeoJSON coordinates to sizes (list lengths, pre-order) and values."""
+    if depth == 0:
+        if len(coordinates) != dims:
+            raise ValueError('Positions of different dimensions')
+        values.extend(coordinates)
+        return
+    sizes.append(len(coordinates))
+    for item in coordinates:
+        flatten_coordinates(item, depth - 1, dims, sizes, values)
+
+
+def build_coordinates(depth, dims, sizes, sizes_pos, values, values_pos):
+    """Inverse of flatten_coordinates, returns (coordinates, next sizes_pos, next values_pos)."""
+    if depth == 0:
+        return values[values_pos:values_pos + dims].tolist(), sizes_pos, values_pos + dims
+    count = int(sizes[sizes_pos])
+    sizes_pos += 1
+    items = []
+    for i in range(count):
+        item, sizes_pos, values_pos = build_coordinates(depth - 1, dims, sizes, sizes_pos, values, values_pos)
+        items.append(item)
+    return items, sizes_pos, values_pos
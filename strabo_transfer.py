@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ StraboSpot transfer engine
+                                 A QGIS plugin
+ Download and Upload Strabo data to and from QGIS.
+                             -------------------
+        begin                : 2017-06-15
+        git sha              : $Format:%H$
+        copyright            : (C) 2017 by Emily Bunse - University of Kansas
+        email                : egbunse@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+ Keeps many StraboSpot requests (spots, projects, images) in flight at once.
+
+ QGIS 2 plug-ins run on Python 2.7, which has no asyncio, so requests run
+ on a pool of worker threads sharing the client's keep-alive session and
+ their results are handed back on the calling thread.  While waiting, the
+ engine calls process_events (QCoreApplication.processEvents inside QGIS)
+ so the dialog keeps repainting and responding.
+"""
+import threading
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+# Requests kept in flight at once by default
+DEFAULT_IN_FLIGHT = 16
+# Seconds to wait for a result before letting the event loop run again
+POLL_INTERVAL = 0.05
+
+
+class TransferEngine(object):
+    """Runs StraboSpot GETs concurrently and yields them as they complete."""
+
+    def __init__(self, client, max_in_flight=DEFAULT_IN_FLIGHT, process_events=None,
+                 poll_interval=POLL_INTERVAL):
+        """Constructor.
+
+        :param client: The plug-in's StraboSpot client, its connection pool is
+            grown to max_in_flight so every request has a kept-alive connection.
+            Its ConcurrencyController adapts how many of them run at once.
+        :type client: strabo_client.StraboClient
+
+        :param max_in_flight: Most requests running at the same time.
+        :type max_in_flight: int
+
+        :param process_events: Called while waiting on results, e.g.
+            QCoreApplication.processEvents to keep the Qt event loop running.
+        :type process_events: function
+        """
+        self.client = client
+        self.max_in_flight = max(1, int(max_in_flight))
+        if client.pool_size < self.max_in_flight:
+            client.set_pool_size(self.max_in_flight)
+        # The client's controller still decides how many of them actually run at once
+        if client.controller.maximum < self.max_in_flight:
+            client.controller.maximum = self.max_in_flight
+        self.process_events = process_events
+        self.poll_interval = poll_interval
+        self.jobs = queue.Queue()
+        self.done = queue.Queue()
+        self.workers = []
+        self.submitted = 0
+        self.delivered = 0
+        # Results of a batch abandoned part way carry an older generation and are dropped
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    @property
+    def pending(self):
+        """Requests submitted whose results have not been handed back yet."""
+        return self.submitted - self.delivered
+
+    def submit(self, key, path, consume=None, **kwargs):
+        """Queue a GET of path, its response is yielded by completed() with key.
+
+        :param consume: Called on the worker thread with the response, e.g. to
+            save a streamed body to disk while the caller is busy elsewhere;
+            what it returns is yielded instead of the response.
+        :type consume: function
+        """
+        self.submitted += 1
+        self.jobs.put((self.generation, key, path, consume, kwargs))
+        # Idle workers left from an earlier batch must not keep this one from growing
+        with self.lock:
+            start = len(self.workers) < min(self.max_in_flight, self.pending)
+        if start:
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            self.workers.append(worker)
+            worker.start()
+
+    def _work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            generation, key, path, consume, kwargs = job
+            try:
+                response = self.client.get(path, **kwargs)
+                if consume is not None:
+                    response = consume(response)
+                self.done.put((generation, key, response, None))
+            except Exception as error:
+                self.done.put((generation, key, None, error))
+
+    def completed(self):
+        """Yield (key, response) for every submitted request as it completes.
+
+        An exception raised by a request is re-raised here, on the caller's
+        thread.  If that happens, or the caller stops iterating early, the
+        rest of the batch is dropped so it is never handed to a later one.
+        """
+        try:
+            while self.pending > 0:
+                try:
+                    generation, key, response, error = self.done.get(timeout=self.poll_interval)
+                except queue.Empty:
+                    if self.process_events is not None:
+                        self.process_events()
+                    continue
+                if generation != self.generation:
+                    if response is not None:
+                        response.close()
+                    continue
+                self.delivered += 1
+                if error is not None:
+                    raise error
+                yield key, response
+        finally:
+            if self.pending > 0:
+                self.abandon()
+
+    def abandon(self):
+        """Drop the outstanding requests, those already running are ignored when they finish."""
+        self.cancel()
+        self.generation += 1
+        self.submitted = 0
+        self.delivered = 0
+        while True:
+            try:
+                generation, key, response, error = self.done.get_nowait()
+            except queue.Empty:
+                break
+            if response is not None:
+                response.close()
+
+    def fetch_all(self, requests_list, **kwargs):
+        """Submit a batch of (key, path[, get kwargs]) requests and yield them as they complete."""
+        for job in requests_list:
+            getargs = dict(kwargs)
+            if len(job) > 2:
+                getargs.update(job[2])
+            self.submit(job[0], job[1], **getargs)
+        return self.completed()
+
+    def cancel(self):
+        """Drop queued requests that have not started yet."""
+        while True:
+            try:
+                job = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:  # Keep close() requests for the workers
+                self.jobs.put(job)
+                break
+            self.submitted -= 1
+
+    def close(self):
+        """Stop the worker threads once they finish the requests they are running."""
+        self.cancel()
+        for worker in self.workers:
+            self.jobs.put(None)
+        self.workers = []
@@ -0,0 +1,193 @@
+# coding=utf-8
+"""StraboSpot response cache test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'egbunse@gmail.com'
+__date__ = '2017-06-15'
+__copyright__ = 'Copyright 2017, Emily Bunse - University of Kansas'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from strabo_cache import ResponseCache, ImageStore
+from strabo_client import StraboClient
+
+from utilities import StraboTestServer
+
+PROJECTS = b'{"projects": [{"id": 12, "name": "Field Season", "modified_timestamp": 1500000000000}]}'
+
+
+def projects(handler):
+    if handler.headers.get('If-None-Match') == '"v1"':
+        return 304, b'', {'ETag': '"v1"'}
+    return 200, PROJECTS, {'ETag': '"v1"', 'Content-Type': 'application/json'}
+
+
+class ResponseCacheTest(unittest.TestCase):
+    """Test GETs are revalidated and served from the on-disk cache."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.folder = tempfile.mkdtemp()
+        self.server = StraboTestServer({'/db/myProjects': projects,
+                                        '/db/project/12': (200, b'{"id": 12}')})
+        self.client = StraboClient(base_url=self.server.url, cache=ResponseCache(self.folder))
+        self.client.set_auth('user@example.com', 'secret')
+
+    def tearDown(self):
+        """Runs after each test."""
+        self.client.close()
+        self.server.close()
+        shutil.rmtree(self.folder)
+
+    def test_revalidate(self):
+        """Test an unchanged payload (304) is served from disk."""
+        first = self.client.get('db/myProjects', cache=True)
+        self.assertEqual(first.json()['projects'][0]['id'], 12)
+        second = self.client.get('db/myProjects', cache=True)
+        self.assertTrue(getattr(second, 'from_cache', False))
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.content, PROJECTS)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_version(self):
+        """Test a matching version skips the round trip entirely."""
+        self.assertEqual(self.client.get('db/project/12', cache=True, version='1').json(), {'id': 12})
+        self.assertEqual(self.client.get('db/project/12', cache=True, version='1').json(), {'id': 12})
+        self.assertEqual(len(self.server.requests), 1)
+        self.client.get('db/project/12', cache=True, version='2').content
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_keyed_by_user(self):
+        """Test one user's cached responses are not served to another."""
+        self.client.get('db/project/12', cache=True, version='1').content
+        self.client.set_auth('other@example.com', 'secret')
+        self.client.get('db/project/12', cache=True, version='1').content
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_partial_read_not_cached(self):
+        """Test a body that was not read to the end is not stored."""
+        r = self.client.get('db/project/12', cache=True, version='1')
+        r.close()
+        self.assertIsNone(self.client.cache.lookup(self.client.url('db/project/12'), 'user@example.com'))
+
+    def test_entry_gone(self):
+        """Test an entry replaced or removed while being looked up is a cache miss."""
+        self.client.get('db/project/12', cache=True, version='1').content
+        url = self.client.url('db/project/12')
+        key = self.client.cache.key(url, 'user@example.com')
+        os.remove(self.client.cache.meta_path(key))
+        self.assertIsNone(self.client.cache.response(url, 'user@example.com'))
+        self.assertEqual(self.client.get('db/project/12', cache=True, version='1').json(), {'id': 12})
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_overlapping_reads(self):
+        """Test two GETs of the same URL read at the same time both succeed."""
+        first = self.client.get('db/myProjects', cache=True)
+        second = self.client.get('db/myProjects', cache=True)
+        self.assertEqual(first.content, PROJECTS)
+        self.assertEqual(second.content, PROJECTS)
+        self.assertIsNotNone(self.client.cache.lookup(self.client.url('db/myProjects'), 'user@example.com'))
+        self.assertEqual([name for name in os.listdir(self.folder) if name.endswith('.part')], [])
+
+
+class ImageStoreTest(unittest.TestCase):
+    """Test images are kept once per content and evicted least recently used first."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.folder = tempfile.mkdtemp()
+        self.now = [0]
+        self.store = ImageStore(os.path.join(self.folder, 'store'), max_bytes=250,
+                                clock=lambda: self.now[0])
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.folder)
+
+    def image(self, name, content):
+        path = os.path.join(self.folder, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_get(self):
+        """Test a stored image is placed at a new path, as a link or a copy."""
+        self.store.put(1, self.image('1.jpeg', b'a' * 100))
+        self.assertFalse(self.store.get(2, os.path.join(self.folder, '2.jpeg')))
+        linked = os.path.join(self.folder, 'linked.tiff')
+        self.assertTrue(self.store.get(1, linked))
+        self.assertEqual(self.read(linked), b'a' * 100)
+        copied = os.path.join(self.folder, 'copied.jpeg')
+        self.assertTrue(self.store.get(1, copied, link=False))
+        self.assertNotEqual(os.stat(copied).st_ino, os.stat(self.store.lookup(1)).st_ino)
+
+    def test_same_content(self):
+        """Test images with the same content are stored once."""
+        first = self.store.put(1, self.image('1.jpeg', b'a' * 100))
+        second = self.store.put(2, self.image('2.jpeg', b'a' * 100))
+        self.assertEqual(first, second)
+        self.assertEqual(self.store.size, 100)
+        self.assertEqual(os.listdir(os.path.join(self.folder, 'store', 'objects')), [first])
+
+    def test_evict(self):
+        """Test the least recently used image goes once the store is over its cap."""
+        self.store.put(1, self.image('1.jpeg', b'a' * 100))
+        self.now[0] = 1
+        self.store.put(2, self.image('2.jpeg', b'b' * 100))
+        self.now[0] = 2
+        self.assertIsNotNone(self.store.lookup(1))
+        self.now[0] = 3
+        self.store.put(3, self.image('3.jpeg', b'c' * 100))
+        self.assertIsNotNone(self.store.lookup(1))
+        self.assertIsNone(self.store.lookup(2))
+        self.assertIsNotNone(self.store.lookup(3))
+        self.assertEqual(self.store.size, 200)
+
+    def test_save(self):
+        """Test the store is found again when reopened, and damaged images are dropped."""
+        self.store.put(1, self.image('1.jpeg', b'a' * 100))
+        self.store.put(2, self.image('2.jpeg', b'b' * 100))
+        self.store.save()
+        with open(self.store.lookup(2), 'ab') as f:
+            f.write(b'x')
+        reopened = ImageStore(os.path.join(self.folder, 'store'), max_bytes=250)
+        self.assertEqual(reopened.size, 200)
+        self.assertIsNotNone(reopened.lookup(1))
+        self.assertIsNone(reopened.lookup(2))
+        self.assertEqual(reopened.size, 100)
+
+    def test_unsaved(self):
+        """Test images put after the index was last saved are removed when reopened."""
+        self.store.put(1, self.image('1.jpeg', b'a' * 100))
+        self.store.save()
+        self.store.put(2, self.image('2.jpeg', b'b' * 100))
+        reopened = ImageStore(os.path.join(self.folder, 'store'), max_bytes=250)
+        self.assertEqual(os.listdir(os.path.join(self.folder, 'store', 'objects')), [reopened.ids['1']])
+        self.assertEqual(reopened.size, 100)
+        self.assertIsNone(reopened.lookup(2))
+
+    def test_missing_object(self):
+        """Test an indexed image removed behind the store's back is dropped when reopened."""
+        self.store.put(1, self.image('1.jpeg', b'a' * 100))
+        self.store.put(2, self.image('2.jpeg', b'b' * 100))
+        self.store.save()
+        os.remove(self.store.lookup(2))
+        reopened = ImageStore(os.path.join(self.folder, 'store'), max_bytes=250)
+        self.assertEqual(reopened.size, 100)
+        self.assertEqual(list(reopened.ids), ['1'])
+
+if __name__ == "__main__":
+    unittest.main()
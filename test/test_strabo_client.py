@@ -0,0 +1,169 @@
+# coding=utf-8
+"""StraboSpot REST client test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'egbunse@gmail.com'
+__date__ = '2017-06-15'
+__copyright__ = 'Copyright 2017, Emily Bunse - University of Kansas'
+
+import threading
+import time
+import unittest
+
+from strabo_client import ConcurrencyController, StraboClient, parse_retry_after
+
+from utilities import StraboTestServer
+
+
+class StraboClientTest(unittest.TestCase):
+    """Test the shared StraboSpot session is set up correctly."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.client = StraboClient(base_url='https://strabospot.org/', pool_size=4)
+
+    def tearDown(self):
+        """Runs after each test."""
+        self.client.close()
+        self.client = None
+
+    def test_url(self):
+        """Test relative paths are joined to the site and full URLs kept."""
+        self.assertEqual(self.client.url('db/myProjects'),
+                         'https://strabospot.org/db/myProjects')
+        self.assertEqual(self.client.url('/db/project/12'),
+                         'https://strabospot.org/db/project/12')
+        image = 'https://strabospot.org/db/image/1234'
+        self.assertEqual(self.client.url(image), image)
+
+    def test_pool_size(self):
+        """Test the connection pool size is applied per host."""
+        adapter = self.client.session.get_adapter('https://strabospot.org')
+        self.assertEqual(adapter._pool_maxsize, 4)
+        self.client.set_pool_size(8)
+        adapter = self.client.session.get_adapter('https://strabospot.org')
+        self.assertEqual(adapter._pool_maxsize, 8)
+
+    def test_auth(self):
+        """Test credentials are held on the session."""
+        self.assertIsNone(self.client.session.auth)
+        self.client.set_auth('user@example.com', 'secret')
+        self.assertEqual(self.client.session.auth.username, 'user@example.com')
+        self.client.clear_auth()
+        self.assertIsNone(self.client.session.auth)
+
+    def test_fetch_all(self):
+        """Test a batch of GETs runs concurrently and every response arrives."""
+        state = {'active': 0, 'peak': 0}
+        lock = threading.Lock()
+
+        def slow(handler):
+            with lock:
+                state['active'] += 1
+                state['peak'] = max(state['peak'], state['active'])
+            time.sleep(0.1)
+            with lock:
+                state['active'] -= 1
+            return 200, handler.path.encode('utf-8')
+
+        paths = ['/db/datasetspotsarc/%d/%s' % (dataset, geotype)
+                 for dataset in range(3) for geotype in ('point', 'line', 'polygon')]
+        server = StraboTestServer(dict((path, slow) for path in paths))
+        try:
+            client = StraboClient(base_url=server.url, pool_size=4)
+            results = dict(client.fetch_all([(path, path) for path in paths]))
+            client.close()
+        finally:
+            server.close()
+        self.assertEqual(sorted(results), sorted(paths))
+        for path in paths:
+            self.assertEqual(results[path].text, path)
+        self.assertTrue(1 < state['peak'] <= 4)
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ConcurrencyControllerTest(unittest.TestCase):
+    """Test the in-flight limit adapts to latency and throttling."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.clock = FakeClock()
+        self.controller = ConcurrencyController(initial=4, maximum=8, clock=self.clock)
+
+    def run_request(self, latency, status=200, retry_after=None):
+        self.controller.acquire()
+        self.clock.now += latency
+        self.controller.release(latency, status, retry_after)
+
+    def test_grow(self):
+        """Test steady latency lets the limit grow up to the maximum."""
+        for i in range(100):
+            self.run_request(0.1)
+        self.assertEqual(self.controller.stats()['limit'], 8)
+
+    def test_slow(self):
+        """Test rising latency brings the limit down."""
+        self.run_request(0.1)
+        limit = self.controller.limit
+        for i in range(3):
+            self.run_request(1.0)
+        self.assertTrue(self.controller.limit < limit)
+
+    def test_throttle(self):
+        """Test a 429 halves the limit and Retry-After pauses new requests."""
+        self.run_request(0.1, 429, '5')
+        stats = self.controller.stats()
+        self.assertEqual(stats['limit'], 2)
+        self.assertEqual(stats['throttled'], 1)
+        self.assertEqual(stats['paused'], 5.0)
+        self.controller.release()  # A failed request without a response
+        self.assertEqual(self.controller.stats()['limit'], 1)
+
+    def test_throughput(self):
+        """Test throughput counts the requests completed in the window."""
+        for i in range(20):
+            self.run_request(0.1)
+        self.assertEqual(self.controller.throughput(), 2.0)
+        self.clock.now += 60
+        self.assertEqual(self.controller.throughput(), 0.0)
+
+    def test_retry_after(self):
+        """Test both Retry-After forms are understood."""
+        self.assertEqual(parse_retry_after('30'), 30.0)
+        self.assertEqual(parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT', now=1445412470), 10.0)
+        self.assertIsNone(parse_retry_after('soon'))
+
+    def test_retry_after_bounds(self):
+        """Test huge delays are capped and past or invalid dates don't pause."""
+        self.assertEqual(parse_retry_after('3600'), 60.0)
+        self.assertEqual(parse_retry_after('Fri, 31 Dec 9999 23:59:59 GMT', now=1445412470), 60.0)
+        self.assertEqual(parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT', now=1445412490), 0.0)
+        self.assertIsNone(parse_retry_after('Wed, 99 Foo 2015 07:28:00 GMT'))
+        self.clock.now = 1445412490
+        self.run_request(0.1, 429, 'Wed, 21 Oct 2015 07:28:00 GMT')
+        self.assertEqual(self.controller.stats()['paused'], 0.0)
+
+    def test_gui_not_paused(self):
+        """Test a Retry-After pause doesn't hold back requests that skip it."""
+        self.run_request(0.1, 429, '3600')
+        self.assertAlmostEqual(self.controller.stats()['paused'], 60.0)
+        self.controller.acquire(pause=False)
+        self.assertEqual(self.controller.in_flight, 1)
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(StraboClientTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,81 @@
+# coding=utf-8
+"""StraboSpot spot coordinates test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'egbunse@gmail.com'
+__date__ = '2017-06-15'
+__copyright__ = 'Copyright 2017, Emily Bunse - University of Kansas'
+
+import unittest
+
+import numpy
+
+from strabo_coords import SpotCoordinates, positions, union_extent, web_mercator, to_dms
+
+POINT = {'type': 'Point', 'coordinates': [-97.5, 38.9]}
+LINE = {'type': 'LineString', 'coordinates': [[-97.0, 38.0, 300.0], [-96.0, 39.0, 310.0]]}
+POLYGON = {'type': 'Polygon', 'coordinates': [[[-95.0, 37.0], [-94.0, 37.0], [-94.0, 38.0], [-95.0, 37.0]]]}
+
+
+def spot(geometry):
+    return {'type': 'Feature', 'geometry': geometry, 'properties': {}}
+
+
+class StraboCoordsTest(unittest.TestCase):
+    """Test working on every spot's coordinates at once."""
+
+    def setUp(self):
+        self.coords = SpotCoordinates([spot(POINT), spot(None), spot(LINE), spot(POLYGON)])
+
+    def test_positions(self):
+        """Positions come out in order and only x, y are kept."""
+        self.assertEqual(positions(LINE), [[-97.0, 38.0], [-96.0, 39.0]])
+        self.assertEqual(positions({'type': 'MultiPoint', 'coordinates': [[1, 2], [3, 4]]}), [[1, 2], [3, 4]])
+        self.assertEqual(positions(None), [])
+
+    def test_first_points(self):
+        """Each spot's first position, NaN without a geometry."""
+        points = self.coords.representative_points()
+        self.assertEqual(points[0].tolist(), [-97.5, 38.9])
+        self.assertTrue(numpy.isnan(points[1]).all())
+        self.assertEqual(points[2].tolist(), [-97.0, 38.0])
+        self.assertEqual(points[3].tolist(), [-95.0, 37.0])
+
+    def test_centroids(self):
+        """The mean of each spot's positions."""
+        centroids = self.coords.representative_points('centroid')
+        self.assertEqual(centroids[2].tolist(), [-96.5, 38.5])
+        self.assertEqual(centroids[3].tolist(), [-94.5, 37.25])
+
+    def test_bounds_and_extent(self):
+        """Bounding boxes per spot and the extent of them all."""
+        bounds = self.coords.bounds()
+        self.assertEqual(bounds[2].tolist(), [-97.0, 38.0, -96.0, 39.0])
+        self.assertEqual(bounds[3].tolist(), [-95.0, 37.0, -94.0, 38.0])
+        self.assertEqual(self.coords.extent(), (-97.5, 37.0, -94.0, 39.0))
+        self.assertEqual(SpotCoordinates([spot(None)]).extent(), None)
+        self.assertEqual(union_extent(None, (0, 0, 1, 1)), (0, 0, 1, 1))
+        self.assertEqual(union_extent((0, 0, 1, 1), (-1, 0.5, 0.5, 2)), (-1, 0, 1, 2))
+
+    def test_web_mercator(self):
+        """Longitude/latitude projected to EPSG:3857 metres."""
+        projected = web_mercator([[0.0, 0.0], [180.0, 0.0]])
+        self.assertAlmostEqual(projected[0][1], 0.0)
+        self.assertAlmostEqual(projected[1][0], 20037508.342789244)
+
+    def test_to_dms(self):
+        """Decimal degrees split as the EXIF GPS tags store them."""
+        degrees, minutes, seconds = to_dms([-97.5, 38.25, 10.5078125])
+        self.assertEqual(degrees.tolist(), [97, 38, 10])
+        self.assertEqual(minutes.tolist(), [30, 15, 30])
+        self.assertEqual(seconds.tolist(), [0, 0, 28125])
+
+
+if __name__ == "__main__":
+    unittest.main()
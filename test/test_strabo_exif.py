@@ -0,0 +1,102 @@
+# coding=utf-8
+"""StraboSpot EXIF geotagging test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'egbunse@gmail.com'
+__date__ = '2017-06-15'
+__copyright__ = 'Copyright 2017, Emily Bunse - University of Kansas'
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import piexif
+from PIL import Image
+
+from strabo_exif import APP0, APP1, geotag, read_exif, read_segments, write_exif
+
+
+def scan_data(path):
+    # Everything from the start of scan on, which geotagging must leave alone
+    with open(path, 'rb') as f:
+        data = f.read()
+    return data[data.index(b'\xff\xda'):]
+
+
+class StraboExifTest(unittest.TestCase):
+    """Test the Exif segment is rewritten without touching the image data."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.folder = tempfile.mkdtemp()
+        self.tagged = os.path.join(self.folder, 'tagged.jpeg')
+        exif = piexif.dump({'0th': {piexif.ImageIFD.Make: b'Camera'}, 'Exif': {}, 'GPS': {}, '1st': {},
+                            'thumbnail': None})
+        Image.new('RGB', (64, 48), (200, 120, 40)).save(self.tagged, 'jpeg', exif=exif)
+        self.plain = os.path.join(self.folder, 'plain.jpeg')
+        Image.new('RGB', (64, 48), (40, 120, 200)).save(self.plain, 'jpeg')
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.folder)
+
+    def test_replace(self):
+        """Test an existing Exif segment gets the GPS tags and keeps its other tags."""
+        before = scan_data(self.tagged)
+        geotag(self.tagged, -97.5, 38.25)
+        exif = piexif.load(read_exif(self.tagged))
+        self.assertEqual(exif['0th'][piexif.ImageIFD.Make], b'Camera')
+        self.assertEqual(exif['GPS'][piexif.GPSIFD.GPSLongitudeRef], b'W')
+        self.assertEqual(exif['GPS'][piexif.GPSIFD.GPSLongitude], ((97, 1), (30, 1), (0, 1000)))
+        self.assertEqual(exif['GPS'][piexif.GPSIFD.GPSLatitude], ((38, 1), (15, 1), (0, 1000)))
+        self.assertEqual(scan_data(self.tagged), before)
+        with open(self.tagged, 'rb') as f:
+            markers = [marker for marker, payload in read_segments(f)]
+        self.assertEqual(markers.count(APP1), 1)
+        self.assertEqual(Image.open(self.tagged).size, (64, 48))
+
+    def test_insert(self):
+        """Test a JPEG without Exif gets a segment after its JFIF header."""
+        self.assertIsNone(read_exif(self.plain))
+        before = scan_data(self.plain)
+        geotag(self.plain, 10.5, -20.0)
+        with open(self.plain, 'rb') as f:
+            markers = [marker for marker, payload in read_segments(f)]
+        self.assertEqual(markers[:2], [APP0, APP1])
+        exif = piexif.load(read_exif(self.plain))
+        self.assertEqual(exif['GPS'][piexif.GPSIFD.GPSLatitudeRef], b'S')
+        self.assertEqual(scan_data(self.plain), before)
+
+    def test_hardlink(self):
+        """Test a hardlinked copy is left as it was."""
+        if not hasattr(os, 'link'):
+            return
+        copy = os.path.join(self.folder, 'copy.jpeg')
+        os.link(self.tagged, copy)
+        with open(copy, 'rb') as f:
+            original = f.read()
+        geotag(self.tagged, 1.0, 1.0)
+        with open(copy, 'rb') as f:
+            self.assertEqual(f.read(), original)
+
+    def test_not_jpeg(self):
+        """Test other files are refused and left alone."""
+        path = os.path.join(self.folder, 'image.tiff')
+        with open(path, 'wb') as f:
+            f.write(b'II*\x00' + b'\x00' * 100)
+        self.assertRaises(ValueError, geotag, path, 1.0, 1.0)
+        self.assertRaises(ValueError, write_exif, self.plain, b'not exif')
+        self.assertRaises(ValueError, read_segments, io.BytesIO(b'GIF89a'))
+        self.assertFalse(os.path.exists(path + '.part'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,209 @@
+# coding=utf-8
+"""StraboSpot spot flattening test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'egbunse@gmail.com'
+__date__ = '2017-06-15'
+__copyright__ = 'Copyright 2017, Emily Bunse - University of Kansas'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from strabo_flatten import SpotFlattener, FlattenSnapshot, DatasetFlattener, SPOT, TAGS, index_tags, \
+    flatten_spots, flatten_incremental
+
+POINT = {'type': 'Point', 'coordinates': [-97.5, 38.9]}
+
+
+def make_spot(spotid, **nested):
+    properties = {'id': spotid, 'modified_timestamp': 1500000000000,
+                  'time': '2017-06-15T10:00:00Z', 'date': '2017-06-15T10:00:00Z',
+                  'self': 'https://strabospot.org/db/feature/' + str(spotid),
+                  'name': 'Spot ' + str(spotid)}
+    properties.update(nested)
+    return {'type': 'Feature', 'geometry': POINT, 'properties': properties}
+
+
+class StraboFlattenTest(unittest.TestCase):
+    """Test flattening nested spot properties into features."""
+
+    def test_spot_feature(self):
+        """The spot's own feature only keeps the basic spot fields."""
+        features = SpotFlattener().flatten_all([make_spot(1)])
+        self.assertEqual(len(features), 1)
+        self.assertEqual(features[0]['geometry'], POINT)
+        self.assertEqual(sorted(features[0]['properties']),
+                         ['date', 'id', 'modified_timestamp', 'self', 'time'])
+
+    def test_nested_values(self):
+        """Nested records keep their values under suffixed field names."""
+        spot = make_spot(1, orientation_data=[{'strike': 10, 'dip': 20}, {'strike': 30, 'dip': 40}],
+                         rock_unit={'unit_label_abbreviation': 'Kd'})
+        features = list(SpotFlattener().flatten(spot))
+        kinds = [kind for kind, record, feature in features]
+        self.assertEqual(kinds, [SPOT, 'orientation_data', 'orientation_data', 'rock_unit'])
+        self.assertEqual(features[1][2].properties(),
+                         {'strike_orientation_data': 10, 'dip_orientation_data': 20, 'SpotID': 1})
+        self.assertEqual(features[3][2].properties(),
+                         {'unit_label_abbreviation_rock_unit': 'Kd', 'SpotID': 1})
+
+    def test_other_features_and_3d_structures(self):
+        """other_features and _3d_structures records are flattened like the rest."""
+        spot = make_spot(1, other_features=[{'label': 'a'}], _3d_structures=[{'type': 'fold'}])
+        features = SpotFlattener().flatten_all([spot])
+        self.assertIn({'label_other_features': 'a', 'SpotID': 1}, [f['properties'] for f in features])
+        self.assertIn({'type_3d_structures': 'fold', 'SpotID': 1}, [f['properties'] for f in features])
+
+    def test_tags(self):
+        """A spot gets one tag feature per project tag listing it."""
+        tags = [{'id': 7, 'name': 'Fault', 'spots': [1, 2]}, {'id': 8, 'name': 'Other', 'spots': [3]},
+                {'id': 9, 'name': 'Empty'}]
+        features = list(SpotFlattener(tags).flatten(make_spot(2)))
+        self.assertEqual([kind for kind, record, feature in features], [SPOT, TAGS])
+        self.assertEqual(features[1][2].properties(), {'tag_id': 7, 'tag_name': 'Fault', 'SpotID': 2})
+
+    def test_child_tables(self):
+        """Without child geometry only the spot's own feature keeps the geometry."""
+        tags = [{'id': 7, 'spots': [1]}]
+        spot = make_spot(1, samples=[{'label': 's1'}], rock_unit={'unit_label_abbreviation': 'Kd'})
+        features = list(SpotFlattener(tags, child_geometry=False).flatten(spot))
+        self.assertEqual([feature.geometry for kind, record, feature in features], [POINT, None, None, None])
+        self.assertEqual([feature.get('SpotID') for kind, record, feature in features[1:]], [1, 1, 1])
+
+    def test_tag_index(self):
+        """Every spot maps to its tags once each, in project order."""
+        fault = {'id': 7, 'spots': [1, 2, 2]}
+        unit = {'id': 8, 'spots': [2]}
+        index = index_tags([fault, unit, {'id': 9}, {'id': 10, 'spots': None}])
+        self.assertEqual(index, {1: [fault], 2: [fault, unit]})
+        self.assertEqual(SpotFlattener([fault]).tags_for(3), ())
+
+    def test_image_record(self):
+        """Image features are yielded with the source record holding the image link."""
+        image = {'id': 55, 'self': 'https://strabospot.org/db/image/55'}
+        spot = make_spot(1, images=[image])
+        kind, record, feature = list(SpotFlattener().flatten(spot))[-1]
+        self.assertEqual(kind, 'images')
+        self.assertIs(record, image)
+        self.assertEqual(feature.get('self_images'), image['self'])
+
+    def test_layers(self):
+        """Features are grouped into one compact layer per kind."""
+        tags = [{'id': 7, 'name': 'Fault', 'spots': [1]}]
+        spots = [make_spot(1, samples=[{'label': 's1'}]), make_spot(2, orientation_data=[{'strike': 10}])]
+        flattener = SpotFlattener(tags)
+        layers = flattener.flatten_layers(spots)
+        self.assertEqual(list(layers), flattener.kinds())
+        self.assertEqual([len(layers[kind]) for kind in (SPOT, TAGS, 'samples', 'orientation_data', 'images')],
+                         [2, 1, 1, 1, 0])
+        self.assertEqual(set(layers['samples'][0].properties()), set(['label_samples', 'SpotID']))
+        self.assertEqual(flattener.layer_name('Bedrock_point', SPOT), 'Bedrock_point')
+        self.assertEqual(flattener.layer_name('Bedrock_point', TAGS), 'Bedrock_point_tags')
+        self.assertEqual(flattener.layer_name('Bedrock_point', '_3d_structures'), 'Bedrock_point_3d_structures')
+
+    def test_flatten_spots_pool(self):
+        """Flattening on a process pool gives the same features in the same order."""
+        tags = [{'id': 7, 'spots': list(range(0, 1200, 3))}]
+        spots = [make_spot(i, samples=[{'label': 's%d' % i}] * (i % 3)) for i in range(1200)]
+        flattener = SpotFlattener(tags)
+        sequential = list(flatten_spots(flattener, spots, processes=1))
+        pooled = list(flatten_spots(flattener, spots, processes=2, threshold=1))
+        self.assertEqual(pooled, sequential)
+        self.assertEqual(sequential[-1][0], 1199)
+
+    def test_incremental(self):
+        """Only new and modified spots are flattened again."""
+        folder = tempfile.mkdtemp()
+        try:
+            path = os.path.join(folder, 'Bedrock_point_1.flat')
+            flattener = SpotFlattener()
+            spots = [make_spot(1, samples=[{'label': 's1'}]), make_spot(2)]
+            snapshot = FlattenSnapshot(path, flattener.signature())
+            first = list(flatten_incremental(flattener, spots, snapshot, processes=1))
+            snapshot.save()
+            self.assertEqual((snapshot.reflattened, snapshot.reused), (2, 0))
+
+            spots[1]['properties']['modified_timestamp'] += 1
+            spots.append(make_spot(3))
+            snapshot = FlattenSnapshot(path, flattener.signature())
+            second = list(flatten_incremental(flattener, spots, snapshot, processes=1))
+            snapshot.save()
+            self.assertEqual((snapshot.reflattened, snapshot.reused), (2, 1))
+            self.assertTrue(snapshot.changed)
+            self.assertEqual(second[:2], [(0, SPOT, None, first[0][3]), (0, 'samples', None, first[1][3])])
+            self.assertEqual([(index, kind) for index, kind, record, feature in second[2:]], [(1, SPOT), (2, SPOT)])
+
+            snapshot = FlattenSnapshot(path, flattener.signature())
+            list(flatten_incremental(flattener, spots, snapshot, processes=1))
+            snapshot.save()
+            self.assertEqual((snapshot.reflattened, snapshot.reused, snapshot.changed), (0, 3, False))
+
+            snapshot = FlattenSnapshot(path, SpotFlattener([{'id': 7, 'spots': [1]}]).signature())
+            self.assertEqual(snapshot.previous, {})
+            snapshot = FlattenSnapshot(path, flattener.signature([True, '.jpeg', folder]))
+            self.assertTrue(snapshot.changed)
+            self.assertNotEqual(flattener.signature([True, '.jpeg', folder]),
+                                flattener.signature([True, '.tiff', folder]))
+        finally:
+            shutil.rmtree(folder)
+
+    def test_dataset_flattener(self):
+        """Spots flattened a chunk at a time as they arrive match flattening each geometry at once."""
+        line = {'type': 'LineString', 'coordinates': [[-97.5, 38.9], [-97.4, 39.0]]}
+        spots = []
+        for spotid in range(1, 8):
+            spot = make_spot(spotid, images=[{'id': spotid * 10}])
+            if spotid % 3 == 0:
+                spot['geometry'] = line
+            spots.append(spot)
+        spots.append({'type': 'Feature', 'geometry': None, 'properties': {'id': 99}})
+        flattener = SpotFlattener()
+        visited = []
+        dataset = DatasetFlattener(flattener, chunk_size=2, processes=1,
+                                   visit=lambda geotype, index, kind, record, feature: visited.append((geotype, index, kind)))
+        for spot in spots:
+            dataset.add(spot)
+        self.assertEqual(dataset.finish(), ['point', 'line'])
+        points = flattener.flatten_layers([spot for spot in spots[:7] if spot['geometry'] is POINT])
+        self.assertEqual([[f.to_geojson() for f in layer] for layer in dataset.layers['point'].values()],
+                         [[f.to_geojson() for f in layer] for layer in points.values()])
+        self.assertEqual(len(dataset.layers['line'][SPOT]), 2)
+        self.assertEqual(dataset.counts, {'point': 5, 'line': 2})
+        self.assertIn(('line', 1, 'images'), visited)
+        self.assertIn(('point', 4, 'images'), visited)
+
+    def test_snapshot_written_as_it_goes(self):
+        """A snapshot's spots are written as they are flattened, and no file is kept without a path."""
+        folder = tempfile.mkdtemp()
+        try:
+            path = os.path.join(folder, 'Bedrock_point_1.flat')
+            flattener = SpotFlattener()
+            snapshot = FlattenSnapshot(path, flattener.signature())
+            list(flatten_incremental(flattener, [make_spot(1), make_spot(2)], snapshot, processes=1))
+            self.assertTrue(os.path.exists(path + '.part'))
+            snapshot.save()
+            self.assertEqual(sorted(FlattenSnapshot(path, flattener.signature()).previous), ['1', '2'])
+            snapshot = FlattenSnapshot(None, flattener.signature())
+            list(flatten_incremental(flattener, [make_spot(1)], snapshot, processes=1))
+            snapshot.save()
+            self.assertEqual((snapshot.reflattened, snapshot.changed), (1, True))
+            self.assertEqual(os.listdir(folder), ['Bedrock_point_1.flat'])
+        finally:
+            shutil.rmtree(folder)
+
+    def test_empty_nested(self):
+        """Missing or empty nested properties add no features."""
+        spot = make_spot(1, samples=[], trace={})
+        self.assertEqual(len(SpotFlattener().flatten_all([spot])), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
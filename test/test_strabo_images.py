@@ -0,0 +1,249 @@
+# coding=utf-8
+"""StraboSpot image download test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'egbunse@gmail.com'
+__date__ = '2017-06-15'
+__copyright__ = 'Copyright 2017, Emily Bunse - University of Kansas'
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import piexif
+from PIL import Image
+
+from strabo_cache import ImageStore
+from strabo_client import StraboClient
+from strabo_images import ImageDownloader, ImageManifest, ImagePool, GeotagPool, SKIP, VERIFY, DOWNLOADED, SKIPPED, MATCHED, FAILED, \
+    MISSING, CORRUPT
+
+from utilities import StraboTestServer
+
+IMAGE = b'\xff\xd8\xff\xe0' + os.urandom(50000) + b'\xff\xd9'
+
+
+class ImageDownloaderTest(unittest.TestCase):
+    """Test image transfers retry, resume and report failures."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.folder = tempfile.mkdtemp()
+        self.ranges = []
+        self.calls = {'busy': 0}
+
+        def dropped(handler):
+            # Send half the image then drop the connection, honour Range on the retry
+            requested = handler.headers.get('Range')
+            self.ranges.append(requested)
+            if requested:
+                start = int(requested.split('=')[1].rstrip('-'))
+                return 206, IMAGE[start:], {'Content-Range': 'bytes %d-%d/%d' % (start, len(IMAGE) - 1, len(IMAGE))}
+            handler.send_response(200)
+            handler.send_header('Content-Length', str(len(IMAGE)))
+            handler.end_headers()
+            handler.wfile.write(IMAGE[:20000])
+            handler.close_connection = True
+            return None
+
+        def busy(handler):
+            self.calls['busy'] += 1
+            if self.calls['busy'] < 3:
+                return 503, b'busy'
+            return 200, IMAGE
+
+        self.server = StraboTestServer({'/db/image/1': (200, IMAGE),
+                                        '/db/image/5': (200, IMAGE, {'ETag': '"' + hashlib.md5(IMAGE).hexdigest() + '"'}),
+                                        '/db/image/2': dropped,
+                                        '/db/image/3': busy})
+        self.client = StraboClient(base_url=self.server.url)
+        self.delays = []
+        self.downloader = ImageDownloader(self.client, retries=3, backoff=0.5, sleep=self.delays.append)
+
+    def tearDown(self):
+        """Runs after each test."""
+        self.client.close()
+        self.server.close()
+        shutil.rmtree(self.folder)
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_download(self):
+        """Test a plain image download."""
+        path = os.path.join(self.folder, '1.jpeg')
+        self.assertTrue(self.downloader.download(self.server.url + '/db/image/1', path, 1))
+        self.assertEqual(self.read(path), IMAGE)
+        self.assertFalse(os.path.exists(path + '.part'))
+
+    def test_resume(self):
+        """Test a dropped transfer is resumed from the partial file."""
+        path = os.path.join(self.folder, '2.jpeg')
+        self.assertTrue(self.downloader.download(self.server.url + '/db/image/2', path, 2))
+        self.assertEqual(self.read(path), IMAGE)
+        # Whatever whole chunks arrived before the drop are not fetched again
+        self.assertEqual(len(self.ranges), 2)
+        self.assertIsNone(self.ranges[0])
+        self.assertTrue(0 < int(self.ranges[1][6:-1]) <= 20000)
+
+    def test_backoff(self):
+        """Test busy responses are retried with a growing delay."""
+        path = os.path.join(self.folder, '3.jpeg')
+        self.assertTrue(self.downloader.download(self.server.url + '/db/image/3', path, 3))
+        self.assertEqual(self.delays, [0.5, 1.0])
+
+    def test_failures(self):
+        """Test a missing image is not retried and is reported."""
+        path = os.path.join(self.folder, '4.jpeg')
+        self.assertFalse(self.downloader.download(self.server.url + '/db/image/4', path, 4))
+        self.assertEqual(self.delays, [])
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.downloader.summary(), ['Image with id: 4 not downloaded (HTTP 404)'])
+
+    def test_pool(self):
+        """Test queued images are downloaded on worker threads and each one is reported."""
+        reports = []
+        lock = threading.Lock()
+
+        def notify(*result):
+            with lock:
+                reports.append(result)
+
+        pool = ImagePool(self.downloader, workers=3, notify=notify)
+        for imageid in (1, 2, 3, 4):
+            path = os.path.join(self.folder, str(imageid) + '.jpeg')
+            pool.submit(self.server.url + '/db/image/' + str(imageid), path, imageid, ('point', imageid))
+        pool.wait()
+        pool.close()
+        self.assertEqual(pool.threads, [])
+        self.assertEqual(sorted(report[0] for report in reports), [1, 2, 3, 4])
+        self.assertEqual(max(report[1] for report in reports), 4)
+        downloaded = dict((report[2], report[4]) for report in reports)
+        self.assertEqual(downloaded, {1: DOWNLOADED, 2: DOWNLOADED, 3: DOWNLOADED, 4: FAILED})
+        self.assertEqual(sorted(report[5] for report in reports), [('point', i) for i in (1, 2, 3, 4)])
+        for imageid in (1, 2, 3):
+            self.assertEqual(self.read(os.path.join(self.folder, str(imageid) + '.jpeg')), IMAGE)
+        self.assertEqual(self.downloader.summary(), ['Image with id: 4 not downloaded (HTTP 404)'])
+
+    def test_store(self):
+        """Test an image downloaded once is taken from the image store the next time."""
+        store = ImageStore(os.path.join(self.folder, 'store'))
+        downloader = ImageDownloader(self.client, store=store)
+        first = os.path.join(self.folder, 'first', '1.jpeg')
+        second = os.path.join(self.folder, 'second', '1.jpeg')
+        os.makedirs(os.path.dirname(first))
+        os.makedirs(os.path.dirname(second))
+        self.assertTrue(downloader.download(self.server.url + '/db/image/1', first, 1))
+        self.assertTrue(downloader.download(self.server.url + '/db/image/1', second, 1))
+        self.assertEqual(self.read(second), IMAGE)
+        self.assertEqual(downloader.stored, 1)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_skip(self):
+        """Test an image still as it was written is skipped, a changed one is downloaded again."""
+        manifest = ImageManifest()
+        downloader = ImageDownloader(self.client, mode=SKIP, manifest=manifest, thorough=True)
+        path = os.path.join(self.folder, '1.jpeg')
+        self.assertEqual(downloader.fetch(self.server.url + '/db/image/1', path, 1), DOWNLOADED)
+        manifest.record(path)
+        manifest.save()
+        downloader.manifest = ImageManifest()
+        self.assertEqual(downloader.fetch(self.server.url + '/db/image/1', path, 1), SKIPPED)
+        with open(path, 'r+b') as f:
+            f.write(b'\x00')
+        self.assertEqual(downloader.fetch(self.server.url + '/db/image/1', path, 1), DOWNLOADED)
+        self.assertEqual(self.read(path), IMAGE)
+        self.assertEqual(self.server.methods, ['GET', 'GET'])
+
+    def test_skip_without_manifest(self):
+        """Test an image the manifest doesn't know is compared with the server's Content-Length and ETag."""
+        downloader = ImageDownloader(self.client, mode=SKIP, manifest=ImageManifest(), thorough=True)
+        path = os.path.join(self.folder, '5.jpeg')
+        with open(path, 'wb') as f:
+            f.write(IMAGE)
+        self.assertEqual(downloader.fetch(self.server.url + '/db/image/5', path, 5), MATCHED)
+        self.assertEqual(downloader.skipped, 1)
+        with open(path, 'r+b') as f:
+            f.write(b'\x00')
+        self.assertEqual(downloader.fetch(self.server.url + '/db/image/5', path, 5), DOWNLOADED)
+        self.assertEqual(self.server.methods, ['HEAD', 'HEAD', 'GET'])
+
+    def test_matched_geotagged(self):
+        """Test a jpeg kept because it matches the server is geotagged and then skipped by the manifest."""
+        manifest = ImageManifest()
+        downloader = ImageDownloader(self.client, mode=SKIP, manifest=manifest)
+        path = os.path.join(self.folder, '7.jpeg')
+        Image.new('RGB', (16, 16)).save(path, 'jpeg')
+        with open(path, 'rb') as f:
+            content = f.read()
+        self.server.routes['/db/image/7'] = (200, content)
+        self.assertEqual(downloader.fetch(self.server.url + '/db/image/7', path, 7), MATCHED)
+        pool = GeotagPool(workers=1, manifest=manifest)
+        pool.submit(path, (-97.5, 38.9), 7)
+        pool.wait()
+        pool.close()
+        with open(path, 'rb') as f:
+            self.assertIn(piexif.GPSIFD.GPSLatitude, piexif.load(f.read())['GPS'])
+        self.assertEqual(downloader.fetch(self.server.url + '/db/image/7', path, 7), SKIPPED)
+        self.assertEqual(self.server.methods, ['HEAD'])
+
+    def test_verify(self):
+        """Test verify mode reports missing and corrupt images without downloading them."""
+        downloader = ImageDownloader(self.client, mode=VERIFY, manifest=ImageManifest())
+        good = os.path.join(self.folder, '1.jpeg')
+        with open(good, 'wb') as f:
+            f.write(IMAGE)
+        short = os.path.join(self.folder, '5.jpeg')
+        with open(short, 'wb') as f:
+            f.write(IMAGE[:100])
+        missing = os.path.join(self.folder, '6.jpeg')
+        self.assertEqual(downloader.fetch(self.server.url + '/db/image/1', good, 1), SKIPPED)
+        self.assertEqual(downloader.fetch(self.server.url + '/db/image/5', short, 5), CORRUPT)
+        self.assertEqual(downloader.fetch(self.server.url + '/db/image/6', missing, 6), MISSING)
+        self.assertNotIn('GET', self.server.methods)
+        self.assertEqual(downloader.summary(), ['Image with id: 5 is corrupt: ' + short,
+                                                'Image with id: 6 is missing: ' + missing])
+
+    def test_geotag_pool(self):
+        """Test jpegs are geotagged on the pool and the ones that can't be are reported."""
+        paths = []
+        for name in ('1.jpeg', '2.jpeg', '3.jpeg'):
+            path = os.path.join(self.folder, name)
+            Image.new('RGB', (16, 16)).save(path, 'jpeg')
+            paths.append(path)
+        broken = os.path.join(self.folder, '4.jpeg')
+        with open(broken, 'wb') as f:
+            f.write(b'not a jpeg')
+        reports = []
+        manifest = ImageManifest()
+        pool = GeotagPool(workers=2, manifest=manifest, notify=lambda *result: reports.append(result))
+        pool.submit(paths[0], (-97.5, 38.9), 1)
+        pool.submit(paths[1], (10.0, -20.0), 2)
+        pool.submit(paths[2], (float('nan'), float('nan')), 3)
+        pool.submit(broken, (1.0, 1.0), 4)
+        pool.wait()
+        pool.close()
+        self.assertEqual(sorted((report[2], report[4]) for report in reports),
+                         [(1, True), (2, True), (3, False), (4, False)])
+        with open(paths[1], 'rb') as f:
+            exif = piexif.load(f.read())
+        self.assertEqual(exif['GPS'][piexif.GPSIFD.GPSLatitudeRef], b'S')
+        self.assertIsNotNone(manifest.lookup(paths[0]))
+        self.assertIsNone(manifest.lookup(paths[2]))
+        summary = sorted(pool.summary())
+        self.assertEqual(len(summary), 2)
+        self.assertTrue(summary[0].startswith('Image with id: 3 not geotagged (the Spot has no coordinates)'))
+        self.assertTrue(summary[1].startswith('Image with id: 4 not geotagged (not a JPEG file)'))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+# coding=utf-8
+"""StraboSpot listing prefetch test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'egbunse@gmail.com'
+__date__ = '2017-06-15'
+__copyright__ = 'Copyright 2017, Emily Bunse - University of Kansas'
+
+import json
+import unittest
+
+from strabo_cache import ListingCache
+from strabo_client import StraboClient
+
+from utilities import StraboTestServer
+
+
+def listing(key, items):
+    return 200, json.dumps({key: items}).encode('utf-8')
+
+
+class ListingCacheTest(unittest.TestCase):
+    """Test project and dataset lists are fetched in the background."""
+
+    def setUp(self):
+        """Runs before each test."""
+        projects = [{'id': 1, 'name': 'Alps'}, {'id': 2, 'name': 'Kansas'}]
+        self.server = StraboTestServer({
+            '/db/myProjects': listing('projects', projects),
+            '/db/projectDatasets/1': listing('datasets', [{'id': 11, 'name': 'Day 1'}]),
+            '/db/projectDatasets/2': listing('datasets', [{'id': 21, 'name': 'Day 2'}])})
+        self.client = StraboClient(base_url=self.server.url)
+        self.listings = ListingCache(self.client)
+
+    def tearDown(self):
+        """Runs after each test."""
+        self.client.close()
+        self.server.close()
+
+    def test_prefetch(self):
+        """Test every listing is in memory once the prefetch is done."""
+        self.listings.prefetch()
+        self.assertTrue(self.listings.wait(10))
+        self.assertEqual([prj['name'] for prj in self.listings.projects()], ['Alps', 'Kansas'])
+        self.assertEqual(self.listings.datasets(2), [{'id': 21, 'name': 'Day 2'}])
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_wait_for(self):
+        """Test waiting on one listing returns it once it is in, and None without a prefetch."""
+        self.assertIsNone(self.listings.wait_for(self.listings.projects, 10))
+        events = []
+        self.listings.prefetch()
+        projects = self.listings.wait_for(self.listings.projects, 10, lambda: events.append(1))
+        self.assertEqual([prj['id'] for prj in projects], [1, 2])
+        self.assertEqual(self.listings.wait_for(lambda: self.listings.datasets(1), 10), [{'id': 11, 'name': 'Day 1'}])
+
+    def test_clear(self):
+        """Test clearing (logout) forgets the listings."""
+        self.listings.prefetch()
+        self.listings.wait(10)
+        self.listings.clear()
+        self.assertIsNone(self.listings.projects())
+        self.assertIsNone(self.listings.datasets(1))
+        self.listings.set_datasets(1, [])
+        self.assertEqual(self.listings.datasets(1), [])
+
+if __name__ == "__main__":
+    unittest.main()
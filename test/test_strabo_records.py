@@ -0,0 +1,63 @@
+# coding=utf-8
+"""StraboSpot flattened feature records test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'egbunse@gmail.com'
+__date__ = '2017-06-15'
+__copyright__ = 'Copyright 2017, Emily Bunse - University of Kansas'
+
+import pickle
+import unittest
+
+from strabo_records import FieldNames, SpotRecord, ChildRecord, GeoJSONRecord
+
+POINT = {'type': 'Point', 'coordinates': [-97.5, 38.9]}
+
+
+class StraboRecordsTest(unittest.TestCase):
+    """Test the compact feature records."""
+
+    def test_spot_record(self):
+        """A spot record keeps only the basic spot fields."""
+        record = SpotRecord(POINT, {'id': 1, 'modified_timestamp': 2, 'time': 't', 'date': 'd', 'self': 's',
+                                    'name': 'ignored'})
+        self.assertEqual(record.to_geojson(), {'type': 'Feature', 'geometry': POINT, 'properties': {
+            'id': 1, 'modified_timestamp': 2, 'time': 't', 'date': 'd', 'self': 's'}})
+        self.assertFalse(hasattr(record, '__dict__'))
+
+    def test_child_record(self):
+        """A child record renames its source fields as they are read and adds SpotID."""
+        fields = FieldNames(prefix='tag_', skip=('spots',))
+        tag = {'id': 7, 'spots': [1]}
+        record = ChildRecord(None, tag, fields, 1)
+        self.assertEqual(record.properties(), {'tag_id': 7, 'SpotID': 1})
+        record.set('path', 'a.jpeg')
+        self.assertEqual(record.get('path'), 'a.jpeg')
+        self.assertEqual(record.get('tag_id'), 7)
+        self.assertIs(record.source, tag)
+
+    def test_geojson_record(self):
+        """A GeoJSON feature read back compares equal to the record it was written from."""
+        record = ChildRecord(POINT, {'dip': 10}, FieldNames(suffix='_orientation_data'), 1)
+        copy = GeoJSONRecord(record.to_geojson())
+        self.assertEqual(copy, record)
+        copy.set('SpotID', 2)
+        self.assertNotEqual(copy, record)
+
+    def test_pickle(self):
+        """Records survive the trip to and from a flattening process."""
+        fields = FieldNames(suffix='_samples')
+        records = [SpotRecord(POINT, {'id': 1}), ChildRecord(POINT, {'label': 's1'}, fields, 1)]
+        records[1].set('path', 'x')
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            self.assertEqual(pickle.loads(pickle.dumps(records, protocol)), records)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+# coding=utf-8
+"""StraboSpot spot collection helpers test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'egbunse@gmail.com'
+__date__ = '2017-06-15'
+__copyright__ = 'Copyright 2017, Emily Bunse - University of Kansas'
+
+import json
+import unittest
+
+from strabo_spots import split_by_geometry
+from strabo_stream import FeatureStream
+
+
+def make_spot(spotid, geometry):
+    return {'type': 'Feature', 'geometry': geometry,
+            'properties': {'id': spotid, 'modified_timestamp': 1500000000000,
+                           'time': '', 'date': '', 'self': ''}}
+
+
+POINT = {'type': 'Point', 'coordinates': [-97.5, 38.9]}
+LINE = {'type': 'LineString', 'coordinates': [[-97.5, 38.9], [-97.4, 38.8]]}
+POLYGON = {'type': 'Polygon', 'coordinates': [[[-97.5, 38.9], [-97.4, 38.8], [-97.3, 38.9], [-97.5, 38.9]]]}
+
+
+class SplitByGeometryTest(unittest.TestCase):
+    """Test the full dataset response is partitioned by geometry type."""
+
+    def test_split(self):
+        """Test each spot lands in the collection for its geometry."""
+        response = {'type': 'FeatureCollection',
+                    'features': [make_spot(1, POINT), make_spot(2, LINE),
+                                 make_spot(3, POLYGON), make_spot(4, POINT),
+                                 make_spot(5, None)]}
+        collections = split_by_geometry(response)
+        self.assertEqual(sorted(collections), ['line', 'point', 'polygon'])
+        ids = dict((geotype, [spot['properties']['id'] for spot in collections[geotype]['features']])
+                   for geotype in collections)
+        self.assertEqual(ids, {'point': [1, 4], 'line': [2], 'polygon': [3]})
+        self.assertEqual(collections['point']['type'], 'FeatureCollection')
+
+    def test_split_stream(self):
+        """Test spots can be partitioned straight off the streamed body."""
+        body = json.dumps({'type': 'FeatureCollection',
+                           'features': [make_spot(1, LINE), make_spot(2, POINT)]}).encode('utf-8')
+        collections = split_by_geometry(FeatureStream([body[:10], body[10:]]))
+        self.assertEqual(sorted(collections), ['line', 'point'])
+        self.assertEqual(collections['line']['features'][0]['properties']['id'], 1)
+
+    def test_missing_geometry_types(self):
+        """Test geometry types without spots are left out."""
+        self.assertEqual(list(split_by_geometry({'features': [make_spot(1, POINT)]})), ['point'])
+        self.assertEqual(split_by_geometry(None), {})
+
+if __name__ == "__main__":
+    unittest.main()
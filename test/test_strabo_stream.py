@@ -0,0 +1,143 @@
+# coding=utf-8
+"""StraboSpot streaming GeoJSON reader test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'egbunse@gmail.com'
+__date__ = '2017-06-15'
+__copyright__ = 'Copyright 2017, Emily Bunse - University of Kansas'
+
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from strabo_cache import ResponseCache
+from strabo_client import StraboClient
+from strabo_stream import BodyStream, FeatureStream, save_body, file_chunks
+
+from utilities import StraboTestServer
+
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+FEATURES = [
+    {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [-97.5, 38.9]},
+     'properties': {'id': 1, 'name': u'Outcrop {north} [A]', 'notes': u'strike \\ dip "quoted" °',
+                    'orientation_data': [{'strike': 10, 'dip': 45}]}},
+    {'type': 'Feature', 'geometry': {'type': 'LineString', 'coordinates': [[-97.5, 38.9], [-97.4, 38.8]]},
+     'properties': {'id': 2, 'trace': {'trace_type': 'contact'}, 'features': []}},
+]
+
+
+class FeatureStreamTest(unittest.TestCase):
+    """Test features are parsed one at a time from chunks of the body."""
+
+    def test_features(self):
+        """Test every chunk size gives the same features as json.loads."""
+        body = json.dumps({'type': 'FeatureCollection', 'features': FEATURES,
+                           'after': {'features': [1]}}, ensure_ascii=False).encode('utf-8')
+        for size in (1, 2, 7, 64, len(body)):
+            stream = FeatureStream(chunked(body, size))
+            self.assertEqual(list(stream), FEATURES)
+            self.assertEqual(stream.count, 2)
+            self.assertEqual(stream.bytes_read, len(body))
+
+    def test_features_key_after_other_keys(self):
+        """Test nested 'features' keys before the top-level one are ignored."""
+        body = json.dumps({'meta': {'features': [{'nope': 1}]}, 'features': FEATURES[1:]}).encode('utf-8')
+        self.assertEqual(list(FeatureStream(chunked(body, 5))), FEATURES[1:])
+
+    def test_tee(self):
+        """Test the raw body is written out untouched while parsing."""
+        body = json.dumps({'type': 'FeatureCollection', 'features': FEATURES}).encode('utf-8')
+        raw = io.BytesIO()
+        self.assertEqual(len(list(FeatureStream(chunked(body, 3), tee=raw))), 2)
+        self.assertEqual(raw.getvalue(), body)
+
+    def test_null_response(self):
+        """Test a null body yields nothing."""
+        raw = io.BytesIO()
+        self.assertEqual(list(FeatureStream([b'nu', b'll'], tee=raw)), [])
+        self.assertEqual(raw.getvalue(), b'null')
+
+    def test_truncated(self):
+        """Test a body cut off inside the features raises."""
+        body = json.dumps({'features': FEATURES}).encode('utf-8')[:-20]
+        self.assertRaises(ValueError, list, FeatureStream(chunked(body, 16)))
+
+
+def gzipped(data):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as zipped:
+        zipped.write(data)
+    return buf.getvalue()
+
+
+class BodyStreamTest(unittest.TestCase):
+    """Test compressed bodies are decoded as a stream and measured."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.body = json.dumps({'type': 'FeatureCollection', 'features': FEATURES * 200}).encode('utf-8')
+        self.compressed = gzipped(self.body)
+
+        def spots(handler):
+            self.accept = handler.headers.get('Accept-Encoding')
+            return 200, self.compressed, {'Content-Encoding': 'gzip'}
+
+        self.server = StraboTestServer({'/db/datasetspotsarc/1': spots})
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Runs after each test."""
+        self.server.close()
+        shutil.rmtree(self.folder)
+
+    def check_stream(self, client):
+        raw = io.BytesIO()
+        body = BodyStream(client.get('db/datasetspotsarc/1', cache=True), chunk_size=1024)
+        self.assertEqual(len(list(FeatureStream(body, tee=raw))), 400)
+        self.assertEqual(raw.getvalue(), self.body)
+        self.assertEqual(body.decoded_bytes, len(self.body))
+        self.assertEqual(body.wire_bytes, len(self.compressed))
+        self.assertEqual(body.encoding, 'gzip')
+        client.close()
+
+    def test_gzip(self):
+        """Test gzip is negotiated and counted before and after decoding."""
+        self.check_stream(StraboClient(base_url=self.server.url))
+        self.assertIn('gzip', self.accept)
+
+    def test_gzip_cached(self):
+        """Test the cache stores the decoded body while counting the compressed one."""
+        client = StraboClient(base_url=self.server.url, cache=ResponseCache(self.folder))
+        self.check_stream(client)
+        cached = client.cache.response(client.url('db/datasetspotsarc/1'), None)
+        self.assertEqual(cached.content, self.body)
+        cached.close()
+
+    def test_save_body(self):
+        """Test a body saved to disk is decoded and parsed back from the file."""
+        client = StraboClient(base_url=self.server.url)
+        path = os.path.join(self.folder, 'dataset_1.json')
+        body = save_body(client.get('db/datasetspotsarc/1', stream=True), path)
+        self.assertEqual(body.decoded_bytes, len(self.body))
+        self.assertEqual(len(list(FeatureStream(file_chunks(path, chunk_size=1024)))), 400)
+        missing = save_body(client.get('db/datasetspotsarc/2', stream=True), os.path.join(self.folder, 'missing.json'))
+        self.assertEqual(missing.response.status_code, 404)
+        self.assertFalse(os.path.exists(os.path.join(self.folder, 'missing.json')))
+        client.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+# coding=utf-8
+"""StraboSpot columnar feature table test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'egbunse@gmail.com'
+__date__ = '2017-06-15'
+__copyright__ = 'Copyright 2017, Emily Bunse - University of Kansas'
+
+import io
+import json
+import unittest
+
+import numpy
+
+from strabo_table import FeatureTable
+
+POINT = {'type': 'Point', 'coordinates': [-97.5, 38.9]}
+LINE = {'type': 'LineString', 'coordinates': [[-97.5, 38.9, 300.0], [-97.4, 38.8, 310.0]]}
+POLYGON = {'type': 'MultiPolygon', 'coordinates': [[[[-97.5, 38.9], [-97.4, 38.8], [-97.3, 38.9], [-97.5, 38.9]]],
+                                                   [[[-96.0, 38.0], [-96.1, 38.1], [-96.0, 38.1], [-96.0, 38.0]]]]}
+COLLECTION = {'type': 'GeometryCollection', 'geometries': [POINT]}
+
+
+def feature(geometry, **properties):
+    return {'type': 'Feature', 'geometry': geometry, 'properties': properties}
+
+
+class StraboTableTest(unittest.TestCase):
+    """Test storing features in columns and reading them back."""
+
+    def test_round_trip(self):
+        """Features come back out as they went in."""
+        features = [feature(POINT, id=1, name='a', strike=10.5, planar=True, extra=None),
+                    feature(LINE, id=2, name='b', labels=['x', 'y']),
+                    feature(POLYGON, id=3, name='a', strike=20),
+                    feature(COLLECTION, id=4),
+                    feature(None, id=5, name=u'é')]
+        table = FeatureTable()
+        for f in features:
+            table.append(f)
+        self.assertEqual(len(table), 5)
+        self.assertEqual(list(table), features)
+
+    def test_typed_columns(self):
+        """Numbers are NumPy arrays and strings are dictionary encoded."""
+        table = FeatureTable()
+        for i in range(100):
+            table.append(feature(POINT, id=i, dip=float(i) / 2, unit='Kd' if i % 2 else 'Qal'))
+        self.assertEqual(table.column('id').dtype, numpy.int64)
+        self.assertEqual(table.column('dip').dtype, numpy.float64)
+        self.assertEqual(table.column('unit').dtype, numpy.int32)
+        self.assertEqual(table.columns['unit'].categories, ['Qal', 'Kd'])
+
+    def test_widening(self):
+        """A column widens from int to float and falls back to objects on mixed types."""
+        table = FeatureTable()
+        for value in (1, 2.5):
+            table.append(feature(POINT, dip=value, mixed=value))
+        table.append(feature(POINT, mixed='steep'))
+        self.assertEqual(table.columns['dip'].kind, 'float')
+        self.assertEqual(table.columns['mixed'].kind, 'object')
+        self.assertEqual([f['properties'] for f in table],
+                         [{'dip': 1.0, 'mixed': 1}, {'dip': 2.5, 'mixed': 2.5}, {'mixed': 'steep'}])
+
+    def test_schema(self):
+        """Field types are known as soon as the features are appended."""
+        table = FeatureTable()
+        table.append(feature(POINT, id=1, time='2017-06-15T10:00:00.000Z', name='a', dip=1, planar=True,
+                             labels=['x'], notes=None))
+        table.append(feature(POINT, id=2, time='2017-06-16T10:00:00Z', name='b', dip=2.5, planar=False))
+        self.assertEqual(dict(table.schema()), {'id': 'Integer64', 'time': 'DateTime', 'name': 'String',
+                                                'dip': 'Real', 'planar': 'Boolean', 'labels': 'String',
+                                                'notes': 'String'})
+        table.append(feature(POINT, time='not recorded'))
+        self.assertEqual(dict(table.schema())['time'], 'String')
+
+    def test_shared_geometry(self):
+        """Consecutive features sharing a geometry store its coordinates once."""
+        table = FeatureTable()
+        for i in range(10):
+            table.append(feature(POINT, SpotID=1))
+        self.assertEqual(len(table.geometry_type), 1)
+        self.assertEqual(table.coordinates().tolist(), [[-97.5, 38.9]])
+
+    def test_write_geojson(self):
+        """The table is written as a FeatureCollection."""
+        table = FeatureTable()
+        table.append(feature(POINT, id=1))
+        out = io.StringIO()
+        table.write_geojson(out)
+        self.assertEqual(json.loads(out.getvalue()),
+                         {'type': 'FeatureCollection', 'features': [feature(POINT, id=1)]})
+
+
+if __name__ == "__main__":
+    unittest.main()
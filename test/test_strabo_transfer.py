@@ -0,0 +1,104 @@
+# coding=utf-8
+"""StraboSpot transfer engine test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'egbunse@gmail.com'
+__date__ = '2017-06-15'
+__copyright__ = 'Copyright 2017, Emily Bunse - University of Kansas'
+
+import threading
+import time
+import unittest
+
+from strabo_client import ConcurrencyController, StraboClient
+from strabo_transfer import TransferEngine
+
+from utilities import StraboTestServer
+
+
+class TransferEngineTest(unittest.TestCase):
+    """Test many requests are kept in flight against a stand-in server."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.state = {'active': 0, 'peak': 0}
+        lock = threading.Lock()
+
+        def slow(handler):
+            with lock:
+                self.state['active'] += 1
+                self.state['peak'] = max(self.state['peak'], self.state['active'])
+            time.sleep(0.2)
+            with lock:
+                self.state['active'] -= 1
+            return 200, handler.path.encode('utf-8')
+
+        self.paths = ['/db/image/%d' % i for i in range(40)]
+        routes = dict((path, slow) for path in self.paths)
+        routes['/db/project/1'] = (200, b'{"id": 1}')
+        self.server = StraboTestServer(routes)
+        self.client = StraboClient(base_url=self.server.url, pool_size=2,
+                                   controller=ConcurrencyController(initial=20))
+        self.events = []
+        self.engine = TransferEngine(self.client, max_in_flight=20,
+                                     process_events=lambda: self.events.append(1))
+
+    def tearDown(self):
+        """Runs after each test."""
+        self.engine.close()
+        self.client.close()
+        self.server.close()
+
+    def test_in_flight(self):
+        """Test requests overlap up to the limit and every result arrives."""
+        results = dict(self.engine.fetch_all([(path, path) for path in self.paths]))
+        self.assertEqual(sorted(results), sorted(self.paths))
+        self.assertEqual(results['/db/image/7'].text, '/db/image/7')
+        self.assertTrue(10 < self.state['peak'] <= 20)
+        self.assertEqual(self.client.pool_size, 20)
+        self.assertEqual(self.engine.pending, 0)
+
+    def test_event_loop(self):
+        """Test the event loop keeps running while requests are outstanding."""
+        list(self.engine.fetch_all([(path, path) for path in self.paths[:5]]))
+        self.assertTrue(len(self.events) > 0)
+
+    def test_reuse(self):
+        """Test the engine can run one batch after another."""
+        self.engine.submit('project', 'db/project/1')
+        self.assertEqual([(key, r.json()) for key, r in self.engine.completed()], [('project', {'id': 1})])
+        self.assertEqual(len(list(self.engine.fetch_all([(path, path) for path in self.paths[:2]]))), 2)
+        self.state['peak'] = 0
+        self.assertEqual(len(list(self.engine.fetch_all([(path, path) for path in self.paths[:12]]))), 12)
+        self.assertTrue(self.state['peak'] > 2)
+
+    def test_abandoned(self):
+        """Test the rest of a batch left part way is not handed to the next one."""
+        batch = self.engine.fetch_all([('old', path) for path in self.paths[:4]])
+        self.assertEqual(next(batch)[0], 'old')
+        batch.close()
+        results = list(self.engine.fetch_all([('new', 'db/project/1')]))
+        self.assertEqual([key for key, r in results], ['new'])
+        self.assertEqual(self.engine.pending, 0)
+
+    def test_consume(self):
+        """Test a response can be consumed on the worker, its result is what is yielded."""
+        results = dict(self.engine.fetch_all([(path, path) for path in self.paths[:3]],
+                                             consume=lambda r: r.content.decode('utf-8')))
+        self.assertEqual(results['/db/image/1'], '/db/image/1')
+
+    def test_error(self):
+        """Test a failed request is raised on the caller's thread."""
+        self.server.close()
+        self.engine.submit('project', 'db/project/1', timeout=1)
+        self.assertRaises(Exception, list, self.engine.completed())
+        self.server = StraboTestServer({})
+
+if __name__ == "__main__":
+    unittest.main()
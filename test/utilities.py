@@ -59,3 +59,73 @@ def get_qgis_app():
         IFACE = QgisInterface(CANVAS)
 
     return QGIS_APP, CANVAS, IFACE, PARENT
+
+
+class StraboTestServer(object):
+    """Local stand-in for strabospot.org used by the network tests.
+
+    routes maps a path to a (status, body[, headers]) tuple or to a callable
+    taking the request handler and returning one (or None once it has
+    written its own response).  Every request path is recorded in
+    self.requests and its method in self.methods.
+    """
+
+    def __init__(self, routes):
+        try:
+            from http.server import BaseHTTPRequestHandler, HTTPServer
+            from socketserver import ThreadingMixIn
+        except ImportError:  # Python 2
+            from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+            from SocketServer import ThreadingMixIn
+        import threading
+
+        server = self
+        self.routes = routes
+        self.requests = []
+        self.methods = []
+        self.lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self.respond(True)
+
+            def do_HEAD(self):
+                self.respond(False)
+
+            def respond(self, send_body):
+                with server.lock:
+                    server.requests.append(self.path)
+                    server.methods.append(self.command)
+                route = server.routes.get(self.path, (404, b''))
+                if callable(route):
+                    route = route(self)
+                    if route is None:
+                        return
+                status, body = route[0], route[1]
+                headers = route[2] if len(route) > 2 else {}
+                self.send_response(status)
+                for key in headers:
+                    self.send_header(key, headers[key])
+                if 'Content-Length' not in headers:
+                    self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if send_body:
+                    self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        self.httpd = Server(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()